@@ -80,3 +80,17 @@ def customer_webhook_handler(event, event_data, event_type, event_subtype):
 
     if not subscriber.has_address:
         subscriber.read_address_from_stripe_object(object_data)
+
+
+@webhooks.handler(['customer', 'invoice'])
+def subscription_state_webhook_handler(event, event_data, event_type,
+                                       event_subtype):
+    """
+    subscription or payment state might have changed, drop cached
+    subscription state of subscriber
+    """
+
+    subscriber = event.customer and event.customer.subscriber
+
+    if subscriber:
+        subscriber.invalidate_subscription_state()
@@ -1,10 +1,12 @@
 
 import re
 
+from django.core.cache import cache
 from django.shortcuts import redirect, resolve_url
 # django 1.10
 # from django.utils.deprecation import MiddlewareMixin
 
+from shareholder.models import Company
 from utils.session import get_company_from_request
 
 
@@ -23,19 +25,29 @@ class CompanySubscriptionRequired(object):
         r'^statements/',
    ]
 
+    def __init__(self):
+        self.blacklist = [re.compile(url) for url in self.BLACKLIST_URLS]
+
     def process_request(self, request):
 
         path = request.path.lstrip('/')
 
         if (request.user.is_authenticated() and
-                any(re.compile(m).match(path) for m in self.BLACKLIST_URLS)):
+                any(pattern.match(path) for pattern in self.blacklist)):
             # check if any companies have no active subscription
-            company = get_company_from_request(request, fail_silently=True)
-            if company:
-                customer = company.get_customer()
-                if customer and not customer.has_active_subscription():
-                    redirect_url = resolve_url(
-                        'djstripe:subscribe',
-                        **dict(company_id=company.pk)
-                    )
-                    return redirect(redirect_url)
+            company_pk = (hasattr(request, 'session') and
+                          request.session.get('company_pk'))
+            if not company_pk:
+                return
+
+            state = cache.get(Company.get_subscription_cache_key(company_pk))
+            if state is None:
+                company = get_company_from_request(request)
+                state = company.get_subscription_state()
+
+            if not state['active']:
+                redirect_url = resolve_url(
+                    'djstripe:subscribe',
+                    **dict(company_id=company_pk)
+                )
+                return redirect(redirect_url)
@@ -57,7 +57,7 @@ class SubscriptionMixin(object):
                 subscriber_model))
 
         if not features:
-            return subscriber.get_customer().has_active_subscription()
+            return subscriber.get_subscription_state()['active']
 
         if not (isinstance(features, list) or isinstance(features, set) or
                 isinstance(features, tuple)):
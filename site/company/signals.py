@@ -0,0 +1,14 @@
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from djstripe.models import CurrentSubscription
+
+
+@receiver(post_save, sender=CurrentSubscription)
+@receiver(post_delete, sender=CurrentSubscription)
+def invalidate_subscription_state(sender, instance, **kwargs):
+    """ subscription changed, drop cached state of subscriber """
+    subscriber = instance.customer and instance.customer.subscriber
+    if subscriber:
+        subscriber.invalidate_subscription_state()
@@ -8,7 +8,8 @@ from model_mommy import mommy, random_gen
 
 from ..event_handlers import (invoice_created_webhook_handler,
                               invoice_payment_succeeded_webhook_handler,
-                              customer_webhook_handler)
+                              customer_webhook_handler,
+                              subscription_state_webhook_handler)
 
 
 class StripeWebhookHandlerTestCase(TestCase):
@@ -150,3 +151,29 @@ class StripeWebhookHandlerTestCase(TestCase):
         handler(event, event_data, event_type, event_subtype)
 
         mock_read_address.assert_called()
+
+    def test_subscription_state_webhook_handler(self):
+        handler = subscription_state_webhook_handler
+        event = mommy.make(Event,
+                           stripe_id='evt_{}'.format(
+                               random_gen.gen_uuid().hex[-24:]),
+                           customer=None,
+                           webhook_message=dict(),
+                           validated_message=dict())
+        event_data, event_type, event_subtype = dict(), 'customer', 'updated'
+
+        # no customer
+        self.assertIsNone(
+            handler(event, event_data, event_type, event_subtype)
+        )
+
+        event.customer = self.customer
+        event.save()
+
+        mock_invalidate = MagicMock()
+        event.customer.subscriber.invalidate_subscription_state = (
+            mock_invalidate)
+
+        handler(event, event_data, event_type, event_subtype)
+
+        mock_invalidate.assert_called()
@@ -1,13 +1,18 @@
 # coding=utf-8
 
+import logging
 import mimetypes
 import os
+import tempfile
+import zipfile
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.timezone import now
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .conf import pingen_settings
 from .models import APICall
@@ -17,13 +22,34 @@ PINGEN_API_URL = getattr(settings, 'PINGEN_API_URL',
                          settings.DEBUG and pingen_settings.API_TEST_URL or
                          pingen_settings.API_LIVE_URL)
 
+logger = logging.getLogger(__name__)
+
+_session = None
+
+
+def get_session():
+    """
+    return requests session shared by all api instances of this process, so
+    connections to the api are pooled and reused
+    """
+    global _session
+    if _session is None:
+        pool_size = pingen_settings.API_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        _session = requests.Session()
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
 
 class Pingen(object):
 
-    def __init__(self, token=None):
+    def __init__(self, token=None, session=None):
         self.token = token or getattr(settings, 'PINGEN_API_TOKEN')
         if not self.token:
             raise ImproperlyConfigured('Missing PINGEN_API_TOKEN in settings')
+        self.session = session or get_session()
 
     def get_api_url(self, path, include_token=True):
         """
@@ -42,29 +68,12 @@ class Pingen(object):
 
         return url
 
-    def upload_document(self, doc, send=None, speed=None, color=None,
-                        duplex=None, rightaddress=None, envelope=None):
+    def _get_upload_data(self, send=None, speed=None, color=None,
+                         duplex=None, rightaddress=None, envelope=None):
         """
-        upload a document (PDF or ZIP)
+        return post data for document upload, falling back to settings
         """
-
-        if not doc or not os.path.isfile(doc):
-            raise ValueError(u'Could not find file: {}'.format(doc))
-
-        filename, ext = os.path.splitext(doc)
-
-        mimetype = mimetypes.MimeTypes().guess_type(doc)[0]
-        # NOTE: very simplistic fallback (not bullet proof at all!)
-        mimetype = mimetype or 'application/{}'.format(ext.lstrip('.'))
-
-        files = dict(
-            file=(
-                filename + ext,
-                open(doc, 'rb'),
-                mimetype
-            )
-        )
-        data = dict(
+        return dict(
             send=send is not None and send or pingen_settings.SEND_ON_UPLOAD,
             speed=speed is not None and speed or pingen_settings.SEND_SPEED,
             color=color is not None and color or pingen_settings.SEND_COLOR,
@@ -76,13 +85,30 @@ class Pingen(object):
                       pingen_settings.SEND_ENVELOPE)
         )
 
+    def _upload(self, doc, data):
+        """
+        post document to the api. returns tuple (success, api_call) with the
+        api call log object not yet saved
+        """
+        if not doc or not os.path.isfile(doc):
+            raise ValueError(u'Could not find file: {}'.format(doc))
+
+        filename, ext = os.path.splitext(doc)
+
+        mimetype = mimetypes.MimeTypes().guess_type(doc)[0]
+        # NOTE: very simplistic fallback (not bullet proof at all!)
+        mimetype = mimetype or 'application/{}'.format(ext.lstrip('.'))
+
         # api call
-        start = now()
         url_path = 'document/upload'
         url = self.get_api_url(url_path)
         timeout = pingen_settings.API_TIMEOUT
-        res = requests.post(url, json=data, files=files, timeout=timeout)
-        end = now()
+        with open(doc, 'rb') as f:
+            files = dict(file=(filename + ext, f, mimetype))
+            start = now()
+            res = self.session.post(url, json=data, files=files,
+                                    timeout=timeout)
+            end = now()
 
         if res.status_code == 200:
             res_data = res.json()
@@ -97,8 +123,7 @@ class Pingen(object):
         else:
             success = False
 
-        # store call
-        APICall.objects.create(
+        api_call = APICall(
             url=self.get_api_url(url_path, include_token=False),
             method='post',
             request_headers=res.request.headers,
@@ -112,4 +137,86 @@ class Pingen(object):
             response_text=res.text
         )
 
+        return success, api_call
+
+    def upload_document(self, doc, send=None, speed=None, color=None,
+                        duplex=None, rightaddress=None, envelope=None):
+        """
+        upload a document (PDF or ZIP)
+        """
+        data = self._get_upload_data(
+            send=send, speed=speed, color=color, duplex=duplex,
+            rightaddress=rightaddress, envelope=envelope)
+        success, api_call = self._upload(doc, data)
+
+        # store call
+        api_call.save()
+
+        return success
+
+    def upload_documents(self, docs, max_workers=None, **kwargs):
+        """
+        upload many documents concurrently through the pooled session. returns
+        list of results in the order of `docs`. api calls are stored in bulk.
+        documents which cannot be found are logged and count as failed.
+
+        Keyword arguments are passed on as upload options (see
+        `upload_document`)
+        """
+        if not docs:
+            return []
+
+        data = self._get_upload_data(**kwargs)
+
+        def _upload_doc(doc):
+            try:
+                return self._upload(doc, data)
+            except ValueError:
+                logger.warning('pingen upload skipped, file not found',
+                               extra={'doc': doc})
+                return False, None
+
+        max_workers = max_workers or pingen_settings.BATCH_MAX_WORKERS
+        pool = ThreadPool(min(max_workers, len(docs)))
+        try:
+            results = pool.map(_upload_doc, docs)
+        finally:
+            pool.close()
+            pool.join()
+
+        # store calls
+        APICall.objects.bulk_create(
+            [api_call for success, api_call in results if api_call])
+
+        return [success for success, api_call in results]
+
+    def upload_zip(self, docs, **kwargs):
+        """
+        bundle all documents into one ZIP file and upload it with a single
+        request. pingen handles each PDF inside the ZIP as separate letter.
+
+        Keyword arguments are passed on as upload options (see
+        `upload_document`)
+        """
+        missing = [doc for doc in docs if not doc or not os.path.isfile(doc)]
+        if missing:
+            raise ValueError(u'Could not find files: {}'.format(missing))
+
+        fd, zip_path = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for index, doc in enumerate(docs):
+                    # prefix to keep names unique inside the archive
+                    arcname = u'{}-{}'.format(index, os.path.basename(doc))
+                    zf.write(doc, arcname)
+            success, api_call = self._upload(
+                zip_path, self._get_upload_data(**kwargs))
+        finally:
+            os.remove(zip_path)
+
+        # store call, referencing the bundled files instead of the tmp zip
+        api_call.files = u'\n'.join(docs)
+        api_call.save()
+
         return success
@@ -10,6 +10,8 @@ DEFAULTS = {
     'API_LIVE_URL': 'https://api.pingen.com',
     'API_TEST_URL': 'https://stage-api.pingen.com/',
     'API_TIMEOUT': None,
+    # max number of pooled connections kept open to the api
+    'API_POOL_SIZE': 10,
 
     # documents
     # Defines if a document is merely uploaded or also sent
@@ -23,8 +25,15 @@ DEFAULTS = {
     # Address, If not passed, account default is taken.
     'RIGHT_ADDRESS': 0,  # 0 = address left, 1 = address right
     # Envelope ID of prepared and designed envelope in your account.
-    'SEND_ENVELOPE': 0
-
+    'SEND_ENVELOPE': 0,
+
+    # batch sending
+    # Number of letters handled by one batch task
+    'BATCH_SIZE': 50,
+    # Number of concurrent uploads inside one batch
+    'BATCH_MAX_WORKERS': 4,
+    # Upload all letters of a batch as one ZIP file (one letter per PDF)
+    'BATCH_ZIP_UPLOAD': False,
 }
 
 
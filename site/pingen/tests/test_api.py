@@ -45,7 +45,7 @@ class PingenTestCase(FakeResponseMixin, TestCase):
         url = self.api.get_api_url(path)
         self.assertTrue(url.endswith(path + '/token/' + self.api.token + '/'))
 
-    @mock.patch.object(requests, 'post')
+    @mock.patch.object(requests.Session, 'post')
     def test_upload_document(self, mock_post):
 
         with self.assertRaises(ValueError):
@@ -82,3 +82,39 @@ class PingenTestCase(FakeResponseMixin, TestCase):
         self.assertFalse(self.api.upload_document(doc))
 
         self.assertEqual(APICall.objects.count(), 4)
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_upload_documents(self, mock_post):
+        self.assertEqual(self.api.upload_documents([]), [])
+
+        doc = os.path.join(os.path.dirname(__file__), 'files', 'example.pdf')
+
+        self.fake_response_content = json.dumps(dict(error=False, id=1))
+        mock_post.return_value = self.get_fake_response('post')
+
+        self.assertEqual(APICall.objects.count(), 0)
+
+        # missing file is skipped, not raised
+        self.assertEqual(
+            self.api.upload_documents([doc, 'missing.pdf', doc]),
+            [1, False, 1])
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(APICall.objects.count(), 2)
+
+    @mock.patch.object(requests.Session, 'post')
+    def test_upload_zip(self, mock_post):
+        doc = os.path.join(os.path.dirname(__file__), 'files', 'example.pdf')
+
+        with self.assertRaises(ValueError):
+            self.api.upload_zip([doc, 'missing.pdf'])
+
+        self.fake_response_content = json.dumps(dict(error=False, id=1))
+        mock_post.return_value = self.get_fake_response('post')
+
+        self.assertTrue(self.api.upload_zip([doc, doc]))
+
+        mock_post.assert_called_once()
+        self.assertEqual(APICall.objects.count(), 1)
+        self.assertEqual(APICall.objects.get().files,
+                         u'{}\n{}'.format(doc, doc))
@@ -8,22 +8,30 @@ import logging
 import random
 
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
 from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as __
 from model_mommy import mommy, random_gen
+from rest_framework.authtoken.models import Token
 
 from reports.models import Report
-from shareholder.models import (Company, Country, Operator, OptionPlan,
-                                OptionTransaction, Position, Security,
-                                Shareholder, UserProfile)
-from utils.formatters import inflate_segments
+from shareholder.models import (Company, Country, NumberAllocator, Operator,
+                                OptionPlan, OptionTransaction, Position,
+                                Security, SecurityPrice, Shareholder,
+                                UserProfile)
+from shareholder.tasks import update_order_cache_task
+from utils.formatters import inflate_segments, make_numeric
 from utils.user import make_username
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# rows written per bulk insert by `BulkCompanyGenerator`
+BULK_BATCH_SIZE = 1000
+
 DEFAULT_TEST_DATA = {
     'password': u'testàäå',
     'username': u'testusernameàäå',
@@ -707,3 +715,228 @@ class ComplexOptionTransactionsWithSegmentsGenerator(object):
         positions.append(buy_segment([1050], s, cs))
 
         return positions, shareholders
+
+
+class LargeCompanyGenerator(object):
+
+    def generate(self, **kwargs):
+        """
+        used for benchmarks. company with `shareholder_count` shareholders,
+        each bought a random count of (numbered) shares from the company
+        shareholder. every `vesting_every` position has a vesting and every
+        `options_every` shareholder got options. same data for same `seed`
+        """
+        shareholder_count = kwargs.get('shareholder_count', 1000)
+        shares_per_shareholder = kwargs.get('shares_per_shareholder', 10)
+        track_numbers = kwargs.get('track_numbers', True)
+        vesting_every = kwargs.get('vesting_every', 10)
+        options_every = kwargs.get('options_every', 20)
+        random.seed(kwargs.get('seed', 0))
+
+        counts = [random.randint(1, shares_per_shareholder * 2)
+                  for i in range(0, shareholder_count)]
+        # half of the shares stay with the company as option pool
+        share_count = sum(counts) * 2
+        founded_at = datetime.date(2010, 1, 1)
+
+        company = kwargs.get('company') or CompanyGenerator().generate(
+            share_count=share_count)
+        if not company.operator_set.exists():
+            OperatorGenerator().generate(company=company)
+        security = SecurityGenerator().generate(
+            company=company, count=share_count, track_numbers=track_numbers,
+            number_segments=track_numbers and [
+                u'1-{}'.format(share_count)] or [])
+        cs = CompanyShareholderGenerator().generate(
+            company=company, security=security,
+            company_shareholder_created_at=founded_at)
+        option_plan = OptionPlanGenerator().generate(
+            company=company, security=security, count=share_count / 2)
+        OptionTransaction.objects.create(
+            option_plan=option_plan, buyer=cs, count=share_count / 2,
+            bought_at=founded_at)
+
+        logger.info('start {} shareholder generation...'.format(
+            shareholder_count))
+        number = 1
+        for i, count in enumerate(counts):
+            shareholder = ShareholderGenerator().generate(
+                company=company, number=unicode(i + 1))
+            bought_at = founded_at + datetime.timedelta(
+                days=random.randint(1, 2500))
+            segments = []
+            if track_numbers:
+                segments = [u'{}-{}'.format(number, number + count - 1)]
+                number += count
+            PositionGenerator().generate(
+                company=company, security=security, buyer=shareholder,
+                seller=cs, count=count, number_segments=segments,
+                bought_at=bought_at,
+                vesting_months=not i % vesting_every and 24 or None)
+            if not i % options_every:
+                OptionTransaction.objects.create(
+                    option_plan=option_plan, buyer=shareholder, seller=cs,
+                    count=count, bought_at=bought_at,
+                    vesting_months=random.choice([None, 12, 48]))
+
+        logger.info('large company generator finished')
+        return company
+
+
+class BulkCompanyGenerator(object):
+
+    def generate(self, **kwargs):
+        """
+        used for load testing. same kind of company as
+        `LargeCompanyGenerator` but users, profiles, shareholders, positions
+        and option transactions are written with bulk inserts inside one
+        transaction. signals are not fired, derived data (order cache,
+        security prices, number allocator) is set explicitly. same data for
+        same `seed`
+        """
+        shareholder_count = kwargs.get('shareholder_count', 1000)
+        shares_per_shareholder = kwargs.get('shares_per_shareholder', 10)
+        track_numbers = kwargs.get('track_numbers', True)
+        vesting_every = kwargs.get('vesting_every', 10)
+        options_every = kwargs.get('options_every', 20)
+        # own generator, the single object generators use `random` too
+        rnd = random.Random(kwargs.get('seed', 0))
+
+        counts = [rnd.randint(1, shares_per_shareholder * 2)
+                  for i in range(0, shareholder_count)]
+        # half of the shares stay with the company as option pool
+        share_count = sum(counts) * 2
+        founded_at = datetime.date(2010, 1, 1)
+        words = _make_wordlist()
+
+        with transaction.atomic():
+            company = kwargs.get('company') or CompanyGenerator().generate(
+                share_count=share_count)
+            if not company.operator_set.exists():
+                OperatorGenerator().generate(company=company)
+            security = SecurityGenerator().generate(
+                company=company, count=share_count,
+                track_numbers=track_numbers,
+                number_segments=track_numbers and [
+                    u'1-{}'.format(share_count)] or [])
+            cs = CompanyShareholderGenerator().generate(
+                company=company, security=security,
+                company_shareholder_created_at=founded_at)
+            option_plan = OptionPlanGenerator().generate(
+                company=company, security=security, count=share_count / 2)
+            OptionTransaction.objects.create(
+                option_plan=option_plan, buyer=cs, count=share_count / 2,
+                bought_at=founded_at)
+
+            logger.info('start {} shareholder bulk generation...'.format(
+                shareholder_count))
+            users = self._bulk_create_users(
+                company, security, shareholder_count, words, rnd)
+            shareholders = self._bulk_create_shareholders(
+                company, security, users, counts)
+
+            positions = []
+            option_transactions = []
+            number = 1
+            for i, count in enumerate(counts):
+                shareholder = shareholders[i]
+                bought_at = founded_at + datetime.timedelta(
+                    days=rnd.randint(1, 2500))
+                segments = []
+                if track_numbers:
+                    segments = [u'{}-{}'.format(number, number + count - 1)]
+                    number += count
+                position = Position(
+                    company=company, security=security, buyer=shareholder,
+                    seller=cs, count=count, value=2,
+                    number_segments=segments, bought_at=bought_at,
+                    vesting_months=not i % vesting_every and 24 or None)
+                position.update_vesting_expires_at()
+                positions.append(position)
+                if not i % options_every:
+                    option_transaction = OptionTransaction(
+                        company=company, option_plan=option_plan,
+                        buyer=shareholder, seller=cs, count=count,
+                        bought_at=bought_at,
+                        vesting_months=rnd.choice([None, 12, 48]))
+                    option_transaction.update_vesting_expires_at()
+                    option_transactions.append(option_transaction)
+
+            Position.objects.bulk_create(positions,
+                                         batch_size=BULK_BATCH_SIZE)
+            OptionTransaction.objects.bulk_create(
+                option_transactions, batch_size=BULK_BATCH_SIZE)
+            SecurityPrice.refresh(set(
+                (security.pk, position.bought_at) for position in positions))
+            # all other order caches were written with the shareholders
+            update_order_cache_task(cs.pk)
+            company.touch_ledger()
+
+        logger.info('bulk company generator finished')
+        return company
+
+    def _bulk_create_users(self, company, security, count, words, rnd):
+        """ return list of `count` new users with profile and token """
+        # security is new per run, usernames must not collide with users of
+        # earlier runs for the same company
+        prefix = u'bulk-{}-{}-'.format(company.pk, security.pk)
+        # hashing is slow, all users share the same password
+        password = make_password(DEFAULT_TEST_DATA.get('password'))
+        User.objects.bulk_create([
+            User(username=u'{}{}'.format(prefix, i),
+                 email=u'{}{}@example.com'.format(prefix, i),
+                 first_name=rnd.choice(words)[:30],
+                 last_name=rnd.choice(words)[:30],
+                 password=password, is_active=True)
+            for i in range(0, count)], batch_size=BULK_BATCH_SIZE)
+
+        # bulk_create does not set pks, neither fires the signal creating
+        # token and profile
+        users = {user.username: user for user in User.objects.filter(
+            username__startswith=prefix)}
+        users = [users[u'{}{}'.format(prefix, i)] for i in range(0, count)]
+
+        Token.objects.bulk_create(
+            [Token(user=user, key=Token().generate_key()) for user in users],
+            batch_size=BULK_BATCH_SIZE)
+        country = CountryGenerator().generate()
+        UserProfile.objects.bulk_create([
+            UserProfile(
+                user=user, country=country, street="Some Street",
+                city="SomeCity", province="Some Province",
+                postal_code="12345", company_name="SomeCorp",
+                birthday=datetime.date(1950, 1, 1) + datetime.timedelta(
+                    days=rnd.randint(0, 50 * 365)),
+                initial_registration_at=datetime.date(2010, 1, 1))
+            for user in users], batch_size=BULK_BATCH_SIZE)
+
+        return users
+
+    def _bulk_create_shareholders(self, company, security, users, counts):
+        """
+        return list of new shareholders for `users`, order cache is set for
+        holding `counts` shares of `security`
+        """
+        shareholders = []
+        for i, (user, count) in enumerate(zip(users, counts)):
+            number = unicode(i + 1)
+            shareholders.append(Shareholder(
+                company=company, user=user, number=number, mailing_type=1,
+                order_cache={
+                    'share_count': count,
+                    'postal_code': '12345',
+                    'cumulated_face_value': float(
+                        count * (security.face_value or 0)),
+                    'number': make_numeric(number),
+                }))
+        Shareholder.objects.bulk_create(shareholders,
+                                        batch_size=BULK_BATCH_SIZE)
+        NumberAllocator.register(
+            company, 'shareholder_number',
+            [shareholder.number for shareholder in shareholders])
+
+        # bulk_create does not set pks
+        by_user = {shareholder.user_id: shareholder
+                   for shareholder in company.shareholder_set.filter(
+                       user__in=users)}
+        return [by_user[user.pk] for user in users]
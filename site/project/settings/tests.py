@@ -9,6 +9,7 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
     }
 }
+CAPTABLE_CACHE_LOCAL_SIZE = 0
 
 CREATE_STRIPE_CUSTOMER_FOR_SUBSCRIBER_ON_CREATE = False
 
@@ -23,8 +23,7 @@ logger = logging.getLogger(__name__)
 def _check_subscription(request):
     company = get_company_from_request(request, fail_silently=True)
     if company:
-        customer = company.get_customer()
-        if customer and not customer.has_active_subscription():
+        if not company.get_subscription_state()['active']:
             redirect_url = resolve_url(
                 'djstripe:subscribe',
                 **dict(company_id=company.pk)
@@ -20,7 +20,7 @@ from natsort import natsorted
 from project.celery import app
 from reports.models import (ORDERING_TYPES, REPORT_FILE_TYPES, REPORT_TYPES,
                             Report)
-from shareholder.models import Company, OptionTransaction, Position, Q
+from shareholder.models import Company, OptionTransaction, Position
 from utils.formatters import human_readable_segments
 from utils.http import url_with_domain
 from utils.pdf import render_to_pdf
@@ -279,15 +279,15 @@ def _get_assembly_participation_pdf_context(company, date):
 
 def _get_certificates_pdf_context(company, date):
     ots = OptionTransaction.objects.filter(
-        option_plan__company=company,
+        company=company,
         printed_at__isnull=False,
         certificate_id__isnull=False,
-        ).distinct()
+        )
     pos = Position.objects.filter(
-        Q(buyer__company=company) | Q(seller__company=company),
+        company=company,
         printed_at__isnull=False,
         certificate_id__isnull=False,
-        ).distinct()
+        )
     # add option transactions
     _rows = []
     _rows += [
@@ -334,11 +334,9 @@ def _get_report(report_id):
 def _get_vested_shares_pdf_context(company, date):
 
     positions = Position.objects.filter(
-        Q(buyer__company=company) | Q(seller__company=company),
-        vesting_months__gt=0).distinct()
+        company=company, vesting_months__gt=0)
     ots = OptionTransaction.objects.filter(
-        option_plan__company=company,
-        vesting_months__gt=0).distinct()
+        company=company, vesting_months__gt=0)
     _rows = []
     _rows += [
         [p.buyer.get_full_name(), p.count, unicode(p.security),
@@ -736,15 +734,15 @@ def render_certificates_xls(company_id, report_id, user_id=None, ordering=None,
     filename = _get_filename(report, company)
 
     ots = OptionTransaction.objects.filter(
-        option_plan__company=company,
+        company=company,
         printed_at__isnull=False,
         certificate_id__isnull=False,
-        ).distinct()
+        )
     pos = Position.objects.filter(
-        Q(buyer__company=company) | Q(seller__company=company),
+        company=company,
         printed_at__isnull=False,
         certificate_id__isnull=False,
-        ).distinct()
+        )
     # add option transactions
     _rows = []
     _rows += [
@@ -831,11 +829,9 @@ def render_vested_shares_xls(company_id, report_id, user_id=None, ordering=None,
     filename = _get_filename(report, company)
 
     positions = Position.objects.filter(
-        Q(buyer__company=company) | Q(seller__company=company),
-        vesting_months__gt=0).distinct()
+        company=company, vesting_months__gt=0)
     ots = OptionTransaction.objects.filter(
-        option_plan__company=company,
-        vesting_months__gt=0).distinct()
+        company=company, vesting_months__gt=0)
     _rows = []
     _rows += [
         [p.buyer.get_full_name(), p.count, unicode(p.security),
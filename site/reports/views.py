@@ -2,7 +2,6 @@ import time
 
 import dateutil.parser
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
@@ -27,9 +26,7 @@ def _get_transactions(from_date, to_date, security, company):
 
     for position in Position.objects.filter(
         bought_at__range=(from_date, to_date), security=security
-    ).filter(
-        Q(buyer__company=company) | Q(seller__company=company)
-    ).prefetch_related('buyer', 'seller', 'security'):
+    ).filter(company=company).prefetch_related('buyer', 'seller', 'security'):
         row = [
             position.bought_at,
             position.buyer.get_full_name() if position.buyer else u"",
@@ -45,9 +42,7 @@ def _get_transactions(from_date, to_date, security, company):
 
     options = OptionTransaction.objects.filter(
         bought_at__range=(from_date, to_date), option_plan__security=security
-    ).filter(
-        Q(buyer__company=company) | Q(seller__company=company)
-    ).prefetch_related(
+    ).filter(company=company).prefetch_related(
         'buyer', 'seller', 'option_plan', 'option_plan__security'
     )
     if options:
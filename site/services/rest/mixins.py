@@ -1,11 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 import re
+from collections import OrderedDict
 
+from django.conf import settings
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from django.utils.translation import get_language
 from django.utils.translation import ugettext_lazy as _
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 
+from utils.cache import captable_cache
 from utils.formatters import string_list_to_json
 
 
@@ -62,3 +72,55 @@ class SubscriptionSerializerMixin(object):
     """
 
     pass
+
+
+class LedgerConditionalResponseMixin(object):
+    """
+    mixin for views returning data derived from the share register. responses
+    carry an ETag built from the company ledger state (see
+    `Company.ledger_changed_at`) and the request. requests with matching
+    `If-None-Match` get a 304 without computing anything, other unchanged
+    responses are served from cache.
+    """
+
+    ledger_response_cache_timeout = getattr(
+        settings, 'LEDGER_RESPONSE_CACHE_TIMEOUT', 60*60*24)
+
+    def get_ledger_etag(self, request, company):
+        # share counts default to today, hence data changes daily
+        key = u'{}:{}:{}:{}:{}'.format(
+            company.get_ledger_cache_key(),
+            timezone.now().date().isoformat(),
+            request.build_absolute_uri(),
+            get_language(),
+            request.accepted_media_type)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_ledger_response(self, request, company, func, *args, **kwargs):
+        """
+        return conditional response for `func(*args, **kwargs)` which computes
+        the response
+        """
+        etag = self.get_ledger_etag(request, company)
+        quoted_etag = quote_etag(etag)
+
+        if quoted_etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH',
+                                                       '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = u'api-ledger-response-{}'.format(etag)
+            data = captable_cache.get(cache_key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = func(*args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # cache plain json data, serializer results are not picklable
+                data = json.loads(JSONRenderer().render(response.data),
+                                  object_pairs_hook=OrderedDict)
+                captable_cache.set(cache_key, data,
+                                   self.ledger_response_cache_timeout)
+
+        response['ETag'] = quoted_etag
+        return response
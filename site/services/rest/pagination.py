@@ -1,7 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import base64
+import datetime
+import json
+import re
+from decimal import Decimal
+
+from django.core.exceptions import FieldError, ImproperlyConfigured
+from django.db import connections, models
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import OrderBy, RawSQL
+from django.utils.translation import ugettext as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class SmallPagePagination(PageNumberPagination):
@@ -17,3 +31,256 @@ class SmallPagePagination(PageNumberPagination):
             'current': self.page.number,
             'results': data
         })
+
+
+class KeysetPagination(SmallPagePagination):
+    """
+    keyset (aka seek) pagination. active if the request has a `cursor` query
+    param (empty for the first page), otherwise falls back to page number
+    pagination.
+
+    pages are fetched with a `WHERE (ordering keys) > (keys of last row)`
+    condition instead of an OFFSET, hence deep pages are as fast as the first
+    one. the queryset ordering (incl. RawSQL ordering on `order_cache`) is
+    kept, `pk` is added as tie breaker to make it stable. NULLs are ordered
+    like the database does for offset pagination: last when ascending, first
+    when descending.
+
+    the total count is skipped unless requested with `count=exact` or
+    `count=estimate` (planner row estimate, no extra scan)
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    keyset_prefix = '_keyset_'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super(KeysetPagination, self).paginate_queryset(
+                queryset, request, view=view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        values, self.reverse = self.decode_cursor(request)
+        self.count = self._get_count(queryset, request)
+        queryset, self.keys = self._annotate_keys(queryset)
+        if values is not None:
+            if len(values) != len(self.keys):
+                raise NotFound(_('Invalid cursor'))
+            queryset = queryset.filter(
+                self._get_keyset_query(self.keys, values, self.reverse))
+
+        ordering = [
+            F(alias).desc() if (desc != self.reverse) else F(alias).asc()
+            for alias, desc in self.keys]
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        # the page we came from (cursor) always exists in the other direction
+        if self.reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.rows = rows
+
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_paginated_response(data)
+
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'count': self.count,
+            'current': None,
+            'results': data
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next or not self.rows:
+            return None
+        return self._get_link(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_previous_link()
+        if not self.has_previous or not self.rows:
+            return None
+        return self._get_link(self.rows[0], reverse=True)
+
+    # --- CURSOR
+
+    def encode_cursor(self, values, reverse=False):
+        data = json.dumps({'v': values, 'r': reverse})
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        return tuple (values, reverse) of cursor inside request. values is None
+        for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+            return list(data['v']), bool(data.get('r', False))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(_('Invalid cursor'))
+
+    def _get_link(self, obj, reverse):
+        values = [self._to_cursor_value(getattr(obj, alias))
+                  for alias, desc in self.keys]
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(values, reverse=reverse))
+
+    def _to_cursor_value(self, value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    # --- KEYS
+
+    def _annotate_keys(self, queryset):
+        """
+        annotate the ordering keys of the queryset and return tuple
+        (queryset, keys) where keys is a list of (alias, descending). NULL
+        does not compare, hence nullable keys are preceded by an `IS NULL`
+        key with the same direction. pk is always the last key.
+        """
+        ordering = list(queryset.query.order_by)
+        if not ordering and queryset.query.default_ordering:
+            ordering = list(queryset.model._meta.ordering)
+
+        keys = []
+        annotations = {}
+        for term in ordering:
+            expression, isnull, desc = self._get_key_expression(
+                queryset.model, term)
+            if not queryset.query.standard_ordering:
+                desc = not desc
+            if expression is None:
+                # pk is unique, following terms are irrelevant
+                keys.append(('pk', desc))
+                break
+            # asc: FALSE < TRUE puts NULLs last, desc puts them first
+            for key_expression in (isnull, expression):
+                if key_expression is None:
+                    continue
+                alias = u'{}{}'.format(self.keyset_prefix, len(keys))
+                annotations[alias] = key_expression
+                keys.append((alias, desc))
+
+        if not keys or keys[-1][0] != 'pk':
+            keys.append(('pk', keys[-1][1] if keys else False))
+
+        return queryset.annotate(**annotations), keys
+
+    def _get_key_expression(self, model, term):
+        """
+        return tuple (expression, isnull expression, descending) for an
+        order_by term. expression is None for the pk, isnull expression is
+        None if the term cannot be NULL
+        """
+        desc = False
+        if isinstance(term, OrderBy):
+            desc = term.descending
+            term = term.expression
+
+        if isinstance(term, RawSQL):
+            try:
+                output_field = term.output_field
+            except FieldError:
+                raise ImproperlyConfigured(
+                    'RawSQL ordering {!r} needs an output_field for keyset '
+                    'pagination'.format(term.sql))
+            return (
+                RawSQL(term.sql, term.params, output_field=output_field),
+                RawSQL(u'(({}) IS NULL)'.format(term.sql), term.params,
+                       output_field=models.BooleanField()),
+                desc)
+
+        if term.startswith('-'):
+            desc, term = True, term[1:]
+
+        if term in ('pk', model._meta.pk.name):
+            return None, None, desc
+
+        field, nullable = self._resolve_lookup(model, term)
+        isnull = None
+        if nullable:
+            isnull = Case(When(then=Value(True), **{term + '__isnull': True}),
+                          default=Value(False),
+                          output_field=models.BooleanField())
+        return F(term), isnull, desc
+
+    def _resolve_lookup(self, model, lookup):
+        """
+        return tuple (field, nullable) for lookup like `user__last_name`.
+        nullable is True if the field or any relation on the way can be NULL
+        """
+        field, nullable = None, False
+        for part in lookup.split(LOOKUP_SEP):
+            if part == 'pk':
+                part = model._meta.pk.name
+            field = model._meta.get_field(part)
+            nullable = nullable or getattr(field, 'null', False)
+            if field.is_relation:
+                model = field.related_model
+        if field.is_relation:
+            # ordering by fk orders by its pk
+            field = model._meta.pk
+        return field, nullable
+
+    def _get_keyset_query(self, keys, values, reverse):
+        """
+        return Q selecting all rows after (before if reverse) the row with
+        values. mixed ordering directions are expanded to
+        `a > x OR (a = x AND b < y) OR ...`. a NULL value has no rows
+        after it for its key, the preceding `IS NULL` key orders it
+        """
+        query, equal = Q(), Q()
+        for (alias, desc), value in zip(keys, values):
+            if value is not None:
+                lookup = '__lt' if desc != reverse else '__gt'
+                query |= equal & Q(**{alias + lookup: value})
+            # `alias=None` is translated to `IS NULL`
+            equal &= Q(**{alias: value})
+        return query
+
+    # --- COUNT
+
+    def _get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return self._estimate_count(queryset)
+        return None
+
+    def _estimate_count(self, queryset):
+        """
+        return row estimate of the postgres query planner for queryset
+        """
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(u'EXPLAIN {}'.format(sql), params)
+            plan = cursor.fetchone()[0]
+        match = re.search(r'rows=(\d+)', plan)
+        return match and int(match.group(1)) or 0
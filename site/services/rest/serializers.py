@@ -3,11 +3,10 @@ from dateutil.parser import parse as timeparse
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.mail import mail_managers, send_mail
 from django.core.urlresolvers import reverse
-from django.db import transaction
-from django.db.models import Q
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.utils.translation import ugettext as _
 from django.utils import timezone
@@ -17,12 +16,15 @@ from rest_framework.exceptions import ValidationError
 from services.rest.mixins import (FieldValidationMixin,
                                   SubscriptionSerializerMixin)
 from reports.models import Report
+from shareholder.ledger import Ledger
 from shareholder.models import (Bank, Company, Country, Operator, OptionPlan,
                                 OptionTransaction, Position, Security,
                                 Shareholder, UserProfile)
-from utils.formatters import inflate_segments, string_list_to_json
+from utils.cache import captable_cache
+from utils.formatters import string_list_to_json
 from utils.hashers import random_hash
-from utils.math import substract_list
+from utils.math import (intervals_overlap, segments_to_intervals,
+                        substract_intervals)
 from utils.session import get_company_from_request
 from utils.user import make_username
 
@@ -107,6 +109,7 @@ class CompanySerializer(SubscriptionSerializerMixin,
     logo_url = serializers.SerializerMethodField()
     vote_count = serializers.SerializerMethodField()
     vote_count_floating = serializers.SerializerMethodField()
+    register_health = serializers.SerializerMethodField()
     current_subscription = serializers.CharField(
         source='get_current_subscription_plan',
         read_only=True
@@ -129,6 +132,7 @@ class CompanySerializer(SubscriptionSerializerMixin,
                   'send_shareholder_statement_via_letter_enabled',
                   'signatures',
                   'support_contact',
+                  'register_health',
                   ) + Company.ADDRESS_FIELDS
 
     def get_profile_url(self, obj):
@@ -138,10 +142,13 @@ class CompanySerializer(SubscriptionSerializerMixin,
         return obj.get_logo_url()
 
     def get_vote_count(self, obj):
-        return obj.get_total_votes()
+        return obj.get_vote_summary()['total']
 
     def get_vote_count_floating(self, obj):
-        return obj.get_total_votes_floating()
+        return obj.get_vote_summary()['floating']
+
+    def get_register_health(self, obj):
+        return obj.get_register_health(schedule=True)
 
 
 class AddCompanySerializer(serializers.Serializer):
@@ -363,32 +370,106 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         return None
 
 
+class ShareholderListBulkSerializer(serializers.ListSerializer):
+    """
+    computes share counts of all shareholders to render with a constant
+    number of queries, see `ShareholderListSerializer`
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        shareholders = list(iterable)
+        if shareholders:
+            company = shareholders[0].company
+            company_shareholder = company.get_company_shareholder(
+                fail_silently=True)
+            self.context['share_counts'] = company.get_share_count_map(
+                shareholders + [company_shareholder]
+                if company_shareholder else shareholders)
+            self.context['company_shareholder'] = company_shareholder
+            self.context['securities'] = list(company.security_set.all())
+        return super(ShareholderListBulkSerializer, self).to_representation(
+            shareholders)
+
+
 class ShareholderListSerializer(serializers.HyperlinkedModelSerializer):
-    """ made for performance, avoids any queries or nested data """
+    """
+    made for performance, avoids any queries or nested data. rendered as list
+    (many=True) share counts are computed once for all objects
+    """
     # user = UserSerializer(many=False)
     full_name = serializers.SerializerMethodField()
     is_company = serializers.SerializerMethodField()
+    share_percent = serializers.SerializerMethodField()
+    share_count = serializers.SerializerMethodField()
+    cumulated_face_value = serializers.SerializerMethodField()
 
     class Meta:
         model = Shareholder
         fields = (
             'pk', 'number',
             # 'user',
-            'share_percent',  # +2 queries/obj
-            'share_count',  # +2 queries/obj
+            'share_percent',
+            'share_count',
             'cumulated_face_value',
             'validate_gafi',
             'is_company',
             'full_name',
             # 'order_cache',  not needed as of now, for ordering only
         )
+        list_serializer_class = ShareholderListBulkSerializer
+
+    def _get_share_counts(self, obj):
+        """ return dict security pk -> share count if computed for list """
+        share_counts = self.context.get('share_counts')
+        if share_counts is not None and obj.pk in share_counts:
+            return share_counts[obj.pk]
 
     def get_full_name(self, obj):
         return obj.get_full_name()
 
     def get_is_company(self, obj):
+        if 'company_shareholder' in self.context:
+            return obj == self.context['company_shareholder']
         return obj.is_company_shareholder()  # adds one query per obj
 
+    def get_share_count(self, obj):
+        share_counts = self._get_share_counts(obj)
+        if share_counts is None:
+            return obj.share_count()  # +2 queries/obj
+        return sum(share_counts.values())
+
+    def get_cumulated_face_value(self, obj):
+        share_counts = self._get_share_counts(obj)
+        if share_counts is None:
+            return obj.cumulated_face_value()
+        return sum([share_counts.get(security.pk, 0) * security.face_value
+                    for security in self.context['securities']
+                    if security.face_value])
+
+    def get_share_percent(self, obj):
+        share_counts = self._get_share_counts(obj)
+        company_shareholder = self.context.get('company_shareholder')
+        if share_counts is None or not company_shareholder:
+            return obj.share_percent()  # +2 queries/obj
+
+        # same math as `Shareholder.share_percent`
+        if obj == company_shareholder:
+            return False
+
+        total = obj.company.share_count
+        if total:
+            cs_count = sum(self.context['share_counts'][
+                company_shareholder.pk].values())
+            # we have no other shareholders
+            if total == cs_count:
+                return "{:.2f}".format(float(0))
+
+            return round(sum(share_counts.values()) / float(total - cs_count),
+                         4)
+
+        return False
+
 
 class ShareholderSerializer(serializers.HyperlinkedModelSerializer):
     user = UserSerializer(many=False)
@@ -598,6 +679,102 @@ class ShareholderSerializer(serializers.HyperlinkedModelSerializer):
         return value
 
 
+class BulkBookingListSerializer(serializers.ListSerializer):
+    """
+    validate and book many positions or option transactions at once. all rows
+    are validated in order against one in-memory `Ledger` of the company, so
+    each row sees the effects of the rows before. rows are inserted in bulk.
+
+    the child serializer must implement `validate_booking(ledger)` and
+    `add_booking(validated_data, ledger, shareholders)`, `shareholders` maps
+    'buyer' and 'seller' to the shareholders the row was validated for
+    """
+
+    def _get_ledger(self, data):
+        holders, pks, numbers = set(), set(), set()
+        for item in data:
+            for key in ('buyer', 'seller'):
+                shareholder = isinstance(item, dict) and item.get(key)
+                if not isinstance(shareholder, dict):
+                    continue
+                try:
+                    pk = int(shareholder.get('pk'))
+                except (TypeError, ValueError):
+                    # reported as invalid shareholder by the row validation
+                    pk = None
+                if pk is not None:
+                    pks.add(pk)
+                    if key == 'seller':
+                        holders.add(pk)
+                if shareholder.get('number'):
+                    numbers.add(shareholder['number'])
+
+        company = get_company_from_request(self.context.get('request'))
+        # bookings are validated against the current share register
+        company.refresh_ledger_changed_at()
+        return Ledger(company, holders=holders, shareholder_pks=pks,
+                      shareholder_numbers=numbers)
+
+    def _validate_shareholders(self, item):
+        """
+        buyer and seller must be shareholders of the company. each is resolved
+        by pk, a given number must belong to the same shareholder. returns
+        dict 'buyer'/'seller' -> shareholder
+        """
+        errors, shareholders = {}, {}
+        for key in ('buyer', 'seller'):
+            data = item.get(key)
+            if not data:
+                continue
+            shareholder = (data.get('pk') and
+                           self.ledger.get_shareholder(pk=data['pk']))
+            if (not shareholder or (data.get('number') and
+                                    unicode(data['number']) !=
+                                    shareholder.number)):
+                errors[key] = [_('Invalid shareholder.')]
+                continue
+            shareholders[key] = shareholder
+        if errors:
+            raise ValidationError(errors)
+        return shareholders
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            raise ValidationError({
+                'non_field_errors': [_('Expected a non empty list of items.')]
+            })
+
+        self.ledger = self._get_ledger(data)
+        self.context['ledger'] = self.ledger
+
+        ret, errors = [], []
+        for item in data:
+            # field validators of the child read the raw row
+            self.child.initial_data = item
+            try:
+                validated = self.child.run_validation(item)
+                shareholders = self._validate_shareholders(item)
+                self.child.validate_booking(self.ledger)
+            except ValidationError as exc:
+                errors.append(exc.detail)
+                continue
+
+            self.child.add_booking(validated, self.ledger, shareholders)
+            ret.append(validated)
+            errors.append({})
+
+        if any(errors):
+            raise ValidationError(errors)
+
+        return ret
+
+    def create(self, validated_data):
+        try:
+            return self.ledger.save()
+        except DjangoValidationError as exc:
+            raise ValidationError({'non_field_errors': exc.messages})
+
+
 class PositionSerializer(serializers.HyperlinkedModelSerializer,
                          FieldValidationMixin):
 
@@ -628,11 +805,16 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
             'certificate_invalidation_position_url',
             'certificate_invalidation_initial_position_url',
             'is_certificate_valid')
+        list_serializer_class = BulkBookingListSerializer
 
     def _get_company(self):
         company = get_company_from_request(self.context.get("request"))
         return company
 
+    def _get_ledger(self):
+        """ return in-memory ledger if validating a bulk booking """
+        return self.context.get('ledger')
+
     def get_certificate_invalidation_position_url(self, obj):
         if obj.certificate_invalidation_position:
             return reverse(
@@ -743,14 +925,49 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
             kwargs.update({'registration_type': '1'})
 
         # ------- common logic
-        kwargs.update({
-            "buyer": buyer,
+        kwargs.update({"buyer": buyer})
+        kwargs.update(self._get_position_kwargs(validated_data, security))
+
+        position = Position.objects.create(**kwargs)
+
+        # fire signal to update order_cache
+        post_save.send(
+            Position, instance=position, using='default', created=True)
+
+        if position.seller:
+            cache_key = u"shareholder_share_count_{}_{}_{}".format(
+                position.seller.pk,
+                timezone.now().date().isoformat(),
+                position.security.pk)
+            captable_cache.set(cache_key, None)
+            cache_key = u"shareholder_share_count_{}_{}_{}".format(
+                position.seller.pk,
+                timezone.now().date().isoformat(),
+                'None')
+            captable_cache.set(cache_key, None)
+        if position.buyer:
+            cache_key = u"shareholder_share_count_{}_{}_{}".format(
+                position.buyer.pk,
+                timezone.now().date().isoformat(),
+                position.security.pk)
+            captable_cache.set(cache_key, None)
+            cache_key = u"shareholder_share_count_{}_{}_{}".format(
+                position.buyer.pk,
+                timezone.now().date().isoformat(),
+                'None')
+            captable_cache.set(cache_key, None)
+
+        return position
+
+    def _get_position_kwargs(self, validated_data, security):
+        """ model kwargs shared by single and bulk booking """
+        kwargs = {
             "bought_at": validated_data.get("bought_at"),
             "value": validated_data.get("value"),
             "count": validated_data.get("count"),
             "security": security,
             "comment": validated_data.get("comment"),
-        })
+        }
 
         # segments must be ordered, have no duplicates and must be list...
         if security.track_numbers and validated_data.get("number_segments"):
@@ -776,39 +993,42 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
 
         if validated_data.get("depot_bank"):
             kwargs.update({
-                'depot_bank': Bank.objects.get(
-                    pk=validated_data.get("depot_bank")['pk'])})
+                'depot_bank_id': validated_data.get("depot_bank")['pk']})
 
-        position = Position.objects.create(**kwargs)
+        return kwargs
 
-        # fire signal to update order_cache
-        post_save.send(
-            Position, instance=position, using='default', created=True)
+    def validate_booking(self, ledger):
+        """
+        cross data validation of a bulk booking row against the ledger (see
+        `is_valid`)
+        """
+        security = self.initial_data.get('security')
+        if not security or not ledger.get_security(pk=security.get('pk')):
+            raise serializers.ValidationError(
+                {'security': [_('Invalid security.')]})
 
-        if position.seller:
-            cache_key = u"shareholder_share_count_{}_{}_{}".format(
-                position.seller.pk,
-                timezone.now().date().isoformat(),
-                position.security.pk)
-            cache.set(cache_key, None)
-            cache_key = u"shareholder_share_count_{}_{}_{}".format(
-                position.seller.pk,
-                timezone.now().date().isoformat(),
-                'None')
-            cache.set(cache_key, None)
-        if position.buyer:
-            cache_key = u"shareholder_share_count_{}_{}_{}".format(
-                position.buyer.pk,
-                timezone.now().date().isoformat(),
-                position.security.pk)
-            cache.set(cache_key, None)
-            cache_key = u"shareholder_share_count_{}_{}_{}".format(
-                position.buyer.pk,
-                timezone.now().date().isoformat(),
-                'None')
-            cache.set(cache_key, None)
+        if ledger.get_security(pk=security.get('pk')).track_numbers:
+            self._validate_number_segments(ledger.company, security)
 
-        return position
+    def add_booking(self, validated_data, ledger, shareholders):
+        """ add unsaved position for a bulk booking row to the ledger """
+        security = ledger.get_security(
+            title=validated_data.get('security').get('title'),
+            face_value=validated_data.get('security').get('face_value'))
+
+        kwargs = self._get_position_kwargs(validated_data, security)
+        # ------- regular security transaction
+        if validated_data.get("seller") and validated_data.get("buyer"):
+            kwargs.update({
+                'buyer': shareholders['buyer'],
+                'seller': shareholders['seller'],
+                'registration_type': '2'})
+        # -------- capital increase
+        else:
+            kwargs.update({'buyer': ledger.company_shareholder,
+                           'registration_type': '1'})
+
+        ledger.add_position(Position(**kwargs))
 
     def validate_certificate_id(self, value):
         """
@@ -817,12 +1037,19 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
         if not value:
             return value
 
+        ledger = self._get_ledger()
+        if ledger:
+            if ledger.has_certificate_id(value):
+                raise ValidationError(
+                    _("Certificate ID {} is already used in transaction or "
+                      "option transaction").format(value))
+            return value
+
         company = self._get_company()
         ot_queryset = OptionTransaction.objects.filter(
-            option_plan__company=company, certificate_id=value)
+            company=company, certificate_id=value)
         pos_queryset = Position.objects.filter(
-            Q(buyer__company=company) | Q(seller__company=company),
-            certificate_id=value)
+            company=company, certificate_id=value)
         # exclude self on update operation
         if self.instance is not None and self.instance.pk:
             pos_queryset = pos_queryset.exclude(pk=self.instance.pk).exists()
@@ -846,17 +1073,32 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
 
         # seller is optional
         if self.initial_data.get('seller'):
-            security = Security.objects.get(
-                pk=self.initial_data.get('security').get('pk'))
-            seller = Shareholder.objects.get(
-                pk=self.initial_data.get('seller').get('pk'))
-
             # does the seller have enough shares to sell?
             bought_at = (self.initial_data.get('bought_at') or
                          timezone.now().date().isoformat())
-            sellable_shares = seller.share_count_sellable(
-                security=security,
-                date=timeparse(bought_at))
+            ledger = self._get_ledger()
+            if ledger:
+                seller = ledger.get_shareholder(
+                    pk=self.initial_data.get('seller').get('pk'))
+                security = ledger.get_security(
+                    pk=(self.initial_data.get('security') or {}).get('pk'))
+                try:
+                    date = timeparse(bought_at)
+                except (TypeError, ValueError):
+                    date = None
+                # invalid rows are reported by their field or row validation
+                if not seller or not security or not date:
+                    return value
+                sellable_shares = ledger.share_count_sellable(
+                    seller.pk, security.pk, date=date)
+            else:
+                security = Security.objects.get(
+                    pk=self.initial_data.get('security').get('pk'))
+                seller = Shareholder.objects.get(
+                    pk=self.initial_data.get('seller').get('pk'))
+                sellable_shares = seller.share_count_sellable(
+                    security=security,
+                    date=timeparse(bought_at))
             if value > sellable_shares:
                 raise ValidationError(
                     _('seller does not have enough shares. max value is {}. '
@@ -880,7 +1122,12 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
     def _validate_number_segments(self, company, security,
                                   raise_exception=False):
         initial_data = self.initial_data
-        security = Security.objects.get(company=company, pk=security.get('pk'))
+        ledger = self._get_ledger()
+        if ledger:
+            security = ledger.get_security(pk=security.get('pk'))
+        else:
+            security = Security.objects.get(
+                company=company, pk=security.get('pk'))
         logger.info('validation: prepare data...')
         if (isinstance(initial_data.get('number_segments'), str) or
                 isinstance(initial_data.get('number_segments'), unicode)):
@@ -890,7 +1137,12 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
             segments = initial_data.get('number_segments')
 
         # if we have seller (non capital increase)
-        if initial_data.get('seller'):
+        if initial_data.get('seller') and ledger:
+            seller = ledger.get_shareholder(
+                pk=initial_data.get('seller')['pk'])
+            owning, failed_segments, owned_segments = ledger.owns_segments(
+                seller.pk, segments, security.pk)
+        elif initial_data.get('seller'):
             logger.info('validation: get seller segments...')
             seller = Shareholder.objects.get(
                 pk=initial_data.get('seller')['pk'])
@@ -932,12 +1184,12 @@ class PositionSerializer(serializers.HyperlinkedModelSerializer,
 
         # segment must not be used by option plan
         logger.info('validation: option plan validation...')
-        inflated_segments = inflate_segments(segments)
-        oplan_segments = inflate_segments(
-            security.company.get_all_option_plan_segments())
-        if substract_list(
-            inflated_segments, oplan_segments
-        ) != inflated_segments:
+        if ledger:
+            oplan_intervals = ledger.get_option_plan_intervals()
+        else:
+            oplan_intervals = security.company.get_option_plan_intervals()
+        if intervals_overlap(segments_to_intervals(segments),
+                             oplan_intervals):
             raise serializers.ValidationError({
                 'number_segments':
                     [_('Segment {} is blocked for options and cannot be'
@@ -1098,13 +1350,28 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
                   'readable_registration_type', 'registration_type',
                   'depot_type', 'readable_depot_type', 'stock_book_id',
                   'certificate_id', 'printed_at')
+        list_serializer_class = BulkBookingListSerializer
+
+    def _get_ledger(self):
+        """ return in-memory ledger if validating a bulk booking """
+        return self.context.get('ledger')
 
     def _get_optionplan(self):
         op_serialized = self.initial_data.get('option_plan')
+        ledger = self._get_ledger()
         if isinstance(op_serialized, dict):
             pk = op_serialized.get('pk')
+        elif ledger:
+            # raw row data, checked by the ledger lookup
+            pk = u'{}'.format(op_serialized).split('/')[-1]
         else:
             pk = int(op_serialized.split('/')[-1])
+        if ledger:
+            option_plan = ledger.get_option_plan(pk)
+            if not option_plan:
+                raise ValidationError(
+                    {'option_plan': [_('Invalid option plan.')]})
+            return option_plan
         option_plan = OptionPlan.objects.get(id=pk)
         return option_plan
 
@@ -1114,13 +1381,44 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
         """
         res = super(OptionTransactionSerializer, self).is_valid(raise_exception)
 
-        initial_data = self.initial_data
+        option_plan = self._get_optionplan()
+        if option_plan.security.track_numbers:
+            self._validate_number_segments(option_plan)
+
+        return res
+
+    def validate_booking(self, ledger):
+        """
+        cross data validation of a bulk booking row against the ledger (see
+        `is_valid`)
+        """
+        option_plan = self._get_optionplan()
+        security = ledger.get_security(pk=option_plan.security_id)
+        if security.track_numbers:
+            self._validate_number_segments(option_plan)
 
+    def add_booking(self, validated_data, ledger, shareholders):
+        """
+        add unsaved option transaction for a bulk booking row to the ledger
+        """
         option_plan = self._get_optionplan()
-        security = option_plan.security
+        security = ledger.get_security(pk=option_plan.security_id)
+        kwargs = self._get_option_transaction_kwargs(
+            validated_data, security)
+        kwargs.update({
+            'buyer': shareholders.get('buyer'),
+            'seller': shareholders.get('seller'),
+            'option_plan': option_plan,
+        })
+        ledger.add_option_transaction(OptionTransaction(**kwargs))
 
-        if not security.track_numbers:
-            return res
+    def _validate_number_segments(self, option_plan):
+        initial_data = self.initial_data
+        ledger = self._get_ledger()
+        if ledger:
+            security = ledger.get_security(pk=option_plan.security_id)
+        else:
+            security = option_plan.security
 
         if (isinstance(initial_data.get('number_segments'), str) or
                 isinstance(initial_data.get('number_segments'), unicode)):
@@ -1135,7 +1433,12 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
                     [_('Invalid security numbers segments.')]})
 
         # if we have seller (non capital increase)
-        if initial_data.get('seller'):
+        if initial_data.get('seller') and ledger:
+            seller = ledger.get_shareholder(
+                pk=initial_data.get('seller')['pk'])
+            owning, failed_segments, owned_segments = ledger.\
+                owns_options_segments(seller.pk, segments, security.pk)
+        elif initial_data.get('seller'):
             seller = Shareholder.objects.get(
                 pk=initial_data.get('seller')['pk'])
             owning, failed_segments, owned_segments = seller.\
@@ -1165,17 +1468,18 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
             })
 
         # segments must be inside option plans segments
-        for segment in inflate_segments(segments):
-            if segment not in inflate_segments(option_plan.number_segments):
-                raise serializers.ValidationError({
-                    'number_segments':
-                        [_('Segment {} is not reserved for options inside a'
-                           ' option plan and cannot be'
-                           ' transfered to a option holder. Available are: '
-                           '{}').format(segment, option_plan.number_segments)]
-                })
-
-        return res
+        not_reserved = substract_intervals(
+            segments_to_intervals(segments),
+            segments_to_intervals(option_plan.number_segments))
+        if not_reserved:
+            raise serializers.ValidationError({
+                'number_segments':
+                    [_('Segment {} is not reserved for options inside a'
+                       ' option plan and cannot be'
+                       ' transfered to a option holder. Available are: '
+                       '{}').format(not_reserved[0][0],
+                                    option_plan.number_segments)]
+            })
 
     def create(self, validated_data):
 
@@ -1197,17 +1501,30 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
         )
         kwargs.update({"seller": seller})
         kwargs.update({"buyer": buyer})
+        kwargs.update({"option_plan": option_plan})
+        kwargs.update(self._get_option_transaction_kwargs(
+            validated_data, option_plan.security))
 
-        kwargs.update({
+        option_transaction = OptionTransaction.objects.create(**kwargs)
+
+        # fire signal to update order_cache
+        post_save.send(
+            OptionTransaction, instance=option_transaction, using='default',
+            created=True)
+
+        return option_transaction
+
+    def _get_option_transaction_kwargs(self, validated_data, security):
+        """ model kwargs shared by single and bulk booking """
+        kwargs = {
             "bought_at": validated_data.get("bought_at"),
             "count": validated_data.get("count"),
-            "option_plan": option_plan,
             "vesting_months": validated_data.get("vesting_months"),
             "registration_type": '2',
-        })
+        }
 
         # segments must be ordered, have no duplicates and must be list...
-        if (option_plan.security.track_numbers and
+        if (security.track_numbers and
                 validated_data.get("number_segments")):
 
             kwargs.update({
@@ -1227,14 +1544,7 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
             kwargs.update({
                 'certificate_id': validated_data.get("certificate_id")})
 
-        option_transaction = OptionTransaction.objects.create(**kwargs)
-
-        # fire signal to update order_cache
-        post_save.send(
-            OptionTransaction, instance=option_transaction, using='default',
-            created=True)
-
-        return option_transaction
+        return kwargs
 
     def get_readable_number_segments(self, obj):
         """
@@ -1261,12 +1571,19 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
         if not value:
             return value
 
+        ledger = self._get_ledger()
+        if ledger:
+            if ledger.has_certificate_id(value):
+                raise ValidationError(
+                    _("Certificate ID {} is already used in transaction or "
+                      "option transaction").format(value))
+            return value
+
         company = self._get_optionplan().company
         ot_queryset = OptionTransaction.objects.filter(
-            option_plan__company=company, certificate_id=value)
+            company=company, certificate_id=value)
         pos_queryset = Position.objects.filter(
-            Q(buyer__company=company) | Q(seller__company=company),
-            certificate_id=value)
+            company=company, certificate_id=value)
         # exclude self on update operation
         if self.instance is not None and self.instance.pk:
             ot_queryset = ot_queryset.exclude(pk=self.instance.pk).exists()
@@ -1289,7 +1606,22 @@ class OptionTransactionSerializer(serializers.HyperlinkedModelSerializer):
                                     '').format(value))
 
         # seller is optional
-        if self.initial_data.get('seller'):
+        ledger = self._get_ledger()
+        if self.initial_data.get('seller') and ledger:
+            seller = ledger.get_shareholder(
+                pk=self.initial_data.get('seller').get('pk'))
+            # invalid sellers are reported by the row validation
+            if not seller:
+                return value
+            options_count = ledger.options_count(
+                seller.pk, self._get_optionplan().security_id)
+
+            if value > options_count:
+                raise ValidationError(
+                    _('seller does not have enough options. max value is {}.'
+                      '').format(options_count))
+
+        elif self.initial_data.get('seller'):
             security = Security.objects.get(
                 pk=self.initial_data.get('option_plan')['security']['pk'])
             seller = Shareholder.objects.get(
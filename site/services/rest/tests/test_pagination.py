@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import DecimalField
+from django.db.models.expressions import RawSQL
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from project.generators import CompanyGenerator, ShareholderGenerator
+from services.rest.pagination import KeysetPagination
+from shareholder.models import Shareholder
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        company = CompanyGenerator().generate()
+        self.shareholders = [
+            ShareholderGenerator().generate(company=company, number=number)
+            for number in ['1', '2', '3', '4', '5', '6', '7']]
+        # shareholders without cached share count
+        for shareholder in self.shareholders:
+            order_cache = {'share_count': int(shareholder.number)}
+            if shareholder.number in ('2', '5', '6'):
+                order_cache = {}
+            Shareholder.objects.filter(pk=shareholder.pk).update(
+                order_cache=order_cache)
+        self.queryset = Shareholder.objects.filter(company=company)
+
+    def _walk(self, queryset):
+        """ return shareholder numbers of all pages """
+        numbers = []
+        url = '/?cursor=&page_size=2'
+        while url:
+            paginator = KeysetPagination()
+            request = Request(APIRequestFactory().get(url))
+            numbers.extend([shareholder.number for shareholder in
+                            paginator.paginate_queryset(queryset, request)])
+            url = paginator.get_next_link()
+        return numbers
+
+    def test_null_ordering(self):
+        """ NULLs are ordered like with offset pagination """
+        ordering = RawSQL("((order_cache->>%s)::numeric)", ('share_count',),
+                          output_field=DecimalField())
+        queryset = self.queryset.order_by(ordering)
+
+        numbers = self._walk(queryset)
+        self.assertEqual(numbers[:4], ['1', '3', '4', '7'])
+        self.assertEqual(sorted(numbers[4:]), ['2', '5', '6'])
+        self.assertEqual(
+            [shareholder.number for shareholder in queryset][:4],
+            numbers[:4])
+
+        numbers = self._walk(queryset.reverse())
+        self.assertEqual(sorted(numbers[:3]), ['2', '5', '6'])
+        self.assertEqual(numbers[3:], ['7', '4', '3', '1'])
+        self.assertEqual(
+            [shareholder.number for shareholder in queryset.reverse()][3:],
+            numbers[3:])
+
+    def test_raw_sql_without_output_field(self):
+        queryset = self.queryset.order_by(
+            RawSQL("(order_cache->>%s)", ('share_count',)))
+        with self.assertRaises(ImproperlyConfigured):
+            self._walk(queryset)
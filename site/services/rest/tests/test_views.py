@@ -839,6 +839,82 @@ class PositionViewSetTestCase(MoreAssertsTestCaseMixin, StripeTestCaseMixin,
         self.assertEqual(position.stock_book_id, "666")
         self.assertEqual(position.depot_type, "1")
 
+    def test_bulk(self):
+        """ book many positions at once, rows see effects of previous rows """
+        operator = OperatorGenerator().generate()
+        company = operator.company
+        CompanyShareholderGenerator().generate(company=company)
+        buyer = ShareholderGenerator().generate(company=company)
+        seller = ShareholderGenerator().generate(company=company)
+        security = SecurityGenerator().generate(company=company)
+        PositionGenerator().generate(
+            seller=None, security=security, buyer=seller, count=3,
+            bought_at=datetime.date(2017, 1, 1))
+
+        self.client.force_login(operator.user)
+        add_company_to_session(self.client.session, company)
+        self.add_subscription(company)
+
+        def row(buyer, seller, count):
+            return {
+                "bought_at": "2017-05-13T00:00:00.000Z",
+                "buyer": {"pk": buyer.pk, "number": buyer.number},
+                "seller": {"pk": seller.pk, "number": seller.number},
+                "security": {"pk": security.pk, "title": security.title,
+                             "face_value": security.face_value},
+                "count": count,
+                "value": 1,
+            }
+
+        # second row exceeds shares left after first row
+        data = [row(buyer, seller, 2), row(buyer, seller, 2)]
+        count = Position.objects.count()
+        res = self.client.post('/services/rest/position/bulk', data,
+                               format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('count', res.data[1])
+        self.assertEqual(Position.objects.count(), count)
+
+        # buyer can sell shares bought within the same batch
+        data = [row(buyer, seller, 2), row(seller, buyer, 1)]
+        res = self.client.post('/services/rest/position/bulk', data,
+                               format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(Position.objects.count(), count + 2)
+        self.assertEqual(buyer.share_count(security=security), 1)
+        self.assertEqual(seller.share_count(security=security), 2)
+
+        # seller pk and number of different shareholders
+        mismatch = row(buyer, seller, 1)
+        mismatch['seller']['number'] = buyer.number
+        res = self.client.post('/services/rest/position/bulk', [mismatch],
+                               format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('seller', res.data[0])
+        self.assertEqual(Position.objects.count(), count + 2)
+
+        # malformed pks are reported per row
+        invalid_buyer, invalid_seller, invalid_security = [
+            row(buyer, seller, 1) for i in range(3)]
+        invalid_buyer['buyer']['pk'] = 'x'
+        invalid_seller['seller']['pk'] = None
+        invalid_security['security']['pk'] = 'x'
+        res = self.client.post(
+            '/services/rest/position/bulk',
+            [invalid_buyer, invalid_seller, invalid_security], format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('buyer', res.data[0])
+        self.assertIn('seller', res.data[1])
+        self.assertIn('security', res.data[2])
+        self.assertEqual(Position.objects.count(), count + 2)
+
+        # empty list
+        res = self.client.post('/services/rest/position/bulk', [],
+                               format='json')
+        self.assertEqual(res.status_code, 400)
+
     def test_add_position_missing_bought_at(self):
         """ must return proper error msg """
         operator = OperatorGenerator().generate()
@@ -2185,6 +2261,15 @@ class ShareholderViewSetTestCase(StripeTestCaseMixin, SubscriptionTestMixin,
         self.assertEqual(res.status_code, 200)
         self.assertEqual(res.data[security.pk], [u'1000-1200', 1666])
 
+        # segments owned at date
+        url = reverse('shareholders-number-segments', kwargs={'pk': shs[1].pk})
+        res = self.client.get(url, {'date': '2013-01-01T23:00:00.000Z'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data[security.pk], [])
+
+        res = self.client.get(url, {'date': 'foo'})
+        self.assertEqual(res.status_code, 400)
+
     def test_get_list(self):
         """
         check list for performance and content
@@ -2238,6 +2323,89 @@ class ShareholderViewSetTestCase(StripeTestCaseMixin, SubscriptionTestMixin,
         self.assertEqual([f['number'] for f in res.data['results']][:7],
                          natsorted(numbers, reverse=True)[1:])
 
+    def test_list_keyset_pagination(self):
+        """
+        cursor based pagination keeps ordering stable across pages
+        """
+        operator = OperatorGenerator().generate()
+        user = operator.user
+        numbers = ['1', '10', '2', '3', '11', '100', '0012']
+        for n in numbers:
+            mommy.make(Shareholder, company=operator.company, number=n)
+
+        self.client.force_login(user)
+        self.add_subscription(operator.company)
+
+        url = ('/services/rest/shareholders?ordering=-order_cache__number'
+               '&page_size=3&cursor=')
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(res.data['count'])
+        self.assertIsNone(res.data['current'])
+        self.assertIsNone(res.data['previous'])
+        first_page = [f['number'] for f in res.data['results']]
+        self.assertEqual(len(first_page), 3)
+
+        # walk all pages
+        result = list(first_page)
+        next_url = res.data['next']
+        while next_url:
+            res = self.client.get(next_url)
+            self.assertEqual(res.status_code, 200)
+            self.assertIsNotNone(res.data['previous'])
+            result.extend([f['number'] for f in res.data['results']])
+            next_url = res.data['next']
+
+        # same ordering as offset based pagination, no duplicates
+        res = self.client.get(
+            '/services/rest/shareholders?ordering=-order_cache__number')
+        self.assertEqual(result,
+                         [f['number'] for f in res.data['results']])
+
+        # second page back to first
+        res = self.client.get(url)
+        res = self.client.get(res.data['next'])
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([f['number'] for f in res.data['results']],
+                         first_page)
+
+        # optional count
+        res = self.client.get(url + '&count=exact')
+        self.assertEqual(res.data['count'], len(numbers))
+        res = self.client.get(url + '&count=estimate')
+        self.assertIsInstance(res.data['count'], int)
+
+        # broken cursor
+        res = self.client.get(url + 'foo')
+        self.assertEqual(res.status_code, 404)
+
+    def test_list_etag(self):
+        """
+        unchanged share register is answered with 304 not modified
+        """
+        operator = OperatorGenerator().generate()
+        shareholder = ShareholderGenerator().generate(company=operator.company)
+        self.client.force_login(operator.user)
+        self.add_subscription(operator.company)
+
+        url = '/services/rest/shareholders'
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        etag = res['ETag']
+        self.assertTrue(etag)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        # change of share register data invalidates etag
+        shareholder.number = u'999'
+        shareholder.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertIn(u'999', [s['number'] for s in res.data['results']])
+
     def test_get_detail(self):
         """
         check shareholder detail
@@ -1,7 +1,6 @@
 import dateutil.parser
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.db.models import Q
+from django.db.models import DecimalField
 from django.db.models.expressions import RawSQL
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
@@ -16,7 +15,9 @@ from rest_framework.views import APIView
 
 from company.mixins import SubscriptionViewMixin
 from reports.models import Report
-from services.rest.pagination import SmallPagePagination
+from services.rest.mixins import LedgerConditionalResponseMixin
+from services.rest.pagination import (KeysetPagination,
+                                      SmallPagePagination)
 from services.rest.permissions import (HasSubscriptionPermission,
                                        IsOperatorPermission,
                                        UserCanAddCompanyPermission)
@@ -35,6 +36,7 @@ from shareholder.models import (Bank, Company, Country, Operator, OptionPlan,
                                 OptionTransaction, Position, Security,
                                 Shareholder)
 from shareholder.tasks import update_order_cache_task
+from utils.cache import captable_cache
 from utils.session import get_company_from_request
 
 User = get_user_model()
@@ -118,7 +120,7 @@ class OperatorViewSet(viewsets.ModelViewSet):
 class PositionViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
     """ API endpoint to get positions """
     serializer_class = PositionSerializer
-    pagination_class = SmallPagePagination
+    pagination_class = KeysetPagination
     permission_classes = [
         IsOperatorPermission,
         HasSubscriptionPermission
@@ -140,9 +142,7 @@ class PositionViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
     def get_queryset(self):
         company = get_company_from_request(self.request)
         return Position.objects.filter(
-            Q(buyer__company=company) |
-            Q(seller__company=company)
-        ).distinct().order_by('-bought_at', '-pk')
+            company=company).order_by('-bought_at', '-pk')
 
     def destroy(self, request, pk=None):
         """ delete position. but not if is_draft-False"""
@@ -158,24 +158,24 @@ class PositionViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
                     position.buyer.pk,
                     timezone.now().date().isoformat(),
                     position.security.pk)
-                cache.set(cache_key, None)
+                captable_cache.set(cache_key, None)
                 cache_key = u"shareholder_share_count_{}_{}_{}".format(
                     position.buyer.pk,
                     timezone.now().date().isoformat(),
                     'None')
-                cache.set(cache_key, None)
+                captable_cache.set(cache_key, None)
             if position.seller:
                 update_order_cache_task.apply_async([position.seller.pk])
                 cache_key = u"shareholder_share_count_{}_{}_{}".format(
                     position.seller.pk,
                     timezone.now().date().isoformat(),
                     position.security.pk)
-                cache.set(cache_key, None)
+                captable_cache.set(cache_key, None)
                 cache_key = u"shareholder_share_count_{}_{}_{}".format(
                     position.seller.pk,
                     timezone.now().date().isoformat(),
                     'None')
-                cache.set(cache_key, None)
+                captable_cache.set(cache_key, None)
 
             # delete
             position.delete()
@@ -220,6 +220,19 @@ class PositionViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST)
 
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        book a list of positions at once. rows are validated in order
+        against the current holdings incl. the effects of previous rows and
+        stored in one transaction. errors are returned per row.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        bookings = serializer.save()
+        return Response({"success": True, "count": len(bookings)},
+                        status=status.HTTP_201_CREATED)
+
     @list_route(methods=['get'])
     def get_new_certificate_id(self, request):
         """
@@ -270,7 +283,7 @@ class OptionTransactionViewSet(SubscriptionViewMixin,
                                viewsets.ModelViewSet):
     """ API endpoint to get options """
     serializer_class = OptionTransactionSerializer
-    pagination_class = SmallPagePagination
+    pagination_class = KeysetPagination
     permission_classes = [
         IsOperatorPermission,
         HasSubscriptionPermission
@@ -293,9 +306,7 @@ class OptionTransactionViewSet(SubscriptionViewMixin,
 
     def get_queryset(self):
         company = get_company_from_request(self.request)
-        qs = OptionTransaction.objects.filter(
-            option_plan__company=company
-        )
+        qs = OptionTransaction.objects.filter(company=company)
 
         # filter if option plan is given in query params
         # FIXME: why no use filter or detail route???
@@ -305,6 +316,19 @@ class OptionTransactionViewSet(SubscriptionViewMixin,
 
         return qs
 
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        book a list of option transactions at once. rows are validated in
+        order against the current holdings incl. the effects of previous rows
+        and stored in one transaction. errors are returned per row.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        bookings = serializer.save()
+        return Response({"success": True, "count": len(bookings)},
+                        status=status.HTTP_201_CREATED)
+
     @detail_route(methods=['post'])
     def confirm(self, request, pk=None):
         """ confirm position and make it unchangable """
@@ -381,13 +405,14 @@ class SecurityViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
         return Security.objects.filter(company=company)
 
 
-class ShareholderViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
+class ShareholderViewSet(LedgerConditionalResponseMixin, SubscriptionViewMixin,
+                         viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
     # FIXME filter by user perms
     serializer_class = ShareholderSerializer
-    pagination_class = SmallPagePagination
+    pagination_class = KeysetPagination
     permission_classes = [
         IsOperatorPermission,
         HasSubscriptionPermission
@@ -408,7 +433,8 @@ class ShareholderViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
             prefix, order_by = self.request.GET.get('ordering').split('__')
             desc = prefix.startswith('-')
 
-            qs = qs.order_by(RawSQL("((order_cache->>%s)::numeric)", (order_by,)))
+            qs = qs.order_by(RawSQL("((order_cache->>%s)::numeric)",
+                                    (order_by,), output_field=DecimalField()))
             if desc:
                 qs = qs.reverse()
 
@@ -427,7 +453,8 @@ class ShareholderViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
 
         qs = Shareholder.objects.filter(company=company)
         qs = self._filter_queryset_by_order_cache(qs)
-        return qs.select_related('company', 'user', 'user__userprofile') \
+        return qs.select_related('company', 'company__country', 'user',
+                                 'user__userprofile') \
             .prefetch_related('user__operator_set') \
             .distinct()
 
@@ -438,41 +465,44 @@ class ShareholderViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
         #     return ShareholderSerializer
         return ShareholderSerializer
 
+    def list(self, request, *args, **kwargs):
+        company = get_company_from_request(request, fail_silently=True)
+        if not company:
+            return super(ShareholderViewSet, self).list(
+                request, *args, **kwargs)
+
+        return self.get_ledger_response(
+            request, company, super(ShareholderViewSet, self).list, request,
+            *args, **kwargs)
+
     @detail_route(methods=['get'])
     def number_segments(self, request, pk=None):
         shareholder = self.get_object()
-        kwargs = {}
-
-        if request.GET.get('date'):
-            # FIXME: parse date(time) properly
-            kwargs.update({'date': request.GET.get('date')[:10]})
-
-        data = {}
-        for security in shareholder.company.security_set.all():
-            if security.track_numbers:
-                kwargs.update({'security': security})
-                data.update({
-                    security.pk: shareholder.current_segments(**kwargs)
-                })
-        return Response(data, status=status.HTTP_200_OK)
+        return self.get_ledger_response(
+            request, shareholder.company, self._get_number_segments_response,
+            request, shareholder)
 
     @list_route(methods=['get'])
     def company_number_segments(self, request):
         company = get_company_from_request(request)
-        shareholder = company.get_company_shareholder()
-        kwargs = {}
+        return self.get_ledger_response(
+            request, company, self._get_number_segments_response, request,
+            company.get_company_shareholder())
 
+    def _get_number_segments_response(self, request, shareholder):
+        date = None
         if request.GET.get('date'):
-            # FIXME: parse date(time) properly
-            kwargs.update({'date': request.GET.get('date')[:10]})
-
-        data = {}
-        for security in shareholder.company.security_set.all():
-            if security.track_numbers:
-                kwargs.update({'security': security})
-                data.update({
-                    security.pk: shareholder.current_segments(**kwargs)
-                })
+            try:
+                date = dateutil.parser.parse(request.GET.get('date'))
+            except (ValueError, OverflowError):
+                return Response(
+                    {'date': [_('Invalid date.')]},
+                    status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_aware(date):
+                date = timezone.localtime(date)
+            date = date.date()
+
+        data = shareholder.current_segments_by_security(date=date)
         return Response(data, status=status.HTTP_200_OK)
 
     @list_route(methods=['get'])
@@ -487,6 +517,11 @@ class ShareholderViewSet(SubscriptionViewMixin, viewsets.ModelViewSet):
             return Response(Shareholder.objects.none())
 
         company = get_company_from_request(request)
+        return self.get_ledger_response(
+            request, company, self._get_option_holder_response, request,
+            company)
+
+    def _get_option_holder_response(self, request, company):
         ohs = company.get_active_option_holders()
 
         ohs = self.filter_queryset(ohs)
@@ -568,6 +603,11 @@ class AddShareSplit(APIView):
                 'execute_at': dateutil.parser.parse(data['execute_at']),
                 'security': Security.objects.get(id=data['security']['pk'])
             })
+            if data.get('dry_run'):
+                preview = company.split_shares(data, dry_run=True)
+                return Response({'success': True, 'data': preview},
+                                status=status.HTTP_200_OK)
+
             company.split_shares(data)
 
             positions = Position.objects.filter(
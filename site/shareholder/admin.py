@@ -13,9 +13,9 @@ from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from reversion.admin import VersionAdmin
 
-from shareholder.models import (Bank, Company, Country, Operator, OptionPlan,
-                                OptionTransaction, Position, Security,
-                                Shareholder, ShareholderStatement,
+from shareholder.models import (Bank, Company, Country, ImportRun, Operator,
+                                OptionPlan, OptionTransaction, Position,
+                                Security, Shareholder, ShareholderStatement,
                                 ShareholderStatementReport, UserProfile)
 
 
@@ -122,6 +122,25 @@ class BankAdmin(VersionAdmin):
     pass
 
 
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'company', 'filename', 'status', '_progress',
+                    '_rows_per_second', '_eta', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('offset', 'imported_count', 'row_count', 'error')
+
+    def _progress(self, obj):
+        return u'{:.1f}%'.format(obj.get_progress())
+    _progress.short_description = _('progress')
+
+    def _rows_per_second(self, obj):
+        return u'{:.0f}'.format(obj.get_rows_per_second())
+    _rows_per_second.short_description = _('rows/s')
+
+    def _eta(self, obj):
+        return obj.get_eta()
+    _eta.short_description = _('ETA')
+
+
 class OperatorAdmin(VersionAdmin):
     list_display = ('id', 'user', 'company', 'date_joined')
     list_filter = ('company',)
@@ -134,7 +153,7 @@ class PositionAdmin(VersionAdmin):
     list_display = (
         'bought_at', 'get_buyer', 'get_seller', 'count', 'value', 'get_company'
         )
-    list_filter = ('buyer__company', 'seller__company', 'depot_type')
+    list_filter = ('company', 'depot_type')
     search_fields = [
         'buyer__user__email', 'seller__user__email',
         'buyer__company__name', 'seller__company__name',
@@ -355,3 +374,4 @@ admin.site.register(ShareholderStatementReport,
                     ShareholderStatementReportAdmin)
 admin.site.register(ShareholderStatement, ShareholderStatementAdmin)
 admin.site.register(Bank, BankAdmin)
+admin.site.register(ImportRun, ImportRunAdmin)
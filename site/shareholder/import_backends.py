@@ -1,19 +1,31 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import hashlib
+import logging
+
 import requests
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 
 from shareholder.models import Bank
 
+logger = logging.getLogger(__name__)
+
+BANK_FIELDS = ('short_name', 'name', 'postal_code', 'address', 'city', 'swift')
+
 
 class SwissBankImportBackend(object):
 
+    checksum_cache_key = 'swiss-banks-import-checksum'
+
     def _call_url(self):
         return requests.get(settings.SWISS_BANKS_DOWNLOAD_URL, verify=False)
 
-    def _get_or_create_bank(self, data):
-        defaults = dict(
+    def _get_bank_kwargs(self, data):
+        """ return bank field values for a splitted line """
+        return dict(
             short_name=data['short_name'],
             name=data['name'],
             postal_code=data['postal_code'],
@@ -21,6 +33,9 @@ class SwissBankImportBackend(object):
             city=data['city'],
             swift=data['swift'],
         )
+
+    def _get_or_create_bank(self, data):
+        defaults = self._get_bank_kwargs(data)
         bank, created = Bank.objects.get_or_create(
             bcnr=data['bcnr'], branchid=data['branchid'],
             defaults=defaults)
@@ -69,15 +84,72 @@ class SwissBankImportBackend(object):
 
         return data
 
-    def update(self):
+    def _apply(self, lines):
         """
-        download and import swiss bank list
+        diff lines against the existing banks and write only new and changed
+        banks. returns dict with counts of `created`, `updated` and
+        `unchanged` banks
         """
-        response = self._call_url()
-        content = self._prepare_data(response)
-        lines = content.split('\n')
+        banks = {}
+        for bank in Bank.objects.all():
+            banks.setdefault((bank.bcnr, bank.branchid), bank)
 
-        # iterate and save/update to Banks model
-        for line in lines[:-1]:
+        result = dict(created=0, updated=0, unchanged=0)
+        new_banks = {}
+        changed_banks = {}
+        for line in lines:
+            if not line.strip():
+                continue
             data = self._split_line(line)
-            self._get_or_create_bank(data)
+            key = (data['bcnr'], data['branchid'])
+            kwargs = self._get_bank_kwargs(data)
+            bank = banks.get(key)
+            if bank is None:
+                # later lines of the same branch win, like with updates
+                new_banks[key] = Bank(bcnr=key[0], branchid=key[1], **kwargs)
+            elif any(getattr(bank, field) != kwargs[field]
+                     for field in BANK_FIELDS):
+                changed_banks[bank.pk] = kwargs
+            else:
+                result['unchanged'] += 1
+
+        with transaction.atomic():
+            Bank.objects.bulk_create(new_banks.values())
+            for pk, kwargs in changed_banks.items():
+                Bank.objects.filter(pk=pk).update(**kwargs)
+
+        result['created'] = len(new_banks)
+        result['updated'] = len(changed_banks)
+        return result
+
+    def update(self, filename=None, encoding='ISO-8859-1', force=False):
+        """
+        download and import swiss bank list. the import is skipped if the
+        list did not change since the last import. returns dict with counts
+        of `created`, `updated` and `unchanged` banks or None if skipped.
+
+        Keyword arguments:
+        filename -- import local file instead (default: None)
+        encoding -- encoding of the local file (default: ISO-8859-1)
+        force -- import even if the list did not change (default: False)
+        """
+        if filename:
+            with open(filename, 'rb') as f:
+                raw = f.read()
+            content = raw.decode(encoding)
+        else:
+            response = self._call_url()
+            raw = response.content
+            content = self._prepare_data(response)
+
+        checksum = hashlib.md5(raw).hexdigest()
+        if not force and cache.get(self.checksum_cache_key) == checksum:
+            logger.info('swiss bank list unchanged, import skipped')
+            return None
+
+        result = self._apply(content.split('\n'))
+        cache.set(self.checksum_cache_key, checksum, None)
+        logger.info('swiss bank list imported: {created} created, '
+                    '{updated} updated, {unchanged} unchanged'.format(
+                        **result))
+        return result
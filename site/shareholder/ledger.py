@@ -0,0 +1,425 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from shareholder.models import (Company, NumberAllocator, OptionTransaction,
+                                Position, SecurityPrice, Shareholder)
+from shareholder.tasks import update_order_cache_task
+from utils.cache import captable_cache
+from utils.formatters import deflate_segments, flatten_list, inflate_segments
+from utils.math import (intervals_to_segments, segments_to_intervals,
+                        substract_intervals, substract_list)
+
+logger = logging.getLogger(__name__)
+
+
+def _to_pk(value):
+    """ pk of raw request data as int, None if invalid """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_date(value):
+    """ date of `value` like stored in a DateField """
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.date()
+    return value
+
+
+def refresh_derived_caches(positions=(), option_transactions=()):
+    """
+    refresh order cache and share counts of all shareholders involved in
+    bulk created positions and option transactions and the security prices,
+    which skipped the post save signals
+    """
+    shareholder_pks = set()
+    security_pks = set()
+    price_keys = []
+    for position in positions:
+        shareholder_pks.update([position.buyer_id, position.seller_id])
+        security_pks.add(position.security_id)
+        if position.buyer_id and position.value:
+            price_keys.append((position.security_id, position.bought_at))
+    for option_transaction in option_transactions:
+        shareholder_pks.update([option_transaction.buyer_id,
+                                option_transaction.seller_id])
+    shareholder_pks.discard(None)
+
+    if price_keys:
+        SecurityPrice.refresh(price_keys)
+        # prices might have been cached since the bookings touched the ledger
+        Company.touch_ledgers(Company.objects.filter(
+            security__in=[key[0] for key in price_keys]), dependencies=())
+
+    today = timezone.now().date().isoformat()
+    cache_keys = []
+    for pk in shareholder_pks:
+        update_order_cache_task.apply_async([pk])
+        for security_pk in list(security_pks) + ['None']:
+            cache_keys.append(u"shareholder_share_count_{}_{}_{}".format(
+                pk, today, security_pk))
+    captable_cache.delete_many(cache_keys)
+
+
+class Ledger(object):
+    """
+    in-memory view of the holdings of a company. loads all data needed to
+    validate a batch of bookings with a few queries. bookings added to the
+    ledger are visible to all following lookups and are written to the db in
+    bulk with `save`.
+
+    holdings are loaded for `holders` (shareholder pks, usually all sellers
+    of the batch) upfront, other shareholders are loaded on first lookup.
+    bookings are only tracked for loaded shareholders, hence every
+    shareholder which is looked up must be part of `holders`.
+    """
+
+    def __init__(self, company, holders=(), shareholder_pks=(),
+                 shareholder_numbers=()):
+        self.company = company
+        self.company_shareholder = company.get_company_shareholder()
+        self.securities = {
+            s.pk: s for s in company.security_set.all()}
+        self.option_plans = {
+            op.pk: op for op in company.optionplan_set.all()}
+        self.shareholders = {self.company_shareholder.pk:
+                             self.company_shareholder}
+        self._shareholder_numbers = {self.company_shareholder.number:
+                                     self.company_shareholder}
+        self.certificate_ids = self._get_certificate_ids()
+
+        self.positions = []
+        self.option_transactions = []
+        self.share_count_increase = 0
+        self._changed_securities = set()
+        self._option_plan_intervals = None
+        # (shareholder pk, security pk) -> list of
+        # (bought_at, signed count, in depot, vesting expires at, segments)
+        self._shares = defaultdict(list)
+        # (shareholder pk, security pk) -> list of
+        # (bought_at, signed count, segments)
+        self._options = defaultdict(list)
+        self._loaded = set()
+
+        self._load_shareholders(shareholder_pks, shareholder_numbers)
+        self._options_created = self._get_options_created()
+        self._load_holdings(holders)
+
+    # --- LOADING
+
+    def _get_certificate_ids(self):
+        positions = Position.objects.filter(
+            company=self.company, certificate_id__isnull=False)
+        option_transactions = OptionTransaction.objects.filter(
+            company=self.company, certificate_id__isnull=False)
+        return (
+            set(positions.values_list('certificate_id', flat=True)) |
+            set(option_transactions.values_list('certificate_id', flat=True)))
+
+    def _get_options_created(self):
+        """
+        return dict security pk -> count of shares granted as options, same as
+        `Company.get_total_options`
+        """
+        options_created = defaultdict(int)
+        qs = OptionTransaction.objects.filter(
+            Q(seller__isnull=True) | Q(buyer__isnull=True),
+            company=self.company).values(
+                'option_plan__security', 'buyer').annotate(
+                    count=Sum('count'))
+        for row in qs:
+            sign = row['buyer'] is None and -1 or 1
+            options_created[row['option_plan__security']] += (
+                sign * row['count'])
+        return options_created
+
+    def _load_shareholders(self, pks, numbers):
+        pks, numbers = set(pks), set(numbers)
+        if not pks and not numbers:
+            return
+        qs = Shareholder.objects.filter(
+            Q(pk__in=pks) | Q(number__in=numbers),
+            company=self.company).select_related('user')
+        for shareholder in qs:
+            self.shareholders[shareholder.pk] = shareholder
+            self._shareholder_numbers[shareholder.number] = shareholder
+
+    def _load_holdings(self, holders):
+        """ read share and option holdings for shareholder pks """
+        holders = set(holders) - self._loaded
+        if not holders:
+            return
+        self._loaded |= holders
+
+        positions = Position.objects.filter(
+            Q(buyer__in=holders) | Q(seller__in=holders)).values_list(
+                'buyer', 'seller', 'security', 'bought_at', 'count',
+                'number_segments', 'vesting_expires_at', 'certificate_id',
+                'certificate_invalidation_position',
+                'certificate_initial_position')
+        for (buyer, seller, security, bought_at, count, segments,
+             vesting_expires_at, certificate_id, invalidation_position,
+             initial_position) in positions:
+            if buyer in holders:
+                # shares stored in certificate depot are not sellable
+                in_depot = bool(certificate_id and not invalidation_position
+                                and not initial_position)
+                self._shares[(buyer, security)].append(
+                    (bought_at, count, in_depot, vesting_expires_at,
+                     segments or []))
+            if seller in holders:
+                self._shares[(seller, security)].append(
+                    (bought_at, -count, False, None, segments or []))
+
+        option_transactions = OptionTransaction.objects.filter(
+            Q(buyer__in=holders) | Q(seller__in=holders)).values_list(
+                'buyer', 'seller', 'option_plan__security', 'bought_at',
+                'count', 'number_segments')
+        for (buyer, seller, security, bought_at, count,
+             segments) in option_transactions:
+            if buyer in holders:
+                self._options[(buyer, security)].append(
+                    (bought_at, count, segments or []))
+            if seller in holders:
+                self._options[(seller, security)].append(
+                    (bought_at, -count, segments or []))
+
+    # --- LOOKUPS
+
+    def get_shareholder(self, pk=None, number=None):
+        """ return shareholder of the company by pk or number or None """
+        if pk is not None:
+            return self.shareholders.get(_to_pk(pk))
+        return self._shareholder_numbers.get(number)
+
+    def get_security(self, pk=None, title=None, face_value=None):
+        """ return security of the company by pk or title and face value """
+        if pk is not None:
+            return self.securities.get(_to_pk(pk))
+        for security in self.securities.values():
+            if (security.title == title and
+                    security.face_value == face_value):
+                return security
+
+    def get_option_plan(self, pk):
+        return self.option_plans.get(_to_pk(pk))
+
+    def has_certificate_id(self, certificate_id):
+        return certificate_id in self.certificate_ids
+
+    def get_option_plan_intervals(self):
+        """ same as `Company.get_option_plan_intervals` """
+        if self._option_plan_intervals is None:
+            self._option_plan_intervals = segments_to_intervals(flatten_list(
+                [op.number_segments for op in self.option_plans.values()]))
+        return self._option_plan_intervals
+
+    def share_count_sellable(self, shareholder_pk, security_pk, date=None):
+        """
+        same as `Shareholder.share_count_sellable` for one security, shares
+        with vesting running on `date` are not sellable
+        """
+        self._load_holdings([shareholder_pk])
+        date = _to_date(date) or timezone.now().date()
+        count = sum(
+            count for bought_at, count, in_depot, vesting_expires_at, segments
+            in self._shares[(shareholder_pk, security_pk)]
+            if bought_at <= date and not in_depot and not (
+                vesting_expires_at and vesting_expires_at > date))
+        if shareholder_pk == self.company_shareholder.pk:
+            count -= self._options_created.get(security_pk, 0)
+        return count
+
+    def options_count(self, shareholder_pk, security_pk, date=None):
+        """ same as `Shareholder.options_count` for one security """
+        self._load_holdings([shareholder_pk])
+        date = _to_date(date) or timezone.now().date()
+        return sum(
+            count for bought_at, count, segments
+            in self._options[(shareholder_pk, security_pk)]
+            if bought_at <= date)
+
+    def current_segments(self, shareholder_pk, security_pk, date=None):
+        """ same as `Shareholder.current_segments` """
+        self._load_holdings([shareholder_pk])
+        date = _to_date(date) or timezone.now().date()
+        entries = [entry for entry in self._shares[(shareholder_pk,
+                                                    security_pk)]
+                   if entry[0] <= date]
+        bought = flatten_list([e[4] for e in entries if e[1] > 0])
+        sold = flatten_list([e[4] for e in entries if e[1] < 0])
+        return deflate_segments(substract_list(
+            inflate_segments(bought), inflate_segments(sold)))
+
+    def current_options_segments(self, shareholder_pk, security_pk,
+                                 date=None):
+        """ same as `Shareholder.current_options_segments` """
+        self._load_holdings([shareholder_pk])
+        date = _to_date(date) or timezone.now().date()
+        entries = [entry for entry in self._options[(shareholder_pk,
+                                                     security_pk)]
+                   if entry[0] <= date]
+        bought = Counter(inflate_segments(
+            flatten_list([e[2] for e in entries if e[1] > 0])))
+        sold = Counter(inflate_segments(
+            flatten_list([e[2] for e in entries if e[1] < 0])))
+        return deflate_segments(set(bought - sold))
+
+    def owns_segments(self, shareholder_pk, segments, security_pk):
+        """ same as `Shareholder.owns_segments` """
+        owning = inflate_segments(
+            self.current_segments(shareholder_pk, security_pk))
+        failed = substract_list(inflate_segments(segments), owning)
+        return (len(failed) == 0, deflate_segments(failed),
+                deflate_segments(owning))
+
+    def owns_options_segments(self, shareholder_pk, segments, security_pk):
+        """ same as `Shareholder.owns_options_segments` """
+        owning = segments_to_intervals(
+            self.current_options_segments(shareholder_pk, security_pk))
+        failed = substract_intervals(segments_to_intervals(segments), owning)
+        return (len(failed) == 0, intervals_to_segments(failed),
+                intervals_to_segments(owning))
+
+    # --- BOOKING
+
+    def add_position(self, position):
+        """
+        add unsaved position to the ledger. capital increases extend the
+        company share count and the number segments of the security
+        """
+        # bulk_create skips `Position.save`, set denormalized fields here
+        position.company_id = self.company.pk
+        position.update_vesting_expires_at()
+        bought_at = _to_date(position.bought_at)
+        segments = position.number_segments or []
+        if position.buyer_id in self._loaded:
+            self._shares[(position.buyer_id, position.security_id)].append(
+                (bought_at, position.count, bool(position.certificate_id),
+                 _to_date(position.vesting_expires_at), segments))
+        if position.seller_id in self._loaded:
+            self._shares[(position.seller_id, position.security_id)].append(
+                (bought_at, -position.count, False, None, segments))
+
+        if not position.seller_id:
+            self.share_count_increase += position.count
+            security = self.securities[position.security_id]
+            if security.track_numbers and segments:
+                security.number_segments.extend(segments)
+                self._changed_securities.add(security)
+
+        if position.certificate_id:
+            self.certificate_ids.add(position.certificate_id)
+        self.positions.append(position)
+
+    def add_option_transaction(self, option_transaction):
+        """ add unsaved option transaction to the ledger """
+        option_transaction.company_id = self.company.pk
+        option_transaction.update_vesting_expires_at()
+        bought_at = _to_date(option_transaction.bought_at)
+        security_pk = self.option_plans[
+            option_transaction.option_plan_id].security_id
+        segments = option_transaction.number_segments or []
+        # options created or destroyed reduce the company shareholders shares
+        if not option_transaction.seller_id:
+            self._options_created[security_pk] += option_transaction.count
+        elif not option_transaction.buyer_id:
+            self._options_created[security_pk] -= option_transaction.count
+        if option_transaction.buyer_id in self._loaded:
+            self._options[(option_transaction.buyer_id, security_pk)].append(
+                (bought_at, option_transaction.count, segments))
+        if option_transaction.seller_id in self._loaded:
+            self._options[(option_transaction.seller_id, security_pk)].append(
+                (bought_at, -option_transaction.count, segments))
+
+        if option_transaction.certificate_id:
+            self.certificate_ids.add(option_transaction.certificate_id)
+        self.option_transactions.append(option_transaction)
+
+    def save(self):
+        """
+        write all added bookings in one transaction with bulk inserts and
+        refresh derived caches (order cache, share counts) once per
+        shareholder. returns list of booked objects
+
+        sellers are locked and the batch is checked again against their
+        committed holdings, raises `ValidationError` if a concurrent booking
+        sold their shares or options meanwhile. options created without
+        seller lock the company shareholder, whose sellable shares they reduce
+        """
+        sellers = set(booking.seller_id for booking in
+                      self.positions + self.option_transactions
+                      if booking.seller_id)
+        if [ot for ot in self.option_transactions if not ot.seller_id]:
+            sellers.add(self.company_shareholder.pk)
+        with transaction.atomic():
+            list(Shareholder.objects.select_for_update().filter(
+                pk__in=sellers).order_by('pk').values_list('pk', flat=True))
+            self._check_sellable(sellers)
+            if self.share_count_increase:
+                Company.objects.filter(pk=self.company.pk).update(
+                    share_count=F('share_count') + self.share_count_increase)
+            for security in self._changed_securities:
+                security.save()
+            Position.objects.bulk_create(self.positions)
+            OptionTransaction.objects.bulk_create(self.option_transactions)
+            NumberAllocator.register(
+                self.company, 'certificate_id',
+                [booking.certificate_id for booking in
+                 self.positions + self.option_transactions
+                 if booking.certificate_id])
+            self.company.touch_ledger(dependencies=('positions',))
+
+        # bulk_create skips post_save signals, refresh caches once
+        refresh_derived_caches(self.positions, self.option_transactions)
+
+        logger.info('booked {} positions and {} option transactions'.format(
+            len(self.positions), len(self.option_transactions)))
+
+        return self.positions + self.option_transactions
+
+    def _check_sellable(self, sellers):
+        """ replay bookings on a fresh ledger of the committed holdings """
+        ledger = Ledger(self.company, holders=sellers)
+        for position in self.positions:
+            seller_pk, security_pk = position.seller_id, position.security_id
+            if seller_pk and (
+                    position.count > ledger.share_count_sellable(
+                        seller_pk, security_pk, date=position.bought_at) or
+                    (self.securities[security_pk].track_numbers and
+                     position.number_segments and not ledger.owns_segments(
+                         seller_pk, position.number_segments,
+                         security_pk)[0])):
+                raise ValidationError(
+                    _('{} does not own enough sellable shares anymore.'
+                      '').format(self.get_shareholder(pk=seller_pk)))
+            ledger.add_position(position)
+
+        for option_transaction in self.option_transactions:
+            seller_pk = option_transaction.seller_id
+            security_pk = self.option_plans[
+                option_transaction.option_plan_id].security_id
+            if seller_pk and (
+                    option_transaction.count > ledger.options_count(
+                        seller_pk, security_pk) or
+                    (self.securities[security_pk].track_numbers and
+                     option_transaction.number_segments and
+                     not ledger.owns_options_segments(
+                         seller_pk, option_transaction.number_segments,
+                         security_pk)[0])):
+                raise ValidationError(
+                    _('{} does not own enough options anymore.'
+                      '').format(self.get_shareholder(pk=seller_pk)))
+            ledger.add_option_transaction(option_transaction)
@@ -12,12 +12,21 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'import latest swiss bank list'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', dest='filename', default=None,
+            help='Import local bank list (ISO-8859-1) instead of downloading')
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help='Import even if the bank list did not change')
+
     def handle(self, *args, **options):
         """
         main call for management command. prepares data and sends it to backend
         """
         try:
             logger.info('fetch swiss banks list ...')
-            SwissBankImportBackend().update()
+            SwissBankImportBackend().update(filename=options['filename'],
+                                            force=options['force'])
         except Exception as e:
             raise CommandError('Company reset failed with "{}"'.format(e))
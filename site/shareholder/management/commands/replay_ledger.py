@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shareholder.models import Company
+from shareholder.replay import LedgerReplay
+
+
+class Command(BaseCommand):
+    help = 'replay all bookings of a company and check share register'
+
+    def add_arguments(self, parser):
+        parser.add_argument('company_pk', type=int)
+        parser.add_argument(
+            '--balances', action='store_true', dest='balances', default=False,
+            help='Print share count per shareholder and security')
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.get(pk=options['company_pk'])
+        except Company.DoesNotExist:
+            raise CommandError('Company {} does not exist'.format(
+                options['company_pk']))
+
+        replay = LedgerReplay(company)
+        replay.replay()
+        self.stdout.write(
+            u'{} positions and {} option transactions replayed in '
+            u'{:.2f}s'.format(replay.position_count,
+                              replay.option_transaction_count,
+                              replay.duration))
+
+        for row in replay.negative_balances:
+            self.stdout.write(self.style.ERROR(
+                u'negative share count {count} of shareholder '
+                u'{shareholder} for security {security} on {date}'.format(
+                    **row)))
+        for row in replay.negative_options:
+            self.stdout.write(self.style.ERROR(
+                u'negative option count {count} of shareholder '
+                u'{shareholder} for option plan {option_plan} on '
+                u'{date}'.format(**row)))
+        for row in replay.double_owned_numbers:
+            self.stdout.write(self.style.ERROR(
+                u'share numbers {} of security {} owned by shareholders '
+                u'{}'.format(row['segments'], row['security'],
+                             row['shareholders'])))
+        for row in replay.unowned_numbers:
+            self.stdout.write(self.style.ERROR(
+                u'share numbers {segments} of security {security} sold by '
+                u'shareholder {shareholder} without owning them on '
+                u'{date}'.format(**row)))
+        for row in replay.option_overgrants:
+            self.stdout.write(self.style.ERROR(
+                u'option plan {option_plan} granted {granted} of {approved} '
+                u'approved options'.format(**row)))
+
+        if options['balances']:
+            for shareholder, counts in sorted(replay.get_balances().items()):
+                for security, count in sorted(counts.items()):
+                    self.stdout.write(u'{}\t{}\t{}'.format(
+                        shareholder, security, count))
+
+        if not replay.is_consistent():
+            raise CommandError('Share register is inconsistent')
+        self.stdout.write(self.style.SUCCESS('Share register is consistent'))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-01 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0082_auto_20170522_1919'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='ledger_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='last change of any share register data (positions, options, shareholders, ...) of the company'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-08 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0083_company_ledger_changed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=500, verbose_name='filename')),
+                ('backend', models.CharField(max_length=100, verbose_name='import backend')),
+                ('status', models.CharField(choices=[('running', 'running'), ('failed', 'failed'), ('finished', 'finished')], default='running', max_length=10, verbose_name='status')),
+                ('row_count', models.PositiveIntegerField(default=0, verbose_name='rows in file')),
+                ('offset', models.PositiveIntegerField(default=0, verbose_name='rows committed')),
+                ('imported_count', models.PositiveIntegerField(default=0, verbose_name='rows imported')),
+                ('start_offset', models.PositiveIntegerField(default=0, editable=False)),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='started at')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finished at')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shareholder.Company', verbose_name='company')),
+            ],
+            options={
+                'verbose_name': 'import run',
+                'verbose_name_plural': 'import runs',
+            },
+        ),
+    ]
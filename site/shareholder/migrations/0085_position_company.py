@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-12 14:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0084_importrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optiontransaction',
+            name='company',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='shareholder.Company'),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='company',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='shareholder.Company'),
+        ),
+        # backfill in the db, too many rows to do it with the orm
+        migrations.RunSQL(
+            """
+            UPDATE shareholder_position AS p SET company_id = s.company_id
+            FROM shareholder_security AS s WHERE p.security_id = s.id;
+            UPDATE shareholder_optiontransaction AS o
+            SET company_id = op.company_id
+            FROM shareholder_optionplan AS op WHERE o.option_plan_id = op.id;
+            """,
+            migrations.RunSQL.noop),
+        migrations.AlterIndexTogether(
+            name='optiontransaction',
+            index_together=set([('company', 'option_plan', 'bought_at')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='position',
+            index_together=set([('company', 'security', 'bought_at')]),
+        ),
+    ]
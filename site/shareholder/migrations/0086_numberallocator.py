@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-14 09:21
+from __future__ import unicode_literals
+
+import re
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# highest value of a bigint column
+MAX_NUMBER = 2 ** 63 - 1
+
+
+def _to_number(value):
+    """
+    digits of `value` joined to one number, 0 if there are none or if they
+    exceed `MAX_NUMBER`
+    """
+    digits = ''.join(re.findall(r'\d+', value or ''))
+    number = digits and int(digits) or 0
+    return number if number <= MAX_NUMBER else 0
+
+
+def seed_number_allocators(apps, schema_editor):
+    """
+    set allocators to the highest certificate id and shareholder number in
+    use per company, the dispo shareholder does not count
+    """
+    Company = apps.get_model('shareholder', 'Company')
+    NumberAllocator = apps.get_model('shareholder', 'NumberAllocator')
+    OptionTransaction = apps.get_model('shareholder', 'OptionTransaction')
+    Position = apps.get_model('shareholder', 'Position')
+    Shareholder = apps.get_model('shareholder', 'Shareholder')
+
+    dispo_pks = set()
+    connection = schema_editor.connection
+    # tagging is no dependency, its tables are missing on fresh databases
+    if 'tagging_taggeditem' in connection.introspection.table_names():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT i.object_id FROM tagging_taggeditem i "
+                "JOIN tagging_tag t ON t.id = i.tag_id "
+                "JOIN django_content_type c ON c.id = i.content_type_id "
+                "WHERE t.name = %s AND c.app_label = %s AND c.model = %s",
+                ['dispo_shareholder', 'shareholder', 'shareholder'])
+            dispo_pks = set(row[0] for row in cursor.fetchall())
+
+    certificate_ids = defaultdict(int)
+    for model in (Position, OptionTransaction):
+        for company, certificate_id in model.objects.filter(
+                certificate_id__isnull=False).values_list(
+                    'company', 'certificate_id').iterator():
+            certificate_ids[company] = max(certificate_ids[company],
+                                           _to_number(certificate_id))
+
+    shareholder_numbers = defaultdict(int)
+    for company, pk, number in Shareholder.objects.values_list(
+            'company', 'pk', 'number').iterator():
+        if pk not in dispo_pks:
+            shareholder_numbers[company] = max(shareholder_numbers[company],
+                                               _to_number(number))
+
+    NumberAllocator.objects.bulk_create([
+        NumberAllocator(company_id=pk, certificate_id=certificate_ids[pk],
+                        shareholder_number=shareholder_numbers[pk])
+        for pk in Company.objects.values_list('pk', flat=True)],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0085_position_company'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberAllocator',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('certificate_id', models.BigIntegerField(default=0)),
+                ('shareholder_number', models.BigIntegerField(default=0)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='number_allocator', to='shareholder.Company')),
+            ],
+        ),
+
+        # data migration
+        migrations.RunPython(seed_number_allocators,
+                             migrations.RunPython.noop),
+    ]
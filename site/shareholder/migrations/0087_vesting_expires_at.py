@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-16 11:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0086_numberallocator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optiontransaction',
+            name='vesting_expires_at',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='vesting_expires_at',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        # backfill, adding months clips to the end of month like relativedelta
+        migrations.RunSQL(
+            """
+            UPDATE shareholder_position
+            SET vesting_expires_at = (
+                bought_at + vesting_months * interval '1 month')::date
+            WHERE vesting_months > 0;
+            UPDATE shareholder_optiontransaction
+            SET vesting_expires_at = (
+                bought_at + vesting_months * interval '1 month')::date
+            WHERE vesting_months > 0;
+            """,
+            migrations.RunSQL.noop),
+    ]
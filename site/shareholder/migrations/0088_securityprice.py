@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-19 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0087_vesting_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecurityPrice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('value', models.DecimalField(decimal_places=4, max_digits=16)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shareholder.Company')),
+                ('position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shareholder.Position')),
+                ('security', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shareholder.Security')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='securityprice',
+            unique_together=set([('security', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='securityprice',
+            index_together=set([('company', 'date')]),
+        ),
+        # last valued trade per security and day
+        migrations.RunSQL(
+            """
+            INSERT INTO shareholder_securityprice
+                (company_id, security_id, date, value, position_id)
+            SELECT DISTINCT ON (p.security_id, p.bought_at)
+                s.company_id, p.security_id, p.bought_at, p.value, p.id
+            FROM shareholder_position AS p
+            JOIN shareholder_security AS s ON s.id = p.security_id
+            WHERE p.buyer_id IS NOT NULL AND p.value > 0
+            ORDER BY p.security_id, p.bought_at, p.id DESC;
+            """,
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-21 08:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0088_securityprice'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='numberallocator',
+            name='certificate_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='numberallocator',
+            name='shareholder_number',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
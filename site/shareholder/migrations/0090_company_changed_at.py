@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2017-06-22 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shareholder', '0089_numberallocator_bigint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='positions_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='last change of positions, options, securities or share count'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='shareholders_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='last change of shareholders or their users'),
+        ),
+    ]
@@ -6,6 +6,7 @@ from django.conf import settings
 from django.contrib.auth import decorators as auth_decorators
 from django.contrib.auth import login, logout
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.authtoken.models import Token
@@ -102,6 +103,21 @@ class AddressModelMixin(models.Model):
         """
         return all(getattr(self, fn) for fn in self.REQUIRED_ADDRESS_FIELDS)
 
+    @classmethod
+    def get_has_address_query(cls, prefix=''):
+        """
+        return Q object matching the same objects as `has_address` to filter
+        in the DB. `prefix` is the lookup path to this model, e.g.
+        'user__userprofile__'
+        """
+        query = Q()
+        for fieldname in cls.REQUIRED_ADDRESS_FIELDS:
+            lookup = u'{}{}'.format(prefix, fieldname)
+            query &= Q(**{lookup + '__isnull': False})
+            if not cls._meta.get_field(fieldname).is_relation:
+                query &= ~Q(**{lookup: ''})
+        return query
+
     def read_address_from_stripe_object(self, stripe_data, save=True):
         """
         update address information for object from stripe data
@@ -133,7 +149,12 @@ class DiscountedTaxByVestingModelMixin(object):
 
         return self.bought_at + relativedelta(months=self.vesting_months)
 
-    vesting_expires_at = property(get_vesting_expires_at)
+    def update_vesting_expires_at(self):
+        """
+        store vesting expiration date for queries, None without vesting
+        """
+        self.vesting_expires_at = (
+            self.vesting_months and self.get_vesting_expires_at() or None)
 
     def get_discounted_tax_ratio(self, date=None):
         """ return percent of discount for tax reduction for management owning
@@ -144,7 +165,7 @@ class DiscountedTaxByVestingModelMixin(object):
         today = date or timezone.now().date()
         # rounding up!
         years_to_go = int(math.ceil((
-            self.vesting_expires_at - today).days / 365))
+            self.get_vesting_expires_at() - today).days / 365))
 
         # vesting is expired
         if years_to_go < 1:
@@ -1,9 +1,10 @@
+import datetime
 import logging
 import math
 import os
 import re
 import time
-from collections import Counter
+from collections import Counter, defaultdict
 from decimal import Decimal
 
 from dateutil.relativedelta import relativedelta
@@ -17,8 +18,9 @@ from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
 from django.core.urlresolvers import reverse
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Q, Sum
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Greatest
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.loader import select_template
@@ -30,7 +32,6 @@ from django.utils.translation import activate as activate_lang
 from django.utils.translation import ugettext as _
 from django_languages import fields as language_fields
 from djstripe.models import Customer as DjStripeCustomer
-from natsort import natsorted
 from rest_framework.authtoken.models import Token
 from sorl.thumbnail import get_thumbnail
 from tagging.models import Tag
@@ -41,8 +42,10 @@ from shareholder.validators import ShareRegisterValidator
 from utils.formatters import (deflate_segments, flatten_list,
                               human_readable_segments, inflate_segments,
                               string_list_to_json)
+from utils.cache import captable_cache
 from utils.files import human_readable_file_size
-from utils.math import substract_list
+from utils.math import (intervals_to_segments, segments_to_intervals,
+                        substract_intervals, substract_list)
 from utils.pdf import render_pdf, merge_pdf
 
 from .mixins import AddressModelMixin
@@ -67,6 +70,11 @@ MAILING_TYPES = [
 
 DISPO_SHAREHOLDER_TAG = 'dispo_shareholder'
 TRANSFER_SHAREHOLDER_TAG = 'transfer_shareholder'
+# kinds of share register data tracked with `Company.<kind>_changed_at`
+LEDGER_DEPENDENCIES = ('positions', 'shareholders')
+# company pk -> last ledger change made by this process, seen by all company
+# instances of the process, see `Company.get_ledger_cache_key`
+_ledger_changes = {}
 
 logger = logging.getLogger(__name__)
 
@@ -178,6 +186,17 @@ class Company(AddressModelMixin, models.Model):
     send_shareholder_statement_via_letter_enabled = models.BooleanField(
         _('Is sending the shareholder statement via snail mail enabled'),
         default=False)
+    ledger_changed_at = models.DateTimeField(
+        _('last change of any share register data (positions, options, '
+          'shareholders, ...) of the company'),
+        default=timezone.now, editable=False)
+    # changes per kind of data, see `LEDGER_DEPENDENCIES`
+    positions_changed_at = models.DateTimeField(
+        _('last change of positions, options, securities or share count'),
+        default=timezone.now, editable=False)
+    shareholders_changed_at = models.DateTimeField(
+        _('last change of shareholders or their users'),
+        default=timezone.now, editable=False)
 
     # pdf invoice
     invoice_template = 'pdf/invoice.pdf.html'  # shareholder/templates
@@ -202,8 +221,10 @@ class Company(AddressModelMixin, models.Model):
         )
 
         if len(partials) > 0:
+            shareholders = Shareholder.objects.select_related('user').in_bulk(
+                partials.keys())
             for id, part in partials.iteritems():
-                s = Shareholder.objects.get(id=id)
+                s = shareholders[id]
                 message = message + _(u"{}{}({}): {} shares\n").format(
                     s.user.first_name,
                     s.user.last_name,
@@ -228,10 +249,60 @@ class Company(AddressModelMixin, models.Model):
                 operators))
 
     # --- GETTER
+    def get_ledger_cache_key(self, *parts):
+        """
+        return cache key which is valid until the share register data of the
+        company changes.
+
+        the ledger timestamp is read from the db on the first call only, so
+        an instance serves one request or task with one query. changes made
+        by this process afterwards (signals, `touch_ledgers`) are seen by
+        all instances, changes of other processes only after
+        `refresh_ledger_changed_at` is called.
+        """
+        if not getattr(self, '_ledger_changed_at_loaded', False):
+            self.refresh_ledger_changed_at()
+        changed_at = _ledger_changes.get(self.pk)
+        if changed_at and changed_at > self.ledger_changed_at:
+            self.ledger_changed_at = changed_at
+        return u'company-{}-{}-{}'.format(
+            self.pk, self.ledger_changed_at.strftime('%Y%m%d%H%M%S%f'),
+            u'-'.join([slugify(u'{}'.format(part)) for part in parts]))
+
+    def refresh_ledger_changed_at(self):
+        """ read `ledger_changed_at` from the db, returns it """
+        self.ledger_changed_at = Company.objects.filter(
+            pk=self.pk).values_list('ledger_changed_at', flat=True).get()
+        self._ledger_changed_at_loaded = True
+        return self.ledger_changed_at
+
     def shareholder_count(self):
         """ total count of active Shareholders """
         return Position.objects.filter(
-            buyer__company=self, seller__isnull=True).count()
+            company=self, seller__isnull=True).count()
+
+    def get_active_shareholder_count(self, date=None):
+        """
+        count of shareholders holding shares on `date` except the company
+        shareholder (number 0), computed with aggregate queries. used for
+        billing
+        """
+        positions = Position.objects.filter(company=self)
+        if date:
+            positions = positions.filter(bought_at__lte=date)
+
+        counts = defaultdict(int)
+        for pk, count in positions.filter(buyer__isnull=False).values_list(
+                'buyer').annotate(count=Sum('count')):
+            counts[pk] += count
+        for pk, count in positions.filter(seller__isnull=False).values_list(
+                'seller').annotate(count=Sum('count')):
+            counts[pk] -= count
+
+        excluded = set(self.shareholder_set.filter(number='0').values_list(
+            'pk', flat=True))
+        return len([pk for pk, count in counts.items()
+                    if count > 0 and pk not in excluded])
 
     def full_validate(self):
         """
@@ -240,13 +311,29 @@ class Company(AddressModelMixin, models.Model):
         validator = ShareRegisterValidator(self)
         return validator.is_valid()
 
+    def get_register_health(self, schedule=False):
+        """
+        return result of the last share register validation without
+        validating, see `ShareRegisterValidator.get_health`. with `schedule`
+        a validation is queued once per ledger state if the register was
+        never validated or changed since
+        """
+        from .tasks import validate_share_register_task
+
+        health = ShareRegisterValidator(self).get_health()
+        if (schedule and (not health or health['is_outdated']) and
+                cache.add(self.get_ledger_cache_key('validation-scheduled'),
+                          True, 60*60*24)):
+            validate_share_register_task.delay(self.pk)
+        return health
+
     def get_active_shareholders(self, date=None, security=None):
         """ returns list of all active shareholders. this is a very expensive
         must use heavy caching"""
-        cache_key = 'company-{}-{}-{}-active-shareholders'.format(
+        cache_key = 'company-{}-active-shareholders-{}-{}'.format(
             self.pk, slugify((date or timezone.now().date()).isoformat()),
             slugify(security))
-        cached = cache.get(cache_key)
+        cached = captable_cache.get(cache_key)
         if cached:
             return Shareholder.objects.filter(pk__in=cached).select_related(
                 'user', 'user__userprofile', 'user__userprofile__country',
@@ -269,10 +356,10 @@ class Company(AddressModelMixin, models.Model):
             'user', 'user__userprofile', 'user__userprofile__country', 'company'
         ).order_by('number')
 
-        # result can be large. memcache has 1MB cache limit... see
-        # https://goo.gl/CFDsi3 for more details
-        cache.set(cache_key, list(result.values_list('pk', flat=True)),
-                  60*60*24)
+        # result can be large, captable_cache splits values exceeding the
+        # memcache 1MB limit, see https://goo.gl/CFDsi3 for more details
+        captable_cache.set(
+            cache_key, list(result.values_list('pk', flat=True)), 60*60*24)
         return result
 
     def get_active_option_holders(self, date=None, security=None):
@@ -325,6 +412,20 @@ class Company(AddressModelMixin, models.Model):
             'number_segments', flat=True)
         return flatten_list(segments)
 
+    def get_option_plan_intervals(self):
+        """
+        return sorted and merged intervals [(start, end), ...] of all number
+        segments reserved for option plans. cached until the share register
+        changes
+        """
+        cache_key = self.get_ledger_cache_key('option-plan-intervals')
+        intervals = captable_cache.get(cache_key)
+        if intervals is None:
+            intervals = segments_to_intervals(
+                self.get_all_option_plan_segments())
+            captable_cache.set(cache_key, intervals, 60 * 60 * 24)
+        return intervals
+
     def get_board_members(self):
         return self.signatures.split(',')
 
@@ -332,11 +433,11 @@ class Company(AddressModelMixin, models.Model):
         """
         return company shareholder, raise ValueError if not existing
         """
-        try:
-            return self.shareholder_set.earliest('id')
-        except Shareholder.DoesNotExist:
-            if not fail_silently:
-                raise ValueError('corp shareholder not found')
+        pk = self.get_shareholder_roles()['company']
+        if pk is not None:
+            return Shareholder.objects.get(pk=pk)
+        if not fail_silently:
+            raise ValueError('corp shareholder not found')
 
     def get_dispo_shareholder(self):
         """
@@ -344,12 +445,39 @@ class Company(AddressModelMixin, models.Model):
         owned by someone but are not registered with the share register under
         his name)
         """
-        shareholders = Shareholder.tagged.with_all(
-            DISPO_SHAREHOLDER_TAG, self.shareholder_set.all())
-        if shareholders.count() > 1:
+        pks = self.get_shareholder_roles()['dispo']
+        if len(pks) > 1:
             raise ValueError('too many dispo shareholders for this company')
-        elif shareholders.count() == 1:
-            return shareholders[0]
+        elif len(pks) == 1:
+            return Shareholder.objects.get(pk=pks[0])
+
+    def get_shareholder_roles(self):
+        """
+        return dict with pks of the special shareholders: `company` (pk or
+        None), `dispo` and `transfer` (lists of pks). cached as resolving the
+        tags is expensive, see `invalidate_shareholder_roles`
+        """
+        cache_key = u'company-{}-shareholder-roles'.format(self.pk)
+        roles = captable_cache.get(cache_key)
+        if roles is None:
+            shareholders = self.shareholder_set.all()
+            roles = {
+                'company': shareholders.order_by('id').values_list(
+                    'id', flat=True).first(),
+                'dispo': list(Shareholder.tagged.with_all(
+                    DISPO_SHAREHOLDER_TAG, shareholders).values_list(
+                        'id', flat=True)),
+                'transfer': list(Shareholder.tagged.with_all(
+                    TRANSFER_SHAREHOLDER_TAG, shareholders).values_list(
+                        'id', flat=True)),
+            }
+            captable_cache.set(cache_key, roles, 60 * 60 * 24)
+        return roles
+
+    def invalidate_shareholder_roles(self):
+        """ drop cached special shareholder pks """
+        captable_cache.delete(
+            u'company-{}-shareholder-roles'.format(self.pk))
 
     def get_management_share_count(self, security=None, date=None):
         """ return number of shares owned by management """
@@ -367,41 +495,15 @@ class Company(AddressModelMixin, models.Model):
 
     def get_new_certificate_id(self):
         """
-        returns new usable certificate id
+        returns new usable certificate id, reserved for the caller
         """
-        positions = Position.objects.filter(
-            Q(buyer__company=self) | Q(seller__company=self),
-            certificate_id__isnull=False)
-        options = OptionTransaction.objects.filter(
-            certificate_id__isnull=False,
-            option_plan__company=self)
-        positions_cert_ids = positions.values_list('certificate_id', flat=True)
-        options_cert_ids = options.values_list('certificate_id', flat=True)
-        cert_ids = set(list(positions_cert_ids) + list(options_cert_ids))
-        if cert_ids:
-            max_cert_id = natsorted(cert_ids)[-1]
-            new_cert_id = int(''.join(re.findall(r'\d+', max_cert_id))) + 1
-            return new_cert_id
-        else:
-            return 1
+        return NumberAllocator.allocate(self, 'certificate_id')
 
     def get_new_shareholder_number(self):
         """
-        returns new usable shareholder number
+        returns new usable shareholder number, reserved for the caller
         """
-        qs = self.shareholder_set.all()
-        dispo_sh = self.get_dispo_shareholder()
-        if dispo_sh:
-            qs = qs.exclude(pk=dispo_sh.pk)
-
-        numbers = qs.values_list('number', flat=True)
-        if numbers:
-            numbers = [''.join(re.findall(r'\d+', n)) for n in numbers]
-            max_number = natsorted(numbers, reverse=True)[0]
-            new_number = int(max_number) + 1
-            return new_number
-        else:
-            return 1
+        return NumberAllocator.allocate(self, 'shareholder_number')
 
     def get_logo_url(self):
         """ return url for logo """
@@ -428,14 +530,14 @@ class Company(AddressModelMixin, models.Model):
         and increases) and sum up count*val
         """
         cap_creating_positions = Position.objects.filter(
-            buyer__company=self, seller__isnull=True)
+            company=self, seller__isnull=True)
         val = 0
         for position in cap_creating_positions:
             face_value = position.security.face_value or 1
             val += position.count * face_value
 
         cap_destroying_positions = Position.objects.filter(
-            seller__company=self, buyer__isnull=True)
+            company=self, buyer__isnull=True)
 
         for position in cap_destroying_positions:
             face_value = position.security.face_value or 1
@@ -445,7 +547,7 @@ class Company(AddressModelMixin, models.Model):
 
     def get_total_share_count(self, security=None):
         cap_creating_positions = Position.objects.filter(
-            buyer__company=self, seller__isnull=True)
+            company=self, seller__isnull=True)
         if security:
             cap_creating_positions = cap_creating_positions.filter(
                 security=security)
@@ -454,7 +556,7 @@ class Company(AddressModelMixin, models.Model):
             val += position.count
 
         cap_destroying_positions = Position.objects.filter(
-            seller__company=self, buyer__isnull=True)
+            company=self, buyer__isnull=True)
 
         if security:
             cap_destroying_positions = cap_destroying_positions.filter(
@@ -525,12 +627,119 @@ class Company(AddressModelMixin, models.Model):
 
         return int(total)
 
+    def get_vote_summary(self):
+        """
+        return dict with the voting rights of the company: `total`,
+        `floating`, `in_options`, `eligible` and `securities` (security pk ->
+        dict with the same keys). same values as the `get_total_votes*`
+        methods, computed with a few aggregate queries and cached until the
+        share register changes
+        """
+        cache_key = self.get_ledger_cache_key('vote-summary')
+        summary = captable_cache.get(cache_key)
+        if summary is None:
+            summary = self._get_vote_summary()
+            captable_cache.set(cache_key, summary, 60*60*24)
+        return summary
+
+    def get_share_prices(self, date=None):
+        """
+        return dict security pk -> last traded share price as of `date`,
+        cached until the share register changes
+        """
+        if date:
+            date = Position._meta.get_field('bought_at').to_python(date)
+        cache_key = self.get_ledger_cache_key('share-prices', date)
+        prices = captable_cache.get(cache_key)
+        if prices is None:
+            qs = SecurityPrice.objects.filter(company=self)
+            if date:
+                qs = qs.filter(date__lte=date)
+            prices = dict(qs.order_by('security', '-date').distinct(
+                'security').values_list('security', 'value'))
+            captable_cache.set(cache_key, prices, 60*60*24)
+        return prices
+
+    def get_last_share_price(self, date=None, security=None):
+        """
+        return price of the last valued trade as of `date` of any or the
+        given security, None if there is none
+        """
+        qs = SecurityPrice.objects.filter(company=self)
+        if date:
+            qs = qs.filter(date__lte=date)
+        if security:
+            qs = qs.filter(security=security)
+        return qs.order_by('-date', '-position').values_list(
+            'value', flat=True).first()
+
+    def get_share_values(self, shareholders=None, date=None):
+        """
+        return dict shareholder pk -> value of all shares held on `date`,
+        each security valued with its last traded price. values all holdings
+        with a few aggregate queries
+        """
+        if shareholders is None:
+            shareholders = self.shareholder_set.all()
+        prices = self.get_share_prices(date=date)
+        return {
+            pk: sum([count * prices.get(security, 0)
+                     for security, count in counts.items()])
+            for pk, counts in self.get_share_count_map(
+                shareholders, date=date).items()}
+
+    def _get_vote_summary(self):
+        vote_ratio = self.vote_ratio or 1
+        holders = [self.get_company_shareholder(fail_silently=True),
+                   self.get_dispo_shareholder()]
+        share_counts = self.get_share_count_map(
+            [holder for holder in holders if holder]).values()
+
+        options = defaultdict(int)
+        qs = OptionTransaction.objects.filter(
+            Q(seller__isnull=True) | Q(buyer__isnull=True),
+            company=self).values(
+                'buyer', 'option_plan__security').annotate(count=Sum('count'))
+        for row in qs:
+            # created options add, destroyed ones remove
+            sign = row['buyer'] and 1 or -1
+            options[row['option_plan__security']] += sign * row['count']
+
+        summary = {'securities': {}}
+        total = in_options = 0
+        held = [0] * len(share_counts)
+        for security in self.security_set.all():
+            face_value = security.face_value or 1
+            security_total = face_value * security.count / vote_ratio
+            security_held = [
+                counts.get(security.pk, 0) * face_value / vote_ratio
+                for counts in share_counts]
+            security_options = options[security.pk] * face_value / vote_ratio
+            floating = (int(security_total) -
+                        sum(int(votes) for votes in security_held))
+            summary['securities'][security.pk] = {
+                'total': int(security_total),
+                'floating': floating,
+                'in_options': security_options,
+                'eligible': int(floating - security_options),
+            }
+            total += security_total
+            in_options += security_options
+            held = [a + b for a, b in zip(held, security_held)]
+
+        summary['total'] = int(total)
+        # votes of each special shareholder are rounded like `vote_count`
+        summary['floating'] = int(total) - sum(int(votes) for votes in held)
+        summary['in_options'] = in_options
+        summary['eligible'] = int(summary['floating'] - in_options)
+        return summary
+
     def get_total_options(self, security=None):
         """
         count of shares granted through options
         """
         options_created = OptionTransaction.objects.filter(
-            buyer__company=self, seller__isnull=True)
+            company=self, seller__isnull=True)
 
         if security:
             options_created = options_created.filter(
@@ -541,7 +750,7 @@ class Company(AddressModelMixin, models.Model):
             val += position.count
 
         options_destroyed = OptionTransaction.objects.filter(
-            seller__company=self, buyer__isnull=True)
+            company=self, buyer__isnull=True)
 
         if security:
             options_destroyed = options_destroyed.filter(
@@ -552,18 +761,58 @@ class Company(AddressModelMixin, models.Model):
 
         return val
 
+    def get_share_count_map(self, shareholders, date=None):
+        """
+        return dict shareholder pk -> {security pk: share count} for all
+        `shareholders` on `date` computed with aggregate queries. same counts
+        as `Shareholder.share_count`, hence the company shareholder counts are
+        reduced by the shares granted through options
+        """
+        pks = [shareholder.pk for shareholder in shareholders]
+        result = {pk: defaultdict(int) for pk in pks}
+        positions = Position.objects.all()
+        if date:
+            positions = positions.filter(bought_at__lte=date)
+
+        bought = positions.filter(buyer__in=pks).values(
+            'buyer', 'security').annotate(count=Sum('count'))
+        for row in bought:
+            result[row['buyer']][row['security']] += row['count']
+
+        sold = positions.filter(seller__in=pks).values(
+            'seller', 'security').annotate(count=Sum('count'))
+        for row in sold:
+            result[row['seller']][row['security']] -= row['count']
+
+        company_shareholder = self.get_company_shareholder(fail_silently=True)
+        if company_shareholder and company_shareholder.pk in result:
+            options = OptionTransaction.objects.filter(
+                Q(seller__isnull=True) | Q(buyer__isnull=True),
+                company=self).values(
+                    'buyer', 'option_plan__security').annotate(
+                        count=Sum('count'))
+            counts = result[company_shareholder.pk]
+            for row in options:
+                # created options block shares, destroyed ones release them
+                sign = row['buyer'] and 1 or -1
+                counts[row['option_plan__security']] -= sign * row['count']
+
+        return {pk: dict(counts) for pk, counts in result.items()}
+
     def get_total_options_floating(self):
         """
         count of shares granted through options
         """
         options_created = OptionTransaction.objects.filter(
-            buyer__company=self, seller=self.get_company_shareholder())
+            company=self, seller=self.get_company_shareholder(),
+            buyer__isnull=False)
         val = 0
         for position in options_created:
             val += position.count
 
         options_returned = OptionTransaction.objects.filter(
-            seller__company=self, buyer=self.get_company_shareholder())
+            company=self, buyer=self.get_company_shareholder(),
+            seller__isnull=False)
 
         for position in options_returned:
             val -= position.count
@@ -572,12 +821,11 @@ class Company(AddressModelMixin, models.Model):
 
     def get_transfer_shareholder(self):
         """ return shareholder which is tagged as transfer shareholder """
-        shareholders = Shareholder.tagged.with_all(
-            TRANSFER_SHAREHOLDER_TAG, self.shareholder_set.all())
-        if shareholders.count() > 1:
+        pks = self.get_shareholder_roles()['transfer']
+        if len(pks) > 1:
             raise ValueError('too many transfer shareholders for this company')
-        elif shareholders.count() == 1:
-            return shareholders.first()
+        elif len(pks) == 1:
+            return Shareholder.objects.get(pk=pks[0])
 
     # --- CHECKS
     def has_management(self):
@@ -587,12 +835,10 @@ class Company(AddressModelMixin, models.Model):
         """ returns bool if at least one certificate was printed/has printed
         date
         """
-        ots = OptionTransaction.objects.filter(option_plan__company=self,
-                                               printed_at__isnull=False
-                                               )
-        poss = Position.objects.filter(
-            Q(buyer__company=self) | Q(seller__company=self),
-            printed_at__isnull=False)
+        ots = OptionTransaction.objects.filter(company=self,
+                                               printed_at__isnull=False)
+        poss = Position.objects.filter(company=self,
+                                       printed_at__isnull=False)
 
         return ots.exists() or poss.exists()
 
@@ -601,11 +847,9 @@ class Company(AddressModelMixin, models.Model):
         transaction) which vesting_months
         """
         return (Position.objects.filter(
-            Q(seller__company=self) | Q(buyer__company=self),
-            vesting_months__gt=0).exists() or
+            company=self, vesting_months__gt=0).exists() or
             OptionTransaction.objects.filter(
-                option_plan__company=self,
-                vesting_months__gt=0).exists()
+                company=self, vesting_months__gt=0).exists()
             )
 
     def get_statement_template(self):
@@ -619,99 +863,61 @@ class Company(AddressModelMixin, models.Model):
     statement_template = property(get_statement_template)
 
     # --- LOGIC
-    def split_shares(self, data):
-        """ split all existing positions """
-        execute_at = data['execute_at']
-        dividend = float(data['dividend'])
-        divisor = float(data['divisor'])
-        security = data['security']
-
-        # get all active shareholder on day 'execute_at'
-        shareholders = self.get_active_shareholders(date=execute_at)
-        company_shareholder = self.get_company_shareholder()
-
-        # create return transactions to return old assets to company
-        # create transaction to hand out new assets to shareholders with
-        # new count
-        value = company_shareholder.last_traded_share_price(
-            date=execute_at, security=security)
-        partials = {}
-        for shareholder in shareholders:
-            count = shareholder.share_count(
-                execute_at, security)
-            kwargs1 = {
-                'buyer': company_shareholder,
-                'seller': shareholder,
-                'count': count,
-                'value': value,
-                'security': security,
-                'bought_at': execute_at,
-                'is_split': True,
-                'comment': _('Share split of {} on {} with ratio {}:{}. '
-                             'Return of old shares.').format(
-                                 security, execute_at.date(),
-                                 int(dividend), int(divisor)),
-            }
-            if value:
-                kwargs1.update({'value': float(value)})
-            if shareholder.pk == company_shareholder.pk:
-                kwargs1.update(dict(buyer=None, count=self.share_count,
-                                    value=shareholder.buyer.first().value))
-
-            p = Position.objects.create(**kwargs1)
-            logger.info('Split: share returned {}'.format(p))
-
-            part, count2 = math.modf(count * divisor / dividend)
-            kwargs2 = {
-                'buyer': shareholder,
-                'seller': company_shareholder,
-                'count': count2,
-                'security': security,
-                'bought_at': execute_at,
-                'is_split': True,
-                'comment': _('Share split of {} on {} with ratio {}:{}. '
-                             'Provisioning of new shares.').format(
-                                 security, execute_at.date(),
-                                 int(dividend), int(divisor)),
-            }
-            if value:
-                kwargs2.update({'value': float(value) / divisor * dividend})
-            if shareholder.pk == company_shareholder.pk:
-                part, count2 = math.modf(
-                    self.share_count /
-                    dividend * float(divisor)
-                )
-                kwargs2.update({
-                    'count': count2,
-                    'seller': None,
-                })
-
-            p = Position.objects.create(**kwargs2)
-            if part != 0.0:
-                partials.update({shareholder.pk: round(part, 6)})
-            logger.info('Split: share issued {}'.format(p))
-
-        # update share count
-        self.share_count = int(
-            self.share_count / dividend * float(divisor)
-        )
+    @classmethod
+    def touch_ledgers(cls, queryset, dependencies=LEDGER_DEPENDENCIES):
+        """
+        mark share register data of companies in `queryset` as changed.
+        `dependencies` names the kinds of data changed (see
+        `LEDGER_DEPENDENCIES`), checks of `ShareRegisterValidator` depending
+        on them run again. returns timestamp of the change
+        """
+        changed_at = timezone.now()
+        kwargs = {u'{}_changed_at'.format(dependency): changed_at
+                  for dependency in dependencies}
+        pks = list(queryset.values_list('pk', flat=True))
+        cls.objects.filter(pk__in=pks).update(
+            ledger_changed_at=changed_at, **kwargs)
+        for pk in pks:
+            _ledger_changes[pk] = changed_at
+        return changed_at
 
-        # record partial shares to operator
-        self._send_partial_share_rights_email(partials)
+    def touch_ledger(self, dependencies=LEDGER_DEPENDENCIES):
+        """
+        mark share register data as changed. invalidates all data cached with
+        `get_ledger_cache_key`
+        """
+        self.ledger_changed_at = Company.touch_ledgers(
+            Company.objects.filter(pk=self.pk), dependencies=dependencies)
+        self._ledger_changed_at_loaded = True
+        for dependency in dependencies:
+            setattr(self, u'{}_changed_at'.format(dependency),
+                    self.ledger_changed_at)
 
-        self.save()
+    def split_shares(self, data, dry_run=False):
+        """
+        split all existing positions of `data['security']`. returns preview
+        of the resulting counts without writing anything if `dry_run`
+        """
+        from shareholder.split import ShareSplit
+
+        split = ShareSplit(self, data['security'], data['execute_at'],
+                           data['dividend'], data['divisor'])
+        if dry_run:
+            return split.preview()
+
+        split.execute()
 
     def has_feature_enabled(self, feature_name):
         """
         checks if `feature_name` is available in current subscription
         """
 
-        customer = self.get_customer()
-        if not customer.has_active_subscription():
+        state = self.get_subscription_state()
+        if not state['active']:
             return False
 
         feature_list = settings.DJSTRIPE_PLANS.get(
-            self.get_current_subscription_plan(), {}).get('features', [])
+            state['plan'], {}).get('features', [])
 
         return feature_name.lower() in feature_list
 
@@ -719,11 +925,46 @@ class Company(AddressModelMixin, models.Model):
         """
         return plan name of current subscription (if available)
         """
+        if not display:
+            return self.get_subscription_state()['plan']
+
         customer = self.get_customer()
         if customer.has_active_subscription():
-            if display:
-                return customer.current_subscription.plan_display()
-            return customer.current_subscription.plan
+            return customer.current_subscription.plan_display()
+
+    @staticmethod
+    def get_subscription_cache_key(pk):
+        return u'company-{}-subscription'.format(pk)
+
+    def get_subscription_state(self):
+        """
+        return dict with `active` flag and `plan` name of the current
+        subscription. cached until stripe reports a change, see
+        `invalidate_subscription_state`, or the billing period ends
+        """
+        cache_key = self.get_subscription_cache_key(self.pk)
+        state = cache.get(cache_key)
+        if state is not None:
+            return state
+
+        customer = self.get_customer()
+        state = dict(active=customer.has_active_subscription(), plan=None)
+        timeout = getattr(settings, 'SUBSCRIPTION_STATE_CACHE_TIMEOUT',
+                          60*60*24)
+        if state['active']:
+            subscription = customer.current_subscription
+            state['plan'] = subscription.plan
+            if subscription.current_period_end:
+                period_left = (subscription.current_period_end -
+                               timezone.now()).total_seconds()
+                timeout = max(1, min(timeout, int(period_left)))
+
+        cache.set(cache_key, state, timeout)
+        return state
+
+    def invalidate_subscription_state(self):
+        """ drop cached subscription state, e.g. on stripe webhooks """
+        cache.delete(self.get_subscription_cache_key(self.pk))
 
     def get_current_subscription_plan_display(self):
         return self.get_current_subscription_plan(display=True)
@@ -786,8 +1027,14 @@ class Company(AddressModelMixin, models.Model):
         """
         return list of permission that are dependent on subscription features
         """
-        permissions = []
         plan_name = self.get_current_subscription_plan()
+        cache_key = self.get_ledger_cache_key(
+            'subscription-permissions', plan_name)
+        permissions = captable_cache.get(cache_key)
+        if permissions is not None:
+            return permissions
+
+        permissions = []
         plan = settings.DJSTRIPE_PLANS.get(plan_name, {})
         for feature_name, feature_config in plan.get('features', {}).items():
             action_validators = feature_config.get('validators', {})
@@ -804,6 +1051,7 @@ class Company(AddressModelMixin, models.Model):
                     permission_name = '{}_{}'.format(action, feature_name)
                     permissions.append(permission_name)
 
+        captable_cache.set(cache_key, permissions, 60*60*24)
         return permissions
 
 
@@ -948,41 +1196,52 @@ class Shareholder(TagMixin, models.Model):
         returns deflated segments which are owned by this shareholder.
         includes segments blocked for options.
         """
-        logger.info('current items: starting')
-        date = date or timezone.now()
-
-        # all pos before date
-        qs_bought = self.buyer.filter(bought_at__lte=date)
-        qs_sold = self.seller.filter(bought_at__lte=date)
-
-        qs_bought = qs_bought.filter(security=security)
-        qs_sold = qs_sold.filter(security=security)
-
-        logger.info('current items: qs done')
-        # -- flat list of bought items
-        segments_bought = qs_bought.values_list(
-            'number_segments', flat=True)
-        # flatten, unsorted with duplicates
-        segments_bought = [
-            segment for sublist in segments_bought for segment in sublist]
+        return self.current_segments_by_security(
+            securities=[security], date=date)[security.pk]
 
-        # flat list of sold segments
-        segments_sold = qs_sold.values_list(
-            'number_segments', flat=True)
-        segments_sold = [
-            segment for sublist in segments_sold for segment in sublist]
-        logger.info('current items: flat lists done. inflating...')
-
-        segments_owning = []
-
-        # inflate to have int only
-        segments_bought = inflate_segments(segments_bought)
-        segments_sold = inflate_segments(segments_sold)
-        logger.info('current items: iterating through bought segments...')
+    def current_segments_by_security(self, securities=None, date=None):
+        """
+        returns dict of security pk -> deflated segments owned by this
+        shareholder for `securities` (default: all securities of the company
+        tracking numbers). loads the segments of all securities with one query
+        and caches the result until the share register changes.
+        """
+        date = date or timezone.now().date()
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        if securities is None:
+            securities = self.company.security_set.filter(track_numbers=True)
+        security_pks = sorted(set(security.pk for security in securities))
+
+        cache_key = self.company.get_ledger_cache_key(
+            'current-segments', self.pk, date.isoformat(), *security_pks)
+        result = captable_cache.get(cache_key)
+        if result is not None:
+            return result
 
-        segments_owning = substract_list(segments_bought, segments_sold)
-        logger.info('current items: finished')
-        return deflate_segments(segments_owning)
+        positions = Position.objects.filter(
+            Q(buyer=self) | Q(seller=self), security__in=security_pks,
+            bought_at__lte=date).values_list(
+                'security', 'buyer', 'seller', 'number_segments')
+
+        # flat lists of bought and sold segments per security, unsorted with
+        # duplicates
+        segments_bought = {pk: [] for pk in security_pks}
+        segments_sold = {pk: [] for pk in security_pks}
+        for security_pk, buyer_pk, seller_pk, segments in positions:
+            if buyer_pk == self.pk:
+                segments_bought[security_pk].extend(segments or [])
+            if seller_pk == self.pk:
+                segments_sold[security_pk].extend(segments or [])
+
+        result = {}
+        for pk in security_pks:
+            result[pk] = deflate_segments(substract_list(
+                inflate_segments(segments_bought[pk]),
+                inflate_segments(segments_sold[pk])))
+
+        captable_cache.set(cache_key, result, 60 * 60 * 24)
+        return result
 
     def current_options_segments(self, security, optionplan=None, date=None):
         """
@@ -1049,10 +1308,13 @@ class Shareholder(TagMixin, models.Model):
         returns string for date=today and all securities showing number segments
         """
         text = ""
-        for security in self.company.security_set.filter(track_numbers=True):
+        securities = list(
+            self.company.security_set.filter(track_numbers=True))
+        segments = self.current_segments_by_security(securities=securities)
+        for security in securities:
             text += "{}: {} ".format(
                 security.get_title_display(),
-                human_readable_segments(self.current_segments(security))
+                human_readable_segments(segments[security.pk])
             )
         return text
 
@@ -1080,21 +1342,13 @@ class Shareholder(TagMixin, models.Model):
 
     def get_vested_positions(self, security=None, date=None):
         """ get number of shares still under vesting as of date for security """
-        position_ids = []
-        qs = self.buyer.filter(vesting_months__isnull=False)
-        if security:
-            qs = qs.filter(security=security)
-
         # vested shares cannot be sold. hence get all which have not yet
         # expired. that's it
-        for pos in qs:
-            if pos.vesting_expires_at > (date or timezone.now().date()):
-                position_ids.append(pos.pk)
-
-        if position_ids:
-            return Position.objects.filter(pk__in=position_ids)
-        else:
-            return Position.objects.none()
+        qs = self.buyer.filter(
+            vesting_expires_at__gt=date or timezone.now().date())
+        if security:
+            qs = qs.filter(security=security)
+        return qs
 
     def get_positions_with_certificate(self, security=None, date=None):
         qs = self.buyer.filter(depot_type=0, certificate_id__isnull=False,
@@ -1124,31 +1378,33 @@ class Shareholder(TagMixin, models.Model):
         """
         returns bool if shareholder is company shareholder
         """
-        return self.company.get_company_shareholder() == self
+        return self.company.get_shareholder_roles()['company'] == self.pk
 
     def is_dispo_shareholder(self):
         """
         returns bool if shareholder is dispo shareholder
         """
-        return self.company.get_dispo_shareholder() == self
+        pks = self.company.get_shareholder_roles()['dispo']
+        if len(pks) > 1:
+            raise ValueError('too many dispo shareholders for this company')
+        return pks == [self.pk]
 
     def is_transfer_shareholder(self):
         """
         returns bool if shareholder is dispo shareholder
         """
-        return self.company.get_transfer_shareholder() == self
+        pks = self.company.get_shareholder_roles()['transfer']
+        if len(pks) > 1:
+            raise ValueError('too many transfer shareholders for this company')
+        return pks == [self.pk]
 
     def last_traded_share_price(self, date=None, security=None):
-        qs = Position.objects.filter(buyer__company=self.company)
-        if date:
-            qs = qs.filter(bought_at__lte=date)
-        if security:
-            qs = qs.filter(security=security)
-        if not qs.exists():
+        price = self.company.get_last_share_price(date=date, security=security)
+        if price is None:
             raise ValueError(
                 'No Transactions available to calculate recent share price')
 
-        return qs.latest('bought_at').value
+        return price
 
     def options_percent(self, date=None):
         """ returns percentage of shares owned compared to corps
@@ -1191,17 +1447,11 @@ class Shareholder(TagMixin, models.Model):
             return 0
 
         # last payed price
-        if (
-            Position.objects.filter(
-                buyer__company=self.company, value__isnull=False
-            ).exists()
-        ):
-            position = Position.objects.filter(
-                buyer__company=self.company).latest('bought_at')
-        else:
+        price = self.company.get_last_share_price(date=date)
+        if price is None:
             return 0
 
-        return options_count * position.value
+        return options_count * price
 
     def owns_segments(self, segments, security):
         """
@@ -1239,18 +1489,15 @@ class Shareholder(TagMixin, models.Model):
         if isinstance(segments, str):
             segments = string_list_to_json(segments)
 
-        segments_owning = inflate_segments(self.current_options_segments(
+        segments_owning = segments_to_intervals(self.current_options_segments(
             security=security))
-        failed_segments = []
-        for segment in inflate_segments(segments):
-
-            # shareholder does not own this
-            if segment not in segments_owning:
-                failed_segments.append(segment)
+        # shareholder does not own these
+        failed_segments = substract_intervals(
+            segments_to_intervals(segments), segments_owning)
 
         return (len(failed_segments) == 0,
-                deflate_segments(failed_segments),
-                deflate_segments(segments_owning))
+                intervals_to_segments(failed_segments),
+                intervals_to_segments(segments_owning))
 
     def security_count(self, date=None):
         """ how many different securities does the shareholder own at date """
@@ -1270,6 +1517,7 @@ class Shareholder(TagMixin, models.Model):
             raise ValueError('disposhareholder already set')
 
         self.set_tag(DISPO_SHAREHOLDER_TAG)
+        self.company.invalidate_shareholder_roles()
 
     def set_transfer_shareholder(self):
         """ mark shareholder as transfer shareholder. this one is used
@@ -1284,6 +1532,7 @@ class Shareholder(TagMixin, models.Model):
             raise ValueError('transfer shareholder already set')
 
         self.set_tag(TRANSFER_SHAREHOLDER_TAG)
+        self.company.invalidate_shareholder_roles()
 
     def share_percent(self, date=None, security=None):
         """
@@ -1330,7 +1579,7 @@ class Shareholder(TagMixin, models.Model):
 
         # exclude special cases
         if not only_sellable or not expired_vesting or without_vesting:
-            cached = cache.get(cache_key)
+            cached = captable_cache.get(cache_key)
             if cached:
                 return cached
 
@@ -1364,24 +1613,13 @@ class Shareholder(TagMixin, models.Model):
             qs_sold = qs_sold.filter(security=security)
 
         if expired_vesting:
-            # for each buyer position with vesting_months applied, we need to
-            # check if the vesting was expired. placed at the end of method
-            # because it's a very expensive method and we might have excluded
-            # all options till now already
-            pks = []
-            now = timezone.now()
-            for pos in qs_bought:
-                if pos.vesting_months:
-                    expires_at = pos.bought_at + relativedelta(
-                        months=pos.vesting_months)
-                    if expires_at <= now.date():
-                        pks.append(pos.pk)
-                else:
-                    pks.append(pos.pk)
-            qs_bought = self.buyer.filter(pk__in=pks)
+            # only positions without vesting or with vesting expired on `date`
+            qs_bought = qs_bought.filter(
+                Q(vesting_expires_at__isnull=True) |
+                Q(vesting_expires_at__lte=date or timezone.now().date()))
 
-        count_bought = sum(qs_bought.values_list('count', flat=True))
-        count_sold = sum(qs_sold.values_list('count', flat=True))
+        count_bought = qs_bought.aggregate(count=Sum('count'))['count'] or 0
+        count_sold = qs_sold.aggregate(count=Sum('count'))['count'] or 0
 
         # clean company shareholder count by options count
         if self.is_company_shareholder():
@@ -1390,7 +1628,7 @@ class Shareholder(TagMixin, models.Model):
             options_created = 0
 
         result = count_bought - count_sold - options_created
-        cache.set(cache_key, result, 30*60)
+        captable_cache.set(cache_key, result, 30*60)
         return result
 
     def share_count_sellable(self, date=None, security=None):
@@ -1415,15 +1653,9 @@ class Shareholder(TagMixin, models.Model):
             return 0
 
         value = 0
-        for security in self.company.security_set.all():
-            # last payed price
-            position = Position.objects.filter(
-                buyer__company=self.company,
-                security=security,
-                value__gt=0
-            ).order_by('-bought_at', '-id').first()
-            if position:
-                value += share_count * position.value
+        # last payed price
+        for price in self.company.get_share_prices(date=date).values():
+            value += share_count * price
 
         return value
 
@@ -1466,7 +1698,7 @@ class Shareholder(TagMixin, models.Model):
             result['is_valid'] = False
             result['errors'].append(_('Shareholder birthday missing.'))
 
-        if not self.user.userprofile.country:
+        if not self.user.userprofile.country_id:
             result['is_valid'] = False
             result['errors'].append(_('Shareholder origin/country missing.'))
 
@@ -1499,12 +1731,12 @@ class Shareholder(TagMixin, models.Model):
         returns percentage of the users voting rights compared to total voting
         rights existing
         """
-        if (self.is_company_shareholder() or
-                not self.company.get_total_votes_floating()):
+        vote_summary = self.company.get_vote_summary()
+        if self.is_company_shareholder() or not vote_summary['floating']:
             return float(0.0)
 
         # do the math
-        total_votes_eligible = self.company.get_total_votes_eligible()
+        total_votes_eligible = vote_summary['eligible']
 
         # no floating cap yet, hence cannot continue the math
         if total_votes_eligible == 0:
@@ -1658,10 +1890,19 @@ class Position(DiscountedTaxByVestingModelMixin, CertificateMixin):
                     'depot from cert depot'),
         null=True, blank=True, related_name='certificate_initial_position')
     vesting_months = models.PositiveIntegerField(blank=True, null=True)
+    # computed from vesting_months on save
+    vesting_expires_at = models.DateField(blank=True, null=True,
+                                          editable=False, db_index=True)
     comment = models.CharField(max_length=255, blank=True, null=True)
+    # denormalized from security for fast company scoped queries, set on save
+    company = models.ForeignKey('Company', blank=True, null=True,
+                                editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        index_together = [('company', 'security', 'bought_at')]
+
     def __unicode__(self):
         return u"Pos {}->#{}@{}->{}".format(
             self.seller,
@@ -1670,6 +1911,12 @@ class Position(DiscountedTaxByVestingModelMixin, CertificateMixin):
             self.buyer
         )
 
+    def save(self, *args, **kwargs):
+        if not self.company_id:
+            self.company_id = self.security.company_id
+        self.update_vesting_expires_at()
+        super(Position, self).save(*args, **kwargs)
+
     def can_view(self, user):
         """
         permission method to check if user is permitted to view obj
@@ -1732,12 +1979,6 @@ class Position(DiscountedTaxByVestingModelMixin, CertificateMixin):
         else:
             raise ValueError('position already invalidated')
 
-    def _vesting_expires_at(self):
-        if self.vesting_months:
-            return self.bought_at + relativedelta(months=self.vesting_months)
-
-    vesting_expires_at = property(_vesting_expires_at)
-
 
 def get_option_plan_upload_path(instance, filename):
     return os.path.join(
@@ -1820,6 +2061,9 @@ class OptionTransaction(DiscountedTaxByVestingModelMixin, CertificateMixin):
     seller = models.ForeignKey('Shareholder', blank=True, null=True,
                                related_name="option_seller")
     vesting_months = models.PositiveIntegerField(blank=True, null=True)
+    # computed from vesting_months on save
+    vesting_expires_at = models.DateField(blank=True, null=True,
+                                          editable=False, db_index=True)
     number_segments = JSONField(
         _('JSON list of segments of ids for securities. can be 1, 2, 3, 4-10'),
         default=list, blank=True, null=True)
@@ -1833,9 +2077,16 @@ class OptionTransaction(DiscountedTaxByVestingModelMixin, CertificateMixin):
         _('What kind of depot is this position stored within'), max_length=1,
         choices=DEPOT_TYPES, blank=True, null=True)
     is_draft = models.BooleanField(default=True)
+    # denormalized from option plan for fast company scoped queries, set on
+    # save
+    company = models.ForeignKey('Company', blank=True, null=True,
+                                editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        index_together = [('company', 'option_plan', 'bought_at')]
+
     def __unicode__(self):
         return u"OpTr {}->#{}->{} (OP:{})".format(
             self.seller,
@@ -1844,6 +2095,12 @@ class OptionTransaction(DiscountedTaxByVestingModelMixin, CertificateMixin):
             self.option_plan
         )
 
+    def save(self, *args, **kwargs):
+        if not self.company_id:
+            self.company_id = self.option_plan.company_id
+        self.update_vesting_expires_at()
+        super(OptionTransaction, self).save(*args, **kwargs)
+
     def can_view(self, user):
         """
         permission method to check if user is permitted to view obj
@@ -2233,6 +2490,205 @@ class ShareholderStatement(models.Model):
     pdf_download_url = property(get_pdf_download_url)
 
 
+class ImportRun(models.Model):
+    """
+    run of a share register import. rows are committed in batches and the
+    count of committed rows (`offset`) is checkpointed with each batch, hence
+    a failed run can be resumed from there
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, _('running')),
+        (STATUS_FAILED, _('failed')),
+        (STATUS_FINISHED, _('finished')),
+    ]
+
+    company = models.ForeignKey('Company', verbose_name=_('company'))
+    filename = models.CharField(_('filename'), max_length=500)
+    backend = models.CharField(_('import backend'), max_length=100)
+    status = models.CharField(_('status'), max_length=10,
+                              choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    row_count = models.PositiveIntegerField(_('rows in file'), default=0)
+    offset = models.PositiveIntegerField(_('rows committed'), default=0)
+    imported_count = models.PositiveIntegerField(_('rows imported'),
+                                                 default=0)
+    # offset when the run was (re)started, for throughput
+    start_offset = models.PositiveIntegerField(default=0, editable=False)
+    error = models.TextField(_('error'), blank=True)
+
+    started_at = models.DateTimeField(_('started at'), default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(_('finished at'), null=True,
+                                       blank=True)
+
+    class Meta:
+        verbose_name = _('import run')
+        verbose_name_plural = _('import runs')
+
+    def __unicode__(self):  # pragma: nocover
+        return u'{}: {} ({})'.format(self.company, self.filename, self.status)
+
+    def get_progress(self):
+        """ return percentage of committed rows """
+        if not self.row_count:
+            return 100.0
+        return 100.0 * self.offset / self.row_count
+
+    def get_rows_per_second(self):
+        """ return throughput since the run was (re)started """
+        seconds = ((self.finished_at or timezone.now()) -
+                   self.started_at).total_seconds()
+        if seconds <= 0:
+            return 0.0
+        return (self.offset - self.start_offset) / seconds
+
+    def get_eta(self):
+        """ return estimated remaining time as timedelta or None """
+        if self.status == self.STATUS_FINISHED:
+            return datetime.timedelta(0)
+        rows_per_second = self.get_rows_per_second()
+        if not rows_per_second:
+            return None
+        return datetime.timedelta(
+            seconds=int((self.row_count - self.offset) / rows_per_second))
+
+    def restart(self):
+        """ mark run as running again, continuing at the checkpoint """
+        self.status = self.STATUS_RUNNING
+        self.error = u''
+        self.start_offset = self.offset
+        self.started_at = timezone.now()
+        self.finished_at = None
+        self.save()
+
+
+def get_max_number(values):
+    """
+    return highest number of strings like '1a' or 'A23.B', digits of a string
+    are joined to one number. 0 if there is none. numbers exceeding
+    `NumberAllocator.MAX_NUMBER` (e.g. '2016-001-0001-0001-0001') are skipped
+    """
+    numbers = [''.join(re.findall(r'\d+', value or '')) for value in values]
+    return max([int(number) for number in numbers
+                if number and int(number) <= NumberAllocator.MAX_NUMBER] or
+               [0])
+
+
+class NumberAllocator(models.Model):
+    """
+    last certificate id and shareholder number handed out per company.
+    allocating locks the row, hence concurrent requests never get the same
+    number. numbers entered manually are registered on save, see
+    `shareholder.signals`
+    """
+    # highest value of a bigint column
+    MAX_NUMBER = 2 ** 63 - 1
+
+    company = models.OneToOneField('Company', related_name='number_allocator')
+    # free-text ids like '2016-001-0001' exceed integer columns
+    certificate_id = models.BigIntegerField(default=0)
+    shareholder_number = models.BigIntegerField(default=0)
+
+    def __unicode__(self):  # pragma: nocover
+        return u'{}: {}/{}'.format(self.company, self.certificate_id,
+                                   self.shareholder_number)
+
+    @classmethod
+    def allocate(cls, company, field):
+        """ return next number for `field` and mark it as used """
+        with transaction.atomic():
+            try:
+                allocator = cls.objects.select_for_update().get(
+                    company=company)
+            except cls.DoesNotExist:
+                allocator, created = cls.objects.get_or_create(
+                    company=company)
+                if created:
+                    allocator.rebuild()
+                allocator = cls.objects.select_for_update().get(
+                    pk=allocator.pk)
+            value = getattr(allocator, field) + 1
+            setattr(allocator, field, value)
+            allocator.save(update_fields=[field])
+        return value
+
+    @classmethod
+    def register(cls, company, field, values):
+        """ mark highest number of `values` as used for `field` """
+        number = get_max_number(values)
+        if number:
+            cls.objects.filter(company=company).update(
+                **{field: Greatest(F(field), number)})
+
+    def rebuild(self, fields=('certificate_id', 'shareholder_number')):
+        """
+        set `fields` to the highest numbers in use. this resets reserved
+        numbers not booked yet
+        """
+        company = self.company
+        if 'certificate_id' in fields:
+            self.certificate_id = get_max_number(
+                list(Position.objects.filter(
+                    company=company, certificate_id__isnull=False
+                ).values_list('certificate_id', flat=True)) +
+                list(OptionTransaction.objects.filter(
+                    company=company, certificate_id__isnull=False
+                ).values_list('certificate_id', flat=True)))
+        if 'shareholder_number' in fields:
+            qs = company.shareholder_set.all()
+            dispo_shareholder = company.get_dispo_shareholder()
+            if dispo_shareholder:
+                qs = qs.exclude(pk=dispo_shareholder.pk)
+            self.shareholder_number = get_max_number(
+                qs.values_list('number', flat=True))
+        self.save(update_fields=fields)
+
+
+class SecurityPrice(models.Model):
+    """
+    price of the last valued trade per security and day, materialized from
+    the positions to look up share prices as of a date with one query. kept
+    current by `shareholder.signals` and `refresh` for bulk created positions
+    """
+    company = models.ForeignKey('Company')
+    security = models.ForeignKey('Security')
+    date = models.DateField()
+    value = models.DecimalField(max_digits=16, decimal_places=4)
+    position = models.ForeignKey('Position', related_name='+')
+
+    class Meta:
+        unique_together = [('security', 'date')]
+        index_together = [('company', 'date')]
+
+    def __unicode__(self):  # pragma: nocover
+        return u'{} {}: {}'.format(self.security, self.date, self.value)
+
+    @classmethod
+    def refresh(cls, keys):
+        """ recompute prices for list of (security pk, date) `keys` """
+        to_date = Position._meta.get_field('bought_at').to_python
+        dates_by_security = defaultdict(set)
+        for security, date in keys:
+            dates_by_security[security].add(to_date(date))
+
+        with transaction.atomic():
+            for security, dates in dates_by_security.items():
+                cls.objects.filter(security=security, date__in=dates).delete()
+                prices = {}
+                for pk, company, date, value in Position.objects.filter(
+                        security=security, bought_at__in=dates,
+                        buyer__isnull=False, value__gt=0).order_by(
+                            'bought_at', 'pk').values_list(
+                                'pk', 'security__company', 'bought_at',
+                                'value'):
+                    prices[date] = cls(
+                        company_id=company, security_id=security, date=date,
+                        value=value, position_id=pk)
+                cls.objects.bulk_create(prices.values())
+
+
 # --------- DJANGO TAGGING ----------
 register(Shareholder)
 
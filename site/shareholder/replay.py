@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import time
+from collections import defaultdict
+
+from shareholder.models import OptionTransaction, Position
+from utils.math import (intervals_to_segments, segments_to_intervals,
+                        substract_intervals)
+
+logger = logging.getLogger(__name__)
+
+
+def _union_intervals(a, b):
+    """ merge two sorted and merged interval lists into one """
+    merged = []
+    for start, end in sorted(a + b):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class LedgerReplay(object):
+    """
+    replays all positions and option transactions of a company in
+    chronological order and checks the whole share register at once:
+
+    * no shareholder holds a negative count of shares or options at the end
+      of any day
+    * no share number is owned by more than one shareholder
+    * no shareholder sells share numbers they do not own
+    * option plans do not grant more options than approved
+
+    each kind of booking is streamed from one ordered query, balances are kept
+    in memory and only entries touched on a day are checked at its end, hence
+    the cost grows with the number of bookings, not shareholders times dates.
+    """
+
+    def __init__(self, company):
+        self.company = company
+        self.securities = {s.pk: s for s in company.security_set.all()}
+        self.option_plans = {
+            op.pk: op for op in company.optionplan_set.all()}
+
+        # shareholder pk -> {security pk: count}
+        self.balances = defaultdict(lambda: defaultdict(int))
+        # shareholder pk -> {option plan pk: count}
+        self.options = defaultdict(lambda: defaultdict(int))
+        # (shareholder pk, security pk) -> owned number intervals
+        self.numbers = defaultdict(list)
+
+        self.negative_balances = []
+        self.negative_options = []
+        self.double_owned_numbers = []
+        self.unowned_numbers = []
+        self.option_overgrants = []
+        self.position_count = 0
+        self.option_transaction_count = 0
+        self.duration = None
+        self._replayed = False
+
+    def _replay_positions(self):
+        tracked = set(pk for pk, security in self.securities.items()
+                      if security.track_numbers)
+        balances = self.balances
+        numbers = self.numbers
+        reported = set()
+        touched = set()
+        day = None
+
+        rows = Position.objects.filter(company=self.company).order_by(
+            'bought_at', 'pk').values_list(
+                'bought_at', 'buyer', 'seller', 'security', 'count',
+                'number_segments').iterator()
+        for bought_at, buyer, seller, security, count, segments in rows:
+            if bought_at != day:
+                self._check_day(day, touched, balances, reported,
+                                self.negative_balances, 'security')
+                day = bought_at
+            self.position_count += 1
+
+            intervals = None
+            if security in tracked and segments:
+                intervals = segments_to_intervals(segments)
+            if buyer:
+                balances[buyer][security] += count
+                touched.add((buyer, security))
+                if intervals:
+                    numbers[(buyer, security)] = _union_intervals(
+                        numbers[(buyer, security)], intervals)
+            if seller:
+                balances[seller][security] -= count
+                touched.add((seller, security))
+                if intervals:
+                    owned = numbers[(seller, security)]
+                    unowned = substract_intervals(intervals, owned)
+                    if unowned:
+                        self.unowned_numbers.append({
+                            'shareholder': seller, 'security': security,
+                            'date': bought_at,
+                            'segments': intervals_to_segments(unowned)})
+                    numbers[(seller, security)] = substract_intervals(
+                        owned, intervals)
+
+        self._check_day(day, touched, balances, reported,
+                        self.negative_balances, 'security')
+
+    def _replay_option_transactions(self):
+        options = self.options
+        granted = defaultdict(int)
+        reported = set()
+        touched = set()
+        day = None
+
+        rows = OptionTransaction.objects.filter(
+            company=self.company).order_by('bought_at', 'pk').values_list(
+                'bought_at', 'buyer', 'seller', 'option_plan',
+                'count').iterator()
+        for bought_at, buyer, seller, option_plan, count in rows:
+            if bought_at != day:
+                self._check_day(day, touched, options, reported,
+                                self.negative_options, 'option_plan')
+                day = bought_at
+            self.option_transaction_count += 1
+
+            if not seller:
+                granted[option_plan] += count
+            else:
+                options[seller][option_plan] -= count
+                touched.add((seller, option_plan))
+            options[buyer][option_plan] += count
+            touched.add((buyer, option_plan))
+
+        self._check_day(day, touched, options, reported,
+                        self.negative_options, 'option_plan')
+
+        for pk, count in granted.items():
+            option_plan = self.option_plans[pk]
+            if count > option_plan.count:
+                self.option_overgrants.append({
+                    'option_plan': pk, 'approved': option_plan.count,
+                    'granted': count})
+
+    def _check_day(self, day, touched, balances, reported, errors, name):
+        """
+        record entries of `touched` with negative balance at the end of
+        `day`, each entry once with the first day it got negative
+        """
+        for shareholder, pk in touched:
+            count = balances[shareholder][pk]
+            if count < 0 and (shareholder, pk) not in reported:
+                reported.add((shareholder, pk))
+                errors.append({'shareholder': shareholder, name: pk,
+                               'date': day, 'count': count})
+        touched.clear()
+
+    def _check_numbers(self):
+        """ find share numbers owned by more than one shareholder """
+        by_security = defaultdict(list)
+        for (shareholder, security), intervals in self.numbers.items():
+            for start, end in intervals:
+                by_security[security].append((start, end, shareholder))
+
+        for security, intervals in by_security.items():
+            intervals.sort()
+            # interval reaching furthest so far
+            last_end, last_shareholder = None, None
+            for start, end, shareholder in intervals:
+                if last_end is not None and start <= last_end:
+                    self.double_owned_numbers.append({
+                        'security': security,
+                        'shareholders': [last_shareholder, shareholder],
+                        'segments': intervals_to_segments(
+                            [(start, min(end, last_end))])})
+                if last_end is None or end > last_end:
+                    last_end, last_shareholder = end, shareholder
+
+    def replay(self):
+        if self._replayed:
+            return
+        self._replayed = True
+
+        started = time.time()
+        self._replay_positions()
+        self._replay_option_transactions()
+        self._check_numbers()
+        self.duration = time.time() - started
+
+        logger.info(
+            'replayed {} positions and {} option transactions of company {} '
+            'in {:.2f}s'.format(self.position_count,
+                                self.option_transaction_count,
+                                self.company.pk, self.duration))
+
+    def is_consistent(self):
+        self.replay()
+        return not (self.negative_balances or self.negative_options or
+                    self.double_owned_numbers or self.unowned_numbers or
+                    self.option_overgrants)
+
+    def get_balances(self):
+        """
+        return dict shareholder pk -> {security pk: count} of shares held
+        after all bookings
+        """
+        self.replay()
+        return {pk: {security: count for security, count in counts.items()
+                     if count}
+                for pk, counts in self.balances.items()}
+
+    def get_report(self):
+        """ return dict with all findings and final balances """
+        self.replay()
+        return {
+            'is_consistent': self.is_consistent(),
+            'position_count': self.position_count,
+            'option_transaction_count': self.option_transaction_count,
+            'duration': self.duration,
+            'negative_balances': self.negative_balances,
+            'negative_options': self.negative_options,
+            'double_owned_numbers': self.double_owned_numbers,
+            'unowned_numbers': self.unowned_numbers,
+            'option_overgrants': self.option_overgrants,
+            'balances': self.get_balances(),
+        }
@@ -1,11 +1,18 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from django.conf import settings
 from django.db import models
 from django.dispatch import receiver
-from shareholder.models import Shareholder, Position, OptionTransaction
+from tagging.models import TaggedItem
+from shareholder.models import (Company, NumberAllocator, OptionPlan,
+                                OptionTransaction, Position, Security,
+                                SecurityPrice, Shareholder, UserProfile)
 from shareholder.tasks import update_order_cache_task
 
+# user fields shown in the share register
+LEDGER_USER_FIELDS = ('first_name', 'last_name', 'email')
+
 
 @receiver(models.signals.post_save, sender=Position)
 @receiver(models.signals.post_save, sender=OptionTransaction)
@@ -21,3 +28,129 @@ def update_order_cache(sender, instance, created, **kwargs):
         update_order_cache_task.apply_async([instance.buyer.pk])
     if sender == OptionTransaction and instance.seller:
         update_order_cache_task.apply_async([instance.seller.pk])
+
+
+@receiver(models.signals.pre_save, sender=Position)
+def remember_security_price_key(sender, instance, raw, **kwargs):
+    """ security and date might change, old price must be refreshed too """
+    if instance.pk and not raw:
+        instance._security_price_key = Position.objects.filter(
+            pk=instance.pk).values_list('security', 'bought_at').first()
+
+
+@receiver(models.signals.post_save, sender=Position)
+@receiver(models.signals.post_delete, sender=Position)
+def refresh_security_price(sender, instance, **kwargs):
+    keys = [(instance.security_id, instance.bought_at)]
+    if getattr(instance, '_security_price_key', None):
+        keys.append(instance._security_price_key)
+    SecurityPrice.refresh(keys)
+
+
+@receiver(models.signals.post_save, sender=Company)
+@receiver(models.signals.post_save, sender=Security)
+@receiver(models.signals.post_save, sender=OptionPlan)
+@receiver(models.signals.post_save, sender=Shareholder)
+@receiver(models.signals.post_save, sender=Position)
+@receiver(models.signals.post_save, sender=OptionTransaction)
+@receiver(models.signals.post_save, sender=UserProfile)
+@receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(models.signals.post_delete, sender=Security)
+@receiver(models.signals.post_delete, sender=OptionPlan)
+@receiver(models.signals.post_delete, sender=Shareholder)
+@receiver(models.signals.post_delete, sender=Position)
+@receiver(models.signals.post_delete, sender=OptionTransaction)
+def touch_company_ledger(sender, instance, **kwargs):
+    """
+    mark share register data of affected companies as changed. user saves
+    limited to other fields than `LEDGER_USER_FIELDS` (e.g. `last_login` on
+    every login) are ignored
+    """
+    update_fields = kwargs.get('update_fields')
+    if (sender not in (Company, Security, OptionPlan, Shareholder, Position,
+                       OptionTransaction, UserProfile) and update_fields and
+            not set(update_fields) & set(LEDGER_USER_FIELDS)):
+        return
+
+    if sender == Company:
+        # keep the saved instance and its ledger cache keys up to date
+        instance.touch_ledger(dependencies=('positions',))
+        return
+
+    if sender in (Security, OptionPlan, Shareholder):
+        qs = Company.objects.filter(pk=instance.company_id)
+    elif sender == Position:
+        qs = Company.objects.filter(security=instance.security_id)
+    elif sender == OptionTransaction:
+        qs = Company.objects.filter(optionplan=instance.option_plan_id)
+    elif sender == UserProfile:
+        qs = Company.objects.filter(shareholder__user=instance.user_id)
+    else:  # user
+        qs = Company.objects.filter(shareholder__user=instance.pk)
+
+    if sender in (Security, OptionPlan, Position, OptionTransaction):
+        dependencies = ('positions',)
+    else:
+        dependencies = ('shareholders',)
+    Company.touch_ledgers(qs, dependencies=dependencies)
+
+
+@receiver(models.signals.post_save, sender=Shareholder)
+@receiver(models.signals.post_delete, sender=Shareholder)
+@receiver(models.signals.post_save, sender=TaggedItem)
+@receiver(models.signals.post_delete, sender=TaggedItem)
+def invalidate_shareholder_roles(sender, instance, **kwargs):
+    """ special shareholders (company, dispo, transfer) might have changed """
+    if sender == TaggedItem:
+        if instance.content_type.model_class() != Shareholder:
+            return
+        instance = instance.object
+        if not instance:
+            return
+
+    if sender == Shareholder and not kwargs.get('created', True):
+        return
+
+    instance.company.invalidate_shareholder_roles()
+
+
+@receiver(models.signals.post_save, sender=Company)
+def create_number_allocator(sender, instance, created, **kwargs):
+    if created:
+        NumberAllocator.objects.get_or_create(company=instance)
+
+
+@receiver(models.signals.post_save, sender=Position)
+@receiver(models.signals.post_save, sender=OptionTransaction)
+@receiver(models.signals.post_save, sender=Shareholder)
+def register_number(sender, instance, **kwargs):
+    """
+    numbers entered manually must not be allocated again. the number of the
+    dispo shareholder is not part of the sequence
+    """
+    if sender == Shareholder:
+        if instance.pk in instance.company.get_shareholder_roles()['dispo']:
+            return
+        NumberAllocator.register(instance.company_id, 'shareholder_number',
+                                 [instance.number])
+    elif instance.certificate_id:
+        NumberAllocator.register(instance.company_id, 'certificate_id',
+                                 [instance.certificate_id])
+
+
+@receiver(models.signals.post_save, sender=TaggedItem)
+@receiver(models.signals.post_delete, sender=TaggedItem)
+def rebuild_shareholder_number(sender, instance, **kwargs):
+    """ number of the dispo shareholder is not part of the sequence """
+    if instance.content_type.model_class() != Shareholder:
+        return
+    shareholder = instance.object
+    if not shareholder:
+        return
+
+    allocator, created = NumberAllocator.objects.get_or_create(
+        company=shareholder.company)
+    if created:
+        allocator.rebuild()
+    else:
+        allocator.rebuild(fields=('shareholder_number',))
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.translation import ugettext as _
+
+from shareholder.ledger import _to_date, refresh_derived_caches
+from shareholder.models import Position
+
+logger = logging.getLogger(__name__)
+
+
+class ShareSplit(object):
+    """
+    share split of `security` on `execute_at` with ratio dividend:divisor.
+    each active shareholder returns his shares to the company shareholder and
+    gets the new count issued, the company shareholder itself destroys and
+    creates the company share count.
+
+    all positions are computed in memory from one balance query, `preview`
+    returns the result without writing, `execute` inserts all positions in
+    one transaction.
+    """
+
+    def __init__(self, company, security, execute_at, dividend, divisor):
+        self.company = company
+        self.security = security
+        self.execute_at = execute_at
+        self.dividend = float(dividend)
+        self.divisor = float(divisor)
+        self.company_shareholder = company.get_company_shareholder()
+
+        self.positions = []
+        # shareholder pk -> fractional share right lost by the split
+        self.partials = {}
+        # list of (shareholder, old count, new count)
+        self.counts = []
+        self._computed = False
+
+    def _get_balances(self):
+        """
+        return dict shareholder pk -> {security pk: share count} on
+        `execute_at` for all shareholders of the company
+        """
+        date = _to_date(self.execute_at)
+        balances = defaultdict(lambda: defaultdict(int))
+        bought = Position.objects.filter(
+            company=self.company, buyer__isnull=False,
+            bought_at__lte=date).values(
+                'buyer', 'security').annotate(count=Sum('count'))
+        for row in bought:
+            balances[row['buyer']][row['security']] += row['count']
+        sold = Position.objects.filter(
+            company=self.company, seller__isnull=False,
+            bought_at__lte=date).values(
+                'seller', 'security').annotate(count=Sum('count'))
+        for row in sold:
+            balances[row['seller']][row['security']] -= row['count']
+        return balances
+
+    def _get_active_shareholders(self, balances):
+        """
+        return shareholders with shares on `execute_at` ordered by number,
+        same as `Company.get_active_shareholders`
+        """
+        company_shareholder_pk = self.company_shareholder.pk
+        pks = []
+        for pk, counts in balances.items():
+            count = sum(counts.values())
+            if pk == company_shareholder_pk:
+                # clean company shareholder count by options count
+                count -= self.company.get_total_options()
+            if count > 0:
+                pks.append(pk)
+        return self.company.shareholder_set.filter(pk__in=pks).order_by(
+            'number')
+
+    def compute(self):
+        """ compute all split positions in memory """
+        if self._computed:
+            return
+        self._computed = True
+
+        balances = self._get_balances()
+        company_shareholder = self.company_shareholder
+        value = company_shareholder.last_traded_share_price(
+            date=self.execute_at, security=self.security)
+        ratio = (self.security, self.execute_at.date(), int(self.dividend),
+                 int(self.divisor))
+
+        for shareholder in self._get_active_shareholders(balances):
+            is_company_shareholder = shareholder.pk == company_shareholder.pk
+            count = balances[shareholder.pk][self.security.pk]
+
+            # return old shares to company
+            kwargs1 = {
+                'buyer': company_shareholder,
+                'seller': shareholder,
+                'count': count,
+                'value': value,
+                'security': self.security,
+                'company': self.company,
+                'bought_at': self.execute_at,
+                'is_split': True,
+                'comment': _('Share split of {} on {} with ratio {}:{}. '
+                             'Return of old shares.').format(*ratio),
+            }
+            if value:
+                kwargs1.update({'value': float(value)})
+            if is_company_shareholder:
+                count = self.company.share_count
+                kwargs1.update(dict(buyer=None, count=count,
+                                    value=shareholder.buyer.first().value))
+            self.positions.append(Position(**kwargs1))
+
+            # hand out new shares with new count
+            if is_company_shareholder:
+                part, count2 = math.modf(count / self.dividend * self.divisor)
+            else:
+                part, count2 = math.modf(count * self.divisor / self.dividend)
+            kwargs2 = {
+                'buyer': shareholder,
+                'seller': company_shareholder,
+                'count': int(count2),
+                'security': self.security,
+                'company': self.company,
+                'bought_at': self.execute_at,
+                'is_split': True,
+                'comment': _('Share split of {} on {} with ratio {}:{}. '
+                             'Provisioning of new shares.').format(*ratio),
+            }
+            if value:
+                kwargs2.update(
+                    {'value': float(value) / self.divisor * self.dividend})
+            if is_company_shareholder:
+                kwargs2.update({'seller': None})
+            self.positions.append(Position(**kwargs2))
+
+            if part != 0.0:
+                self.partials.update({shareholder.pk: round(part, 6)})
+            self.counts.append((shareholder, count, int(count2)))
+
+        self.share_count = int(
+            self.company.share_count / self.dividend * self.divisor)
+
+    def preview(self):
+        """
+        return dry run result: new company share count, old and new count and
+        fractional rights per shareholder
+        """
+        self.compute()
+        return {
+            'share_count': self.share_count,
+            'shareholders': [{
+                'pk': shareholder.pk,
+                'number': shareholder.number,
+                'name': shareholder.get_full_name(),
+                'count': count,
+                'new_count': new_count,
+                'partial': self.partials.get(shareholder.pk, 0.0),
+            } for shareholder, count, new_count in self.counts],
+        }
+
+    def execute(self):
+        """ write split positions and new company share count at once """
+        self.compute()
+        with transaction.atomic():
+            Position.objects.bulk_create(self.positions)
+            self.company.share_count = self.share_count
+            self.company.save()
+
+        refresh_derived_caches(self.positions)
+        logger.info('Split: {} positions created for {}'.format(
+            len(self.positions), self.security))
+
+        # record partial shares to operator
+        self.company._send_partial_share_rights_email(self.partials)
@@ -8,6 +8,7 @@ import os
 import requests
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.exceptions import ValidationError
 from django.core.mail import (EmailMessage, EmailMultiAlternatives,
                               mail_admins, send_mail)
 from django.core.urlresolvers import reverse
@@ -20,10 +21,12 @@ from django.utils.translation import activate as activate_lang
 from django.utils.translation import ugettext as _
 
 from pingen.api import Pingen
+from pingen import conf as pingen_conf
 from project.celery import app
 from shareholder.import_backends import SwissBankImportBackend
 from shareholder.models import (Company, Shareholder, ShareholderStatement,
-                                ShareholderStatementReport)
+                                ShareholderStatementReport, UserProfile)
+from shareholder.replay import LedgerReplay
 from utils.pdf import render_pdf
 from utils.formatters import make_numeric
 
@@ -467,6 +470,42 @@ def send_statement_letter(statement_id):
         obj.save()
 
 
+@app.task
+def send_statement_letters_batch(statement_ids):
+    """
+    send letters for a batch of statements via service. uses a single api
+    client uploading concurrently over pooled connections or, if
+    `PINGEN['BATCH_ZIP_UPLOAD']` is set, all letters inside one ZIP file.
+    statements already sent or downloaded are skipped, so retries are safe
+    """
+    statements = list(ShareholderStatement.objects.filter(
+        UserProfile.get_has_address_query(prefix='user__userprofile__'),
+        pk__in=statement_ids, letter_sent_at=None, pdf_downloaded_at=None,
+        report__company__send_shareholder_statement_via_letter_enabled=True))
+
+    if not statements:
+        return 0
+
+    api = Pingen()
+    docs = [statement.pdf_file for statement in statements]
+    if pingen_conf.pingen_settings.BATCH_ZIP_UPLOAD:
+        try:
+            results = [api.upload_zip(docs)] * len(docs)
+        except ValueError:
+            logger.exception('cannot send statement letters as zip',
+                             extra={'statement_ids': statement_ids})
+            return 0
+    else:
+        results = api.upload_documents(docs)
+
+    sent_pks = [statement.pk for statement, result
+                in zip(statements, results) if result]
+    ShareholderStatement.objects.filter(pk__in=sent_pks).update(
+        letter_sent_at=now(), updated_at=now())
+
+    return len(sent_pks)
+
+
 @app.task
 def send_statement_letters():
     """
@@ -475,23 +514,28 @@ def send_statement_letters():
     """
     offset = getattr(settings, 'SHAREHOLDER_STATMENT_LETTER_OFFSET_DAYS', 7)
     report_date = now().date() - timedelta(days=offset)
-    # find reports
-    report_qs = ShareholderStatementReport.objects.filter(
-        report_date=report_date)
-    for report in report_qs:
-        # find statements that were not downloaded (in time)
-        statement_qs = report.shareholderstatement_set.filter(
-            pdf_downloaded_at=None, letter_sent_at=None)
-        for statement in statement_qs:
-            # check if statement user has an postal address
-            if not statement.user.userprofile.has_address:
-                # bummer
-                logger.warning('cannot send statement, missing address',
-                               extra={'statement_pk': statement.pk})
-                continue
+    # find statements that were not downloaded (in time)
+    statement_qs = ShareholderStatement.objects.filter(
+        report__report_date=report_date,
+        pdf_downloaded_at=None, letter_sent_at=None)
+
+    # check if statement user has an postal address
+    address_query = UserProfile.get_has_address_query(
+        prefix='user__userprofile__')
+    statement_ids = list(statement_qs.filter(address_query).order_by(
+        'pk').values_list('pk', flat=True))
+    missing_address_ids = list(statement_qs.exclude(
+        pk__in=statement_ids).values_list('pk', flat=True))
+    if missing_address_ids:
+        # bummer
+        logger.warning('cannot send statements, missing address',
+                       extra={'statement_pks': missing_address_ids})
 
-            # send letter via service to user
-            send_statement_letter.delay(statement.pk)
+    # send letters via service to users
+    batch_size = pingen_conf.pingen_settings.BATCH_SIZE
+    for index in range(0, len(statement_ids), batch_size):
+        send_statement_letters_batch.delay(
+            statement_ids[index:index + batch_size])
 
 
 @app.task
@@ -502,6 +546,38 @@ def update_banks_from_six():
     SwissBankImportBackend().update()
 
 
+@app.task
+def validate_share_register_task(company_pk):
+    """
+    validate share register of company, results are available via
+    `Company.get_register_health`
+    """
+    company = Company.objects.get(pk=company_pk)
+    try:
+        company.full_validate()
+    except ValidationError as e:
+        logger.info('share register invalid', extra={'company': company_pk,
+                                                      'errors': e.messages})
+
+
+@app.task
+def replay_ledger_task(company_pk):
+    """
+    replay all bookings of the company and log inconsistencies, see
+    `shareholder.replay.LedgerReplay`
+    """
+    replay = LedgerReplay(Company.objects.get(pk=company_pk))
+    if not replay.is_consistent():
+        logger.warning('share register inconsistent', extra={
+            'company': company_pk,
+            'negative_balances': replay.negative_balances,
+            'negative_options': replay.negative_options,
+            'double_owned_numbers': replay.double_owned_numbers,
+            'unowned_numbers': replay.unowned_numbers,
+            'option_overgrants': replay.option_overgrants})
+    return replay.is_consistent()
+
+
 @app.task
 def update_order_cache_task(shareholder_pk):
     """ update cache in model for some shareholder values for faster sorting and
@@ -514,6 +590,7 @@ def update_order_cache_task(shareholder_pk):
         return
 
     order_cache = shareholder.order_cache
+    old_order_cache = dict(order_cache)
     order_cache['share_count'] = shareholder.share_count()
     order_cache['postal_code'] = (
         shareholder.user.userprofile.postal_code or 0)
@@ -525,6 +602,9 @@ def update_order_cache_task(shareholder_pk):
     # use `update()` to not trigger the signal itself again
     Shareholder.objects.filter(pk=shareholder.pk).update(
         order_cache=order_cache)
+    # list ordering changed
+    if order_cache != old_order_cache:
+        shareholder.company.touch_ledger(dependencies=())
 
 
 @app.task
@@ -1,12 +1,8 @@
-from dateutil.relativedelta import relativedelta
-
 from django import template
 from django.conf import settings
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
-from shareholder.models import OptionTransaction
-
 
 register = template.Library()
 
@@ -212,18 +208,8 @@ def get_vested_positions(shareholder, date=None, security=None):
 
 @register.assignment_tag
 def get_vested_option_positions(shareholder, date=None):
-    positions = shareholder.option_buyer.filter(
-        vesting_months__isnull=False)
-    position_pks = []
-    date = date or now().date()
-    for position in positions:
-        expiration_date = position.bought_at + relativedelta(
-            months=position.vesting_months)
-        if expiration_date > date:
-            position_pks.append(position.pk)
-
-    positions = OptionTransaction.objects.filter(pk__in=position_pks)
-    return positions
+    return shareholder.option_buyer.filter(
+        vesting_expires_at__gt=date or now().date())
 
 
 @register.assignment_tag
@@ -1,6 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import hashlib
+import os
 
+import mock
 from django.test import TestCase
 
 from shareholder.import_backends import SwissBankImportBackend
@@ -13,6 +16,8 @@ CONTENT = (u"01100  0000     001008100  120160115131SNB            "
            u"31 31 11                              30-5-5      "
            u"SNBZCHZZXXX   ")
 
+FIXTURE = os.path.join(os.path.dirname(__file__), 'files', 'swiss_banks.txt')
+
 
 class SwissBankImportBackendTestCase(TestCase):
     """
@@ -45,3 +50,34 @@ class SwissBankImportBackendTestCase(TestCase):
         self.backend._get_or_create_bank(res)
         self.assertEqual(Bank.objects.count(), 1)
         self.assertEqual(Bank.objects.first().address, u'Börsenstrasse 15')
+
+    def test_update(self):
+        res = self.backend.update(filename=FIXTURE)
+        self.assertEqual(res, dict(created=2, updated=0, unchanged=0))
+        self.assertEqual(Bank.objects.count(), 2)
+        bank = Bank.objects.get(bcnr='110', branchid='0000')
+        self.assertEqual(bank.city, u'Bern')
+        self.assertEqual(bank.address, u'Bundesplatz 1')
+
+        # only changed banks are written
+        Bank.objects.filter(pk=bank.pk).update(city=u'Thun')
+        res = self.backend.update(filename=FIXTURE)
+        self.assertEqual(res, dict(created=0, updated=1, unchanged=1))
+        self.assertEqual(Bank.objects.count(), 2)
+        bank.refresh_from_db()
+        self.assertEqual(bank.city, u'Bern')
+
+    @mock.patch('shareholder.import_backends.cache')
+    def test_update_unchanged(self, cache_mock):
+        """ skip import if the list is the same as last time """
+        with open(FIXTURE, 'rb') as f:
+            cache_mock.get.return_value = hashlib.md5(f.read()).hexdigest()
+
+        self.assertIsNone(self.backend.update(filename=FIXTURE))
+        self.assertFalse(Bank.objects.exists())
+
+        res = self.backend.update(filename=FIXTURE, force=True)
+        self.assertEqual(res['created'], 2)
+        cache_mock.set.assert_called_with(
+            self.backend.checksum_cache_key, cache_mock.get.return_value,
+            None)
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from project.generators import (CompanyShareholderGenerator,
+                                OptionPlanGenerator,
+                                OptionTransactionGenerator, PositionGenerator,
+                                SecurityGenerator, ShareholderGenerator)
+from shareholder.ledger import Ledger
+from shareholder.models import NumberAllocator, OptionTransaction, Position
+
+
+class LedgerTestCase(TestCase):
+
+    def setUp(self):
+        self.security = SecurityGenerator().generate(
+            track_numbers=True, number_segments=[u'1-10'])
+        self.company = self.security.company
+        CompanyShareholderGenerator().generate(company=self.company)
+        self.seller = ShareholderGenerator().generate(company=self.company)
+        self.buyer = ShareholderGenerator().generate(company=self.company)
+        PositionGenerator().generate(
+            seller=None, buyer=self.seller, security=self.security, count=5,
+            number_segments=[u'1-5'], bought_at=datetime.date(2017, 1, 1))
+
+    def test_lookups(self):
+        ledger = Ledger(self.company, holders=[self.seller.pk],
+                        shareholder_pks=[self.buyer.pk])
+
+        self.assertEqual(ledger.get_shareholder(pk=self.buyer.pk), self.buyer)
+        self.assertEqual(ledger.get_shareholder(number=self.buyer.number),
+                         self.buyer)
+        self.assertEqual(ledger.get_security(pk=self.security.pk),
+                         self.security)
+        self.assertEqual(
+            ledger.share_count_sellable(self.seller.pk, self.security.pk),
+            self.seller.share_count_sellable(security=self.security))
+        self.assertEqual(
+            ledger.current_segments(self.seller.pk, self.security.pk),
+            self.seller.current_segments(self.security))
+        self.assertEqual(
+            ledger.share_count_sellable(self.seller.pk, self.security.pk,
+                                        date=datetime.date(2016, 1, 1)), 0)
+
+    def test_add_position(self):
+        ledger = Ledger(self.company, holders=[self.seller.pk, self.buyer.pk])
+        position = Position(
+            buyer=self.buyer, seller=self.seller, security=self.security,
+            count=2, number_segments=[1, 2], certificate_id='99',
+            bought_at=datetime.date(2017, 2, 1))
+        ledger.add_position(position)
+
+        self.assertEqual(
+            ledger.share_count_sellable(self.seller.pk, self.security.pk), 3)
+        self.assertEqual(
+            ledger.current_segments(self.seller.pk, self.security.pk),
+            [u'3-5'])
+        # bought into certificate depot
+        self.assertEqual(
+            ledger.share_count_sellable(self.buyer.pk, self.security.pk), 0)
+        self.assertTrue(ledger.has_certificate_id('99'))
+
+        count = Position.objects.count()
+        ledger.save()
+        self.assertEqual(Position.objects.count(), count + 1)
+        # bulk insert skips post_save, numbers are registered by save
+        self.assertEqual(NumberAllocator.objects.get(
+            company=self.company).certificate_id, 99)
+        self.assertEqual(self.seller.share_count(security=self.security), 3)
+        # denormalized company is set by save and by bulk booking
+        self.assertFalse(
+            Position.objects.exclude(company=self.company).exists())
+
+    def test_share_count_sellable_vesting(self):
+        # vesting is evaluated at the requested date
+        PositionGenerator().generate(
+            seller=None, buyer=self.buyer, security=self.security, count=3,
+            number_segments=[u'6-8'], bought_at=datetime.date(2017, 1, 1),
+            vesting_months=12)
+        ledger = Ledger(self.company, holders=[self.buyer.pk])
+
+        for date in [datetime.date(2017, 6, 1), datetime.date(2018, 6, 1)]:
+            self.assertEqual(
+                ledger.share_count_sellable(self.buyer.pk, self.security.pk,
+                                            date=date),
+                self.buyer.share_count_sellable(date=date,
+                                                security=self.security))
+        self.assertEqual(
+            ledger.share_count_sellable(self.buyer.pk, self.security.pk,
+                                        date=datetime.date(2017, 6, 1)), 0)
+        self.assertEqual(
+            ledger.share_count_sellable(self.buyer.pk, self.security.pk,
+                                        date=datetime.date(2018, 6, 1)), 3)
+
+    def test_save_concurrent_sale(self):
+        ledger = Ledger(self.company, holders=[self.seller.pk])
+        ledger.add_position(Position(
+            buyer=self.buyer, seller=self.seller, security=self.security,
+            count=4, number_segments=[u'1-4'],
+            bought_at=datetime.date(2017, 2, 1)))
+        # booked after the ledger was loaded
+        PositionGenerator().generate(
+            seller=self.seller, buyer=self.buyer, security=self.security,
+            count=3, number_segments=[u'3-5'],
+            bought_at=datetime.date(2017, 1, 15))
+
+        count = Position.objects.count()
+        with self.assertRaises(ValidationError):
+            ledger.save()
+        self.assertEqual(Position.objects.count(), count)
+
+    def test_add_option_transaction(self):
+        company_shareholder = self.company.get_company_shareholder()
+        option_plan = OptionPlanGenerator().generate(
+            company=self.company, security=self.security,
+            number_segments=[u'6-10'])
+        ledger = Ledger(self.company,
+                        holders=[company_shareholder.pk, self.buyer.pk])
+        count = ledger.share_count_sellable(company_shareholder.pk,
+                                            self.security.pk)
+
+        # options granted in the batch reduce the company shareholders shares
+        ledger.add_option_transaction(OptionTransaction(
+            option_plan=option_plan, seller=None, buyer=self.buyer, count=2,
+            number_segments=[u'6-7'], bought_at=datetime.date(2017, 2, 1)))
+        self.assertEqual(
+            ledger.share_count_sellable(company_shareholder.pk,
+                                        self.security.pk), count - 2)
+        self.assertEqual(ledger.options_count(self.buyer.pk,
+                                              self.security.pk), 2)
+
+        ledger.save()
+        self.assertEqual(
+            Ledger(self.company).share_count_sellable(
+                company_shareholder.pk, self.security.pk),
+            company_shareholder.share_count_sellable(security=self.security))
+
+    def test_save_concurrent_option_sale(self):
+        option_plan = OptionPlanGenerator().generate(
+            company=self.company, security=self.security,
+            number_segments=[u'6-10'])
+        OptionTransactionGenerator().generate(
+            option_plan=option_plan, seller=None, buyer=self.seller, count=3,
+            number_segments=[u'6-8'], bought_at=datetime.date(2017, 1, 1))
+        ledger = Ledger(self.company, holders=[self.seller.pk])
+        ledger.add_option_transaction(OptionTransaction(
+            option_plan=option_plan, seller=self.seller, buyer=self.buyer,
+            count=3, number_segments=[u'6-8'],
+            bought_at=datetime.date(2017, 2, 1)))
+        # booked after the ledger was loaded
+        OptionTransactionGenerator().generate(
+            option_plan=option_plan, seller=self.seller, buyer=self.buyer,
+            count=2, number_segments=[u'6-7'],
+            bought_at=datetime.date(2017, 1, 15))
+
+        count = OptionTransaction.objects.count()
+        with self.assertRaises(ValidationError):
+            ledger.save()
+        self.assertEqual(OptionTransaction.objects.count(), count)
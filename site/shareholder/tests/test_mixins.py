@@ -158,6 +158,21 @@ class DiscountedTaxByVestingModelMixinTestCase(TestCase):
             self.option.get_vesting_expires_at(),
             today + relativedelta(years=10))
 
+    def test_update_vesting_expires_at(self):
+        """ expiration is stored on save """
+        today = timezone.now().date()
+        self.position.refresh_from_db()
+        self.assertEqual(self.position.vesting_expires_at,
+                         today + relativedelta(years=2))
+        self.option.refresh_from_db()
+        self.assertEqual(self.option.vesting_expires_at,
+                         today + relativedelta(years=10))
+
+        self.position.vesting_months = None
+        self.position.save()
+        self.position.refresh_from_db()
+        self.assertIsNone(self.position.vesting_expires_at)
+
     def test_get_discounted_tax_ratio(self):
         """ return percent to be applied for discounted tax value calculation
         read: https://goo.gl/n5p0IR
@@ -16,6 +16,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.test import TestCase, TransactionTestCase, override_settings
 from django.test.client import Client, RequestFactory
@@ -34,10 +35,12 @@ from project.generators import (BankGenerator, CompanyGenerator,
                                 SecurityGenerator, ShareholderGenerator,
                                 TwoInitialSecuritiesGenerator, UserGenerator)
 from project.tests.mixins import StripeTestCaseMixin, SubscriptionTestMixin
-from shareholder.models import (Company, Country, Position, Security,
-                                Shareholder, ShareholderStatement,
+from shareholder.models import (Company, Country, NumberAllocator,
+                                Position, Security, Shareholder,
+                                ShareholderStatement,
                                 ShareholderStatementReport, UserProfile,
                                 create_auth_token)
+from shareholder.validators import ShareRegisterValidator
 
 logger = logging.getLogger(__name__)
 
@@ -116,11 +119,11 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
                                               security=self.security, count=2,
                                               option_plan=optionplan)
 
-    @mock.patch('shareholder.models.cache')
+    @mock.patch('shareholder.models.captable_cache')
     def test_get_active_shareholders(self, cache_mock):
         """ return qs of active shareholders """
         cache_mock.get.return_value = None
-        cache_key = 'company-{}-{}-none-active-shareholders'.format(
+        cache_key = 'company-{}-active-shareholders-{}-none'.format(
             self.company.pk, timezone.now().date())
 
         shs = self.company.get_active_shareholders()
@@ -176,6 +179,8 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
         self.position2.certificate_id = '99'
         self.position2.save()
         self.assertEqual(self.company.get_new_certificate_id(), 100)
+        # reserved, not handed out twice
+        self.assertEqual(self.company.get_new_certificate_id(), 101)
 
     def test_get_new_shareholder_number(self):
         """ get new unused shareholder number """
@@ -191,6 +196,34 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
 
         self.assertEqual(self.company.get_new_shareholder_number(), 99)
 
+    @mock.patch('shareholder.models.captable_cache')
+    def test_get_shareholder_roles(self, cache_mock):
+        """ pks of special shareholders, cached per company """
+        cache_mock.get.return_value = None
+        cache_key = u'company-{}-shareholder-roles'.format(self.company.pk)
+
+        roles = self.company.get_shareholder_roles()
+        self.assertEqual(
+            roles, {'company': self.shareholder1.pk, 'dispo': [],
+                    'transfer': []})
+        cache_mock.set.assert_called_with(cache_key, roles, 86400)
+
+        self.shareholder2.set_dispo_shareholder()
+        cache_mock.delete.assert_called_with(cache_key)
+        roles = self.company.get_shareholder_roles()
+        self.assertEqual(roles['dispo'], [self.shareholder2.pk])
+        self.assertTrue(self.shareholder2.is_dispo_shareholder())
+        self.assertFalse(self.shareholder2.is_company_shareholder())
+        self.assertEqual(self.company.get_dispo_shareholder(),
+                         self.shareholder2)
+
+        # cache hit
+        cache_mock.reset_mock()
+        cache_mock.get.return_value = roles
+        self.assertEqual(self.company.get_company_shareholder(),
+                         self.shareholder1)
+        cache_mock.set.assert_not_called()
+
     def test_text_repr(self):
 
         optiontransaction, shs = \
@@ -263,6 +296,70 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
             seller=self.shareholder1, security=self.security, count=1, buyer=ds)
         self.assertEqual(self.company.get_total_votes_floating(), 2*100/2)
 
+    def test_get_share_values(self):
+        """ value of all holdings at once, priced by last valued trade """
+        company = CompanyGenerator().generate(share_count=1000)
+        security = SecurityGenerator().generate(company=company)
+        sc = ShareholderGenerator().generate(company=company)
+        s1 = ShareholderGenerator().generate(company=company)
+        PositionGenerator().generate(
+            buyer=sc, seller=None, count=1000, value=1, security=security,
+            bought_at=datetime.date(2016, 1, 1))
+        position = PositionGenerator().generate(
+            buyer=s1, seller=sc, count=100, value=5, security=security,
+            bought_at=datetime.date(2017, 1, 1))
+
+        self.assertEqual(company.get_share_prices(),
+                         {security.pk: Decimal('5')})
+        self.assertEqual(
+            company.get_share_prices(date=datetime.date(2016, 6, 1)),
+            {security.pk: Decimal('1')})
+        self.assertEqual(company.get_share_values(),
+                         {sc.pk: 900 * 5, s1.pk: 100 * 5})
+        self.assertEqual(
+            company.get_share_values(date=datetime.date(2016, 6, 1)),
+            {sc.pk: 1000, s1.pk: 0})
+        self.assertEqual(s1.last_traded_share_price(), Decimal('5'))
+
+        # price series follows changes
+        position.value = None
+        position.save()
+        self.assertEqual(company.get_share_prices(),
+                         {security.pk: Decimal('1')})
+        position.delete()
+        self.assertEqual(company.get_last_share_price(), Decimal('1'))
+
+    def test_get_vote_summary(self):
+        """ all vote totals of the company at once """
+        ds = ShareholderGenerator().generate(company=self.company)
+        ds.set_dispo_shareholder()
+        PositionGenerator().generate(
+            seller=self.shareholder1, security=self.security, count=1, buyer=ds)
+        security2 = SecurityGenerator().generate(
+            company=self.company, title='C', face_value=10, count=20)
+        PositionGenerator().generate(
+            seller=None, buyer=self.shareholder2, security=security2,
+            count=20)
+
+        summary = self.company.get_vote_summary()
+        self.assertEqual(summary['total'], self.company.get_total_votes())
+        self.assertEqual(summary['floating'],
+                         self.company.get_total_votes_floating())
+        self.assertEqual(summary['in_options'],
+                         self.company.get_total_votes_in_options())
+        self.assertEqual(summary['eligible'],
+                         self.company.get_total_votes_eligible())
+        for security in (self.security, security2):
+            self.assertEqual(
+                summary['securities'][security.pk],
+                {'total': self.company.get_total_votes(security=security),
+                 'floating': self.company.get_total_votes_floating(
+                     security=security),
+                 'in_options': self.company.get_total_votes_in_options(
+                     security=security),
+                 'eligible': self.company.get_total_votes_eligible(
+                     security=security)})
+
     @mock.patch('shareholder.models.select_template')
     def test_statement_template(self, mock_select_template):
         """
@@ -359,6 +456,29 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
             self.assertIn('create_shareholders',
                           self.company.subscription_permissions)
 
+    def test_get_ledger_cache_key(self):
+        company = Company.objects.get(pk=self.company.pk)
+        with self.assertNumQueries(1):
+            key = company.get_ledger_cache_key('foo', 1)
+            self.assertEqual(company.get_ledger_cache_key('foo', 1), key)
+
+        # changes by other processes are seen after refresh only
+        Company.objects.filter(pk=company.pk).update(
+            ledger_changed_at=timezone.now())
+        self.assertEqual(company.get_ledger_cache_key('foo', 1), key)
+        company.refresh_ledger_changed_at()
+        self.assertNotEqual(company.get_ledger_cache_key('foo', 1), key)
+
+        key = company.get_ledger_cache_key('foo', 1)
+        company.touch_ledger()
+        self.assertNotEqual(company.get_ledger_cache_key('foo', 1), key)
+
+        # changes of this process through other instances are seen at once
+        key = company.get_ledger_cache_key('foo', 1)
+        PositionGenerator().generate(company=Company.objects.get(
+            pk=company.pk))
+        self.assertNotEqual(company.get_ledger_cache_key('foo', 1), key)
+
     def test_has_printed_certificates(self):
         ot = OptionTransactionGenerator().generate()
         self.assertFalse(ot.option_plan.company.has_printed_certificates())
@@ -366,6 +486,78 @@ class CompanyTestCase(StripeTestCaseMixin, SubscriptionTestMixin, TestCase):
         ot.save()
         self.assertTrue(ot.option_plan.company.has_printed_certificates())
 
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_register_health(self):
+        """ validation results are stored and reused until changes """
+        self.assertIsNone(self.company.get_register_health())
+        self.company.share_count = 11
+        self.company.save()
+
+        with self.assertRaises(ValidationError):
+            self.company.full_validate()
+
+        health = self.company.get_register_health()
+        self.assertFalse(health['valid'])
+        self.assertFalse(health['is_outdated'])
+        self.assertFalse(health['checks']['company_share_count']['valid'])
+        self.assertTrue(health['checks']['security_share_count']['valid'])
+        self.assertIsNotNone(
+            health['checks']['company_share_count']['checked_at'])
+
+        # unchanged register: only checks not tracked by the ledger run
+        with mock.patch.object(ShareRegisterValidator,
+                               'shareholders_have_users') as check, \
+                mock.patch.object(ShareRegisterValidator,
+                                  'has_operator') as operator_check:
+            with self.assertRaises(ValidationError):
+                self.company.full_validate()
+            check.assert_not_called()
+            operator_check.assert_called_once_with()
+
+        # changed positions: checks depending on shareholders are kept
+        self.company.touch_ledger(dependencies=('positions',))
+        self.assertTrue(self.company.get_register_health()['is_outdated'])
+        with mock.patch.object(ShareRegisterValidator,
+                               'shareholders_have_users') as check, \
+                mock.patch.object(ShareRegisterValidator,
+                                  'company_share_count') as count_check:
+            self.company.full_validate()
+            check.assert_not_called()
+            count_check.assert_called_once_with()
+
+        # changed shareholders
+        self.company.touch_ledger(dependencies=('shareholders',))
+        with mock.patch.object(ShareRegisterValidator,
+                               'shareholders_have_users') as check, \
+                mock.patch.object(ShareRegisterValidator,
+                                  'company_share_count') as count_check:
+            with self.assertRaises(ValidationError):
+                self.company.full_validate()
+            check.assert_called_once_with()
+            count_check.assert_not_called()
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('shareholder.tasks.validate_share_register_task')
+    def test_get_register_health_schedule(self, task_mock):
+        """ outdated register is validated in the background once """
+        self.company.get_register_health()
+        task_mock.delay.assert_not_called()
+
+        self.company.get_register_health(schedule=True)
+        self.company.get_register_health(schedule=True)
+        task_mock.delay.assert_called_once_with(self.company.pk)
+
+        task_mock.reset_mock()
+        ShareRegisterValidator(self.company).validate()
+        self.company.get_register_health(schedule=True)
+        task_mock.delay.assert_not_called()
+
+        self.company.touch_ledger()
+        self.company.get_register_health(schedule=True)
+        task_mock.delay.assert_called_once_with(self.company.pk)
+
     def test_has_vested_positions(self):
         ot = OptionTransactionGenerator().generate()
         self.assertFalse(ot.option_plan.company.has_vested_positions())
@@ -388,6 +580,83 @@ class CountryTestCase(TestCase):
         self.assertEqual(country.name, 'Germany')
 
 
+class NumberAllocatorTestCase(TestCase):
+
+    def setUp(self):
+        self.security = SecurityGenerator().generate()
+        self.company = self.security.company
+        CompanyShareholderGenerator().generate(company=self.company)
+
+    def get_allocator(self):
+        return NumberAllocator.objects.get(company=self.company)
+
+    def test_register(self):
+        """ numbers entered manually are registered on save """
+        shareholder = ShareholderGenerator().generate(
+            company=self.company, number=u'500')
+        self.assertEqual(self.get_allocator().shareholder_number, 500)
+
+        # lower numbers keep the highest one
+        shareholder.number = u'7'
+        shareholder.save()
+        self.assertEqual(self.get_allocator().shareholder_number, 500)
+        self.assertEqual(self.company.get_new_shareholder_number(), 501)
+
+        PositionGenerator().generate(
+            company=self.company, security=self.security, seller=None,
+            buyer=shareholder, certificate_id=u'A77')
+        self.assertEqual(self.get_allocator().certificate_id, 77)
+        self.assertEqual(self.company.get_new_certificate_id(), 78)
+
+    def test_register_long_numbers(self):
+        """ free-text ids exceed integer columns """
+        shareholder = ShareholderGenerator().generate(
+            company=self.company, number=u'1')
+        position = PositionGenerator().generate(
+            company=self.company, security=self.security, seller=None,
+            buyer=shareholder, certificate_id=u'2016-001-0001')
+        self.assertEqual(self.get_allocator().certificate_id, 20160010001)
+
+        # out of bigint range, skipped
+        position.certificate_id = u'2016-001-0001-0001-0001-0001'
+        position.save()
+        self.assertEqual(self.get_allocator().certificate_id, 20160010001)
+        self.assertEqual(self.company.get_new_certificate_id(), 20160010002)
+
+    def test_rebuild_on_dispo_tag(self):
+        """ number of the dispo shareholder is not part of the sequence """
+        ShareholderGenerator().generate(company=self.company, number=u'12')
+        dispo_shareholder = ShareholderGenerator().generate(
+            company=self.company, number=u'100')
+        self.assertEqual(self.get_allocator().shareholder_number, 100)
+
+        dispo_shareholder.set_dispo_shareholder()
+        self.assertEqual(self.get_allocator().shareholder_number, 12)
+
+        # saving the dispo shareholder does not register its number again
+        dispo_shareholder.save()
+        self.assertEqual(self.get_allocator().shareholder_number, 12)
+        self.assertEqual(self.company.get_new_shareholder_number(), 13)
+
+    def test_lazy_creation(self):
+        """ missing allocator is created from the numbers in use """
+        shareholder = ShareholderGenerator().generate(
+            company=self.company, number=u'42')
+        PositionGenerator().generate(
+            company=self.company, security=self.security, seller=None,
+            buyer=shareholder, certificate_id=u'8')
+        NumberAllocator.objects.filter(company=self.company).delete()
+
+        # registering needs an allocator
+        NumberAllocator.register(self.company, 'certificate_id', [u'20'])
+        self.assertFalse(
+            NumberAllocator.objects.filter(company=self.company).exists())
+
+        self.assertEqual(self.company.get_new_certificate_id(), 9)
+        self.assertEqual(self.company.get_new_shareholder_number(), 43)
+        self.assertEqual(self.get_allocator().certificate_id, 9)
+
+
 class PositionTestCase(TransactionTestCase):
 
     def test_invalidate_certificate(self):
@@ -480,6 +749,41 @@ class PositionTestCase(TransactionTestCase):
             u"'{}'".format(company.name)
         )
 
+    def test_split_shares_dry_run(self):
+        """ preview split without writing """
+        company = CompanyGenerator().generate(share_count=1000)
+        OperatorGenerator().generate(company=company)
+        shareholders, security = ComplexShareholderConstellationGenerator()\
+            .generate(company=company)
+        data = {
+            'execute_at': timezone.now(),
+            'dividend': 3,
+            'divisor': 7,
+            'security': security,
+        }
+        count = Position.objects.count()
+
+        preview = company.split_shares(data, dry_run=True)
+
+        self.assertEqual(Position.objects.count(), count)
+        company.refresh_from_db()
+        self.assertEqual(company.share_count, 1000)
+        self.assertEqual(preview['share_count'], int(1000 / 3.0 * 7))
+        self.assertEqual(len(mail.outbox), 0)
+
+        company.split_shares(data)
+
+        self.assertEqual(company.share_count, preview['share_count'])
+        self.assertEqual(Position.objects.count(),
+                         count + 2 * len(preview['shareholders']))
+        for row in preview['shareholders']:
+            shareholder = Shareholder.objects.get(pk=row['pk'])
+            part, count2 = math.modf(row['count'] * 7 / 3.0)
+            self.assertEqual(row['new_count'], count2)
+            self.assertEqual(row['partial'], round(part, 6))
+            if not shareholder.is_company_shareholder():
+                self.assertEqual(shareholder.share_count(), row['new_count'])
+
     def test_split_shares_empty_value(self):
         """
         share split leaves value, percent unchanged but
@@ -914,6 +1218,30 @@ class ShareholderTestCase(TestCase):
             shs[1].current_segments(positions[0].security),
             [u'1000-1200', 1666])
 
+    def test_current_segments_by_security(self):
+        """
+        segments of all securities tracking numbers at once
+        """
+        positions, shs = ComplexPositionsWithSegmentsGenerator().generate()
+        security = positions[0].security
+        security2 = SecurityGenerator().generate(
+            company=security.company, track_numbers=True,
+            number_segments=[u'1-10'])
+        PositionGenerator().generate(
+            buyer=shs[1], seller=None, security=security2,
+            number_segments=[u'1-3'], count=3)
+
+        # securities, ledger state, positions
+        with self.assertNumQueries(3):
+            segments = shs[1].current_segments_by_security()
+
+        self.assertEqual(segments, {security.pk: [u'1000-1200', 1666],
+                                    security2.pk: [u'1-3']})
+        self.assertEqual(
+            shs[1].current_segments_by_security(
+                date=timezone.now().date() - datetime.timedelta(days=1)),
+            {security.pk: [], security2.pk: []})
+
     def test_current_segments_performance(self):
         """
         checks speed of method
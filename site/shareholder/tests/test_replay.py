@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.test import TestCase
+
+from project.generators import (CompanyShareholderGenerator,
+                                OptionPlanGenerator,
+                                OptionTransactionGenerator, PositionGenerator,
+                                SecurityGenerator, ShareholderGenerator)
+from shareholder.replay import LedgerReplay
+
+
+class LedgerReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.security = SecurityGenerator().generate(
+            track_numbers=True, number_segments=[u'1-10'])
+        self.company = self.security.company
+        self.company_shareholder = CompanyShareholderGenerator().generate(
+            company=self.company, security=self.security,
+            company_shareholder_created_at=datetime.date(2016, 1, 1))
+        self.shareholder = ShareholderGenerator().generate(
+            company=self.company)
+        PositionGenerator().generate(
+            seller=self.company_shareholder, buyer=self.shareholder,
+            security=self.security, count=5, number_segments=[u'1-5'],
+            bought_at=datetime.date(2017, 1, 1))
+
+    def test_consistent(self):
+        replay = LedgerReplay(self.company)
+
+        self.assertTrue(replay.is_consistent())
+        self.assertEqual(replay.position_count, 2)
+        balances = replay.get_balances()
+        self.assertEqual(balances[self.shareholder.pk],
+                         {self.security.pk: 5})
+        self.assertEqual(
+            balances[self.company_shareholder.pk],
+            {self.security.pk: self.company.share_count - 5})
+
+    def test_inconsistent(self):
+        other = ShareholderGenerator().generate(company=self.company)
+        # sells more shares and numbers than owned
+        PositionGenerator().generate(
+            seller=self.shareholder, buyer=other, security=self.security,
+            count=6, number_segments=[u'5-10'],
+            bought_at=datetime.date(2017, 2, 1))
+        option_plan = OptionPlanGenerator().generate(
+            company=self.company, security=self.security, count=2)
+        OptionTransactionGenerator().generate(
+            option_plan=option_plan, buyer=self.company_shareholder,
+            seller=None, count=3)
+
+        replay = LedgerReplay(self.company)
+
+        self.assertFalse(replay.is_consistent())
+        self.assertEqual(replay.negative_balances, [{
+            'shareholder': self.shareholder.pk, 'security': self.security.pk,
+            'date': datetime.date(2017, 2, 1), 'count': -1}])
+        self.assertEqual(
+            [row['segments'] for row in replay.double_owned_numbers],
+            [[u'6-10']])
+        self.assertEqual(replay.unowned_numbers, [{
+            'shareholder': self.shareholder.pk, 'security': self.security.pk,
+            'date': datetime.date(2017, 2, 1), 'segments': [u'6-10']}])
+        self.assertEqual(replay.option_overgrants, [{
+            'option_plan': option_plan.pk, 'approved': 2, 'granted': 3}])
+
+    def test_unowned_numbers(self):
+        """ numbers sold without owning them are reported """
+        other = ShareholderGenerator().generate(company=self.company)
+        # numbers 11-12 are owned by nobody
+        PositionGenerator().generate(
+            seller=self.shareholder, buyer=other, security=self.security,
+            count=4, number_segments=[u'4-5', u'11-12'],
+            bought_at=datetime.date(2017, 2, 1))
+
+        replay = LedgerReplay(self.company)
+
+        self.assertFalse(replay.is_consistent())
+        self.assertEqual(replay.negative_balances, [])
+        self.assertEqual(replay.double_owned_numbers, [])
+        self.assertEqual(replay.unowned_numbers, [{
+            'shareholder': self.shareholder.pk, 'security': self.security.pk,
+            'date': datetime.date(2017, 2, 1), 'segments': [u'11-12']}])
@@ -1,11 +1,13 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import mock
+from django.contrib.auth.models import update_last_login
 from django.test import TestCase
 from model_mommy import mommy
 
-from project.generators import ShareholderGenerator
-from shareholder.models import Position, Shareholder
+from project.generators import (PositionGenerator, SecurityGenerator,
+                                ShareholderGenerator)
+from shareholder.models import Company, Position, Shareholder
 from shareholder.signals import update_order_cache
 
 
@@ -22,3 +24,39 @@ class SignalTestCase(TestCase):
         update_order_cache(Position, position, False)
         calls = (mock.call(position.buyer.pk), mock.call(position.seller.pk))
         task_mock.apply_async.has_calls(calls)
+
+    def test_touch_company_ledger(self):
+        shareholder = ShareholderGenerator().generate()
+        company = shareholder.company
+        changed_at = Company.objects.get(pk=company.pk).ledger_changed_at
+
+        shareholder.save()
+        company.refresh_from_db()
+        self.assertGreater(company.ledger_changed_at, changed_at)
+        self.assertGreater(company.shareholders_changed_at, changed_at)
+
+        changed_at = company.ledger_changed_at
+        security = SecurityGenerator().generate(company=company)
+        position = PositionGenerator().generate(
+            company=company, security=security, buyer=shareholder)
+        company.refresh_from_db()
+        self.assertGreater(company.ledger_changed_at, changed_at)
+        self.assertGreater(company.positions_changed_at, changed_at)
+        # shareholders are unchanged
+        self.assertLess(company.shareholders_changed_at, changed_at)
+
+        changed_at = company.ledger_changed_at
+        position.delete()
+        company.refresh_from_db()
+        self.assertGreater(company.ledger_changed_at, changed_at)
+
+        # login does not change the share register
+        changed_at = company.ledger_changed_at
+        update_last_login(None, shareholder.user)
+        company.refresh_from_db()
+        self.assertEqual(company.ledger_changed_at, changed_at)
+
+        shareholder.user.last_name = u'Changed'
+        shareholder.user.save(update_fields=['last_name'])
+        company.refresh_from_db()
+        self.assertGreater(company.ledger_changed_at, changed_at)
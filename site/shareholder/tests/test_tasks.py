@@ -15,12 +15,14 @@ from project.generators import (CompanyGenerator, OperatorGenerator,
 from project.tests.mixins import (FakeResponseMixin, StripeTestCaseMixin,
                                   SubscriptionTestMixin)
 
-from ..models import ShareholderStatement, ShareholderStatementReport
+from ..models import (Company, ShareholderStatement,
+                      ShareholderStatementReport)
 from ..tasks import (_context_email_defaults,
                      fetch_statement_email_opened_mandrill,
                      generate_statements_report, send_statement_email,
                      send_statement_generation_operator_notify,
                      send_statement_letter, send_statement_letters,
+                     send_statement_letters_batch,
                      send_statement_report_operator_notify,
                      update_order_cache_task)
 from .mixins import AddressTestMixin
@@ -335,10 +337,10 @@ class TasksTestCase(AddressTestMixin, FakeResponseMixin, StripeTestCaseMixin,
         self.assertIsNotNone(statement.letter_sent_at)
 
     @override_settings(SHAREHOLDER_STATMENT_LETTER_OFFSET_DAYS=0)
-    @mock.patch('shareholder.tasks.send_statement_letter.delay')
-    def test_send_statement_letters(self, mock_send_statement_letter):
+    @mock.patch('shareholder.tasks.send_statement_letters_batch.delay')
+    def test_send_statement_letters(self, mock_send_statement_letters_batch):
         send_statement_letters()
-        mock_send_statement_letter.assert_not_called()
+        mock_send_statement_letters_batch.assert_not_called()
 
         # add shareholder statements & report
         company = CompanyGenerator().generate()
@@ -350,7 +352,7 @@ class TasksTestCase(AddressTestMixin, FakeResponseMixin, StripeTestCaseMixin,
 
         # no postal address
         send_statement_letters()
-        mock_send_statement_letter.assert_not_called()
+        mock_send_statement_letters_batch.assert_not_called()
 
         # add postal address for one user
         user_profile = statements[0].user.userprofile
@@ -362,7 +364,49 @@ class TasksTestCase(AddressTestMixin, FakeResponseMixin, StripeTestCaseMixin,
 
         send_statement_letters()
 
-        mock_send_statement_letter.assert_called_once()
+        mock_send_statement_letters_batch.assert_called_once_with(
+            [statements[0].pk])
+
+    @override_settings(PINGEN_API_TOKEN='123456789abcdef')
+    @mock.patch('pingen.api.Pingen.upload_zip', return_value=True)
+    @mock.patch('pingen.api.Pingen.upload_documents')
+    def test_send_statement_letters_batch(self, mock_upload_documents,
+                                          mock_upload_zip):
+        self.assertEqual(send_statement_letters_batch([]), 0)
+
+        company = CompanyGenerator().generate()
+        company.send_shareholder_statement_via_letter_enabled = True
+        company.save()
+        report = mommy.make(ShareholderStatementReport, company=company)
+        statements = mommy.make(ShareholderStatement, report=report,
+                                pdf_file='example.pdf', _quantity=3)
+        statement_ids = [statement.pk for statement in statements]
+
+        # no postal addresses
+        self.assertEqual(send_statement_letters_batch(statement_ids), 0)
+        mock_upload_documents.assert_not_called()
+
+        for statement in statements:
+            self.add_address(statement.user.userprofile)
+
+        # one failed upload
+        mock_upload_documents.return_value = [True, False, True]
+        self.assertEqual(send_statement_letters_batch(statement_ids), 2)
+        mock_upload_documents.assert_called_once()
+        self.assertEqual(
+            ShareholderStatement.objects.filter(
+                pk__in=statement_ids, letter_sent_at__isnull=False).count(),
+            2)
+
+        # remaining letter inside one zip
+        with self.settings(PINGEN={'BATCH_ZIP_UPLOAD': True}):
+            self.assertEqual(send_statement_letters_batch(statement_ids), 1)
+        mock_upload_zip.assert_called_once()
+
+        # retry does not send letters twice
+        mock_upload_documents.reset_mock()
+        self.assertEqual(send_statement_letters_batch(statement_ids), 0)
+        mock_upload_documents.assert_not_called()
 
     def test_update_order_cache_task(self):
         """ update shareholder objs order_cache field """
@@ -373,3 +417,10 @@ class TasksTestCase(AddressTestMixin, FakeResponseMixin, StripeTestCaseMixin,
             shareholder.order_cache,
             {u'cumulated_face_value': 0, u'number': u'234543',
              u'postal_code': u'12345', u'share_count': 0})
+
+        # unchanged order cache keeps ledger cache keys valid
+        changed_at = Company.objects.get(
+            pk=shareholder.company_id).ledger_changed_at
+        update_order_cache_task(shareholder.pk)
+        self.assertEqual(Company.objects.get(
+            pk=shareholder.company_id).ledger_changed_at, changed_at)
@@ -1,10 +1,18 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from utils.cache import captable_cache
+
 
 class Validator(object):
     """
@@ -22,18 +30,154 @@ class Validator(object):
 class ShareRegisterValidator(Validator):
     """
     giant suite to validate if a share registers data is fully valid
+
+    results of checks are cached per check until the share register data it
+    depends on changes (see `check_dependencies`), hence only checks
+    outdated by a change are run again. the results of the last run are
+    stored with timestamps and can be read without validating, see
+    `get_health`
     """
+    # in order of execution
+    checks = (
+        'has_operator',
+        'shareholders_have_users',
+        'security_share_count',
+        'company_share_count',
+        'company_has_initial_position',
+        'shareholder_mailing_type',  # must be last
+    )
+    # check -> kinds of data it depends on, see `Company.touch_ledgers`.
+    # checks without dependencies run each time
+    check_dependencies = {
+        'shareholders_have_users': ('shareholders',),
+        'security_share_count': ('positions',),
+        'company_share_count': ('positions',),
+        'company_has_initial_position': ('positions', 'shareholders'),
+        'shareholder_mailing_type': ('shareholders',),
+    }
+
+    def __init__(self, company, workers=None):
+        super(ShareRegisterValidator, self).__init__(company)
+        self.workers = workers or getattr(
+            settings, 'SHARE_REGISTER_VALIDATION_WORKERS', 1)
+        self._security_counts = None
 
     def is_valid(self):
         """
         entry point to have the validator do its job
         """
-        self.has_operator()
-        self.shareholders_have_users()
-        self.security_share_count()
-        self.company_share_count()
-        self.company_has_initial_position()
-        self.shareholder_mailing_type()  # must be last
+        results = self.validate()
+        for name in self.checks:
+            if not results[name]['valid']:
+                raise ValidationError(results[name]['error'])
+        return True
+
+    def validate(self):
+        """
+        run all checks without a cached result for the current state of their
+        dependencies, concurrently if `workers` > 1. returns dict check name
+        -> dict with `valid`, `error` and `checked_at`
+        """
+        changed_at = self._get_changed_at()
+        cache_keys = {
+            name: self._get_check_cache_key(name, changed_at)
+            for name in self.checks if self.check_dependencies.get(name)}
+        results = {}
+        for name, cache_key in cache_keys.items():
+            result = captable_cache.get(cache_key)
+            if result is not None:
+                results[name] = result
+        pending = [name for name in self.checks if name not in results]
+
+        if self.workers > 1 and len(pending) > 1:
+            pool = ThreadPool(min(self.workers, len(pending)))
+            try:
+                checked = pool.map(self._run_check_in_thread, pending)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            checked = [self._run_check(name) for name in pending]
+
+        for name, result in zip(pending, checked):
+            results[name] = result
+            if name in cache_keys:
+                captable_cache.set(cache_keys[name], result, 60*60*24)
+        captable_cache.set(self._get_health_cache_key(), {
+            'valid': all(result['valid'] for result in results.values()),
+            'checked_at': timezone.now(),
+            'changed_at': changed_at,
+            'checks': results,
+        }, None)
+        return results
+
+    def get_health(self):
+        """
+        return result of the last validation without validating or None if
+        never validated. `is_outdated` tells if data checked changed since
+        """
+        health = captable_cache.get(self._get_health_cache_key())
+        if health:
+            health['is_outdated'] = (
+                health.get('changed_at') != self._get_changed_at())
+        return health
+
+    def _get_changed_at(self):
+        """ return dict dependency -> timestamp of its last change """
+        # local import to avoid circular import
+        from shareholder.models import LEDGER_DEPENDENCIES, Company  # noqa
+        fields = [u'{}_changed_at'.format(dependency)
+                  for dependency in LEDGER_DEPENDENCIES]
+        values = Company.objects.filter(pk=self.company.pk).values_list(
+            *fields).get()
+        return dict(zip(LEDGER_DEPENDENCIES, values))
+
+    def _get_check_cache_key(self, name, changed_at):
+        return u'company-{}-validation-{}-{}'.format(
+            self.company.pk, name, u'-'.join(
+                changed_at[dependency].strftime('%Y%m%d%H%M%S%f')
+                for dependency in self.check_dependencies[name]))
+
+    def _get_health_cache_key(self):
+        return u'company-{}-register-health'.format(self.company.pk)
+
+    def _run_check(self, name):
+        try:
+            getattr(self, name)()
+            error = None
+        except ValidationError as e:
+            error = u' '.join(e.messages)
+        return {'valid': error is None, 'error': error,
+                'checked_at': timezone.now()}
+
+    def _run_check_in_thread(self, name):
+        try:
+            return self._run_check(name)
+        finally:
+            # each thread opens its own db connection
+            connection.close()
+
+    def _get_security_counts(self):
+        """
+        return dict security pk -> share count from positions, same as
+        `Security.calculate_count` for all securities at once
+        """
+        if self._security_counts is None:
+            # local import to avoid circular import
+            from shareholder.models import Position  # noqa
+            counts = defaultdict(int)
+            created = Position.objects.filter(
+                company=self.company, seller__isnull=True).values(
+                    'security').annotate(count=Sum('count'))
+            for row in created:
+                counts[row['security']] += row['count']
+            destroyed = Position.objects.filter(
+                company=self.company, buyer__isnull=True).values(
+                    'security').annotate(count=Sum('count'))
+            for row in destroyed:
+                counts[row['security']] -= row['count']
+            self._security_counts = counts
+        return self._security_counts
 
     def has_operator(self):
         """
@@ -59,8 +203,9 @@ class ShareRegisterValidator(Validator):
         """
         each security.count must match whats owned by shareholders
         """
+        counts = self._get_security_counts()
         for security in self.company.security_set.all():
-            if security.count != security.calculate_count():
+            if security.count != counts[security.pk]:
                 raise ValidationError(
                     _('Security count does not match transactions count: {}')
                     .format(security)
@@ -70,9 +215,10 @@ class ShareRegisterValidator(Validator):
         """
         company share count must match whats owned by shareholders
         """
+        counts = self._get_security_counts()
         count = 0
         for security in self.company.security_set.all():
-            count += security.calculate_count()
+            count += counts[security.pk]
 
         if count != self.company.share_count:
             raise ValidationError(
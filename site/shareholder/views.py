@@ -71,13 +71,14 @@ class ShareholderView(OperatorPermissionRequiredMixin, DetailView):
         """ add more attributes to objects for plain display """
         shareholder = self.get_object()
         securities = shareholder.company.security_set.all()
+        segments = shareholder.current_segments_by_security(
+            securities=[sec for sec in securities if sec.track_numbers])
 
         # hack security props for shareholder spec data
         for sec in securities:
             if sec.track_numbers:
-                if shareholder.current_segments(sec):
-                    sec.segments = human_readable_segments(
-                        shareholder.current_segments(sec))
+                if segments[sec.pk]:
+                    sec.segments = human_readable_segments(segments[sec.pk])
             sec.count = shareholder.share_count(security=sec) or 0
             sec.options_count = shareholder.options_count(security=sec) or 0
         return {'securities': securities}
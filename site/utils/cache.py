@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+cache for captable data (share counts, segments, ledger responses, ...)
+
+values are pickled and compressed if larger than
+`CAPTABLE_CACHE_COMPRESS_MIN_LENGTH` bytes. values exceeding
+`CAPTABLE_CACHE_CHUNK_SIZE` are split into several cache items, memcached
+refuses items over 1MB. recently used values are kept in an in-process LRU
+tier for `CAPTABLE_CACHE_LOCAL_TIMEOUT` seconds, so repeated reads of a key
+do not hit the network.
+"""
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: nocover
+    import pickle
+
+PLAIN = b'p'
+COMPRESSED = b'z'
+CHUNKED = b'c'
+
+# company pk and ledger timestamp of `Company.get_ledger_cache_key`
+KEY_PREFIX_RE = re.compile(r'^company-\d+-(\d{20}-)?')
+KEY_SEPARATOR_RE = re.compile(r'[-_]')
+
+
+def get_key_family(key):
+    """
+    return name of the kind of data cached under `key`, e.g.
+    `current-segments` for `company.get_ledger_cache_key('current-segments',
+    shareholder.pk, ...)`
+    """
+    family = []
+    for part in KEY_SEPARATOR_RE.split(KEY_PREFIX_RE.sub(u'', key)):
+        if not part.isalpha():
+            break
+        family.append(part)
+    return u'-'.join(family) or u'other'
+
+
+class CaptableCache(object):
+    """
+    two tier cache: in-process LRU in front of the django cache `alias`.
+    same api as django caches for `get`, `set`, `delete` and `delete_many`.
+
+    the local tier is not invalidated across processes, values deleted by
+    another process are served from it up to `local_timeout` seconds.
+    chunks of overwritten or deleted values are left to expire.
+    """
+
+    def __init__(self, alias=None, backend=None, local_size=None,
+                 local_timeout=None, chunk_size=None,
+                 compress_min_length=None):
+        self.alias = alias or getattr(settings, 'CAPTABLE_CACHE_ALIAS',
+                                      'default')
+        self._backend = backend
+        if local_size is None:
+            local_size = getattr(settings, 'CAPTABLE_CACHE_LOCAL_SIZE', 200)
+        if local_timeout is None:
+            local_timeout = getattr(
+                settings, 'CAPTABLE_CACHE_LOCAL_TIMEOUT', 5)
+        if chunk_size is None:
+            chunk_size = getattr(
+                settings, 'CAPTABLE_CACHE_CHUNK_SIZE', 1000*1000)
+        if compress_min_length is None:
+            compress_min_length = getattr(
+                settings, 'CAPTABLE_CACHE_COMPRESS_MIN_LENGTH', 1024)
+        self.local_size = local_size
+        self.local_timeout = local_timeout
+        self.chunk_size = chunk_size
+        self.compress_min_length = compress_min_length
+
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def backend(self):
+        return self._backend or caches[self.alias]
+
+    def get(self, key, default=None):
+        family = get_key_family(key)
+        blob = self._get_local(key)
+        if blob is not None:
+            self._count(family, 'local_hits')
+            return pickle.loads(blob)
+
+        blob = self._get_remote(key)
+        if blob is None:
+            self._count(family, 'misses')
+            return default
+
+        self._count(family, 'hits')
+        self._set_local(key, blob)
+        return pickle.loads(blob)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(blob) >= self.compress_min_length:
+            payload = COMPRESSED + zlib.compress(blob)
+        else:
+            payload = PLAIN + blob
+
+        if len(payload) > self.chunk_size:
+            token = uuid.uuid4().hex[:8]
+            chunks = OrderedDict()
+            for start in range(0, len(payload), self.chunk_size):
+                chunk_key = self._get_chunk_key(key, token, len(chunks))
+                chunks[chunk_key] = payload[start:start + self.chunk_size]
+            self.backend.set_many(chunks, timeout)
+            payload = CHUNKED + '{}:{}'.format(len(chunks), token)
+
+        self.backend.set(key, payload, timeout)
+        self._set_local(key, blob)
+
+    def delete(self, key):
+        self._delete_local([key])
+        self.backend.delete(key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        self._delete_local(keys)
+        self.backend.delete_many(keys)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_stats(self):
+        """
+        return dict key family -> dict with count of `local_hits`, `hits`
+        (remote) and `misses` of this process
+        """
+        with self._lock:
+            return {family: dict(counts)
+                    for family, counts in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    # helper
+
+    def _count(self, family, name):
+        with self._lock:
+            self._stats[family][name] += 1
+
+    def _get_chunk_key(self, key, token, index):
+        return u'{}-chunk-{}-{}'.format(key, token, index)
+
+    def _get_remote(self, key):
+        """ return pickled value stored under `key` or None """
+        payload = self.backend.get(key)
+        if not isinstance(payload, bytes) or not payload:
+            return None
+
+        if payload[:1] == CHUNKED:
+            count, token = payload[1:].split(':')
+            chunk_keys = [self._get_chunk_key(key, token, index)
+                          for index in range(int(count))]
+            chunks = self.backend.get_many(chunk_keys)
+            if len(chunks) != len(chunk_keys):
+                return None
+            payload = b''.join(chunks[chunk_key] for chunk_key in chunk_keys)
+
+        if payload[:1] == COMPRESSED:
+            return zlib.decompress(payload[1:])
+        if payload[:1] == PLAIN:
+            return payload[1:]
+
+    def _get_local(self, key):
+        if not self.local_size:
+            return None
+        with self._lock:
+            entry = self._local.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return None
+            # mark as most recently used
+            self._local[key] = entry
+            return entry[1]
+
+    def _set_local(self, key, blob):
+        if not self.local_size:
+            return
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = (time.time() + self.local_timeout, blob)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _delete_local(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+
+captable_cache = CaptableCache()
@@ -4,24 +4,28 @@ import csv
 import datetime
 import logging
 import os
+from collections import defaultdict
 
 from dateutil.parser import parse
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.db import DataError
+from django.db import DataError, transaction
 from django.db.models import Sum
 from django.utils.text import slugify
 from django.utils.translation import ugettext as _
 from django.utils.translation import ugettext_lazy as __
 from django.utils import translation
 from django.utils import timezone
+from rest_framework.authtoken.models import Token
 
 from project.generators import DEFAULT_TEST_DATA, OperatorGenerator
 from shareholder.models import Country  # OptionPlan, OptionTransaction
 from shareholder.models import (DEPOT_TYPES, REGISTRATION_TYPES, Company,
-                                Position, Security,
-                                Shareholder, UserProfile)
+                                ImportRun, NumberAllocator, Position,
+                                Security, SecurityPrice, Shareholder,
+                                UserProfile)
+from shareholder.tasks import update_order_cache_task
 from utils.geo import COUNTRY_MAP, _get_language_iso_code
 
 SISWARE_CSV_HEADER = [
@@ -49,6 +53,14 @@ logger = logging.getLogger(__name__)
 
 COMPANY_SHAREHOLDER_NUMBER = 1913  # RFB AG
 
+# rows written per bulk insert in bulk import mode
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+
+MAILING_TYPE_MAP = {
+    'Papier': '1',
+    'Unzustellbar': '0',
+}
+
 
 class BaseImportBackend(object):
     """
@@ -89,6 +101,11 @@ class SisWareImportBackend(BaseImportBackend):
 
     file_content = []
 
+    def __init__(self, filename):
+        self._countries = {}
+        self._bulk_lookups = None
+        super(SisWareImportBackend, self).__init__(filename)
+
     def _init_import(self, company_pk):
         """
         check and/or prepare data required for the import
@@ -112,14 +129,7 @@ class SisWareImportBackend(BaseImportBackend):
         except ValueError:
             # import based on setting
             row = self._find_row(column=0, needle=COMPANY_SHAREHOLDER_NUMBER)
-            user = self._get_or_create_user(
-                shareholder_id=row[0], first_name=row[8]+' '+row[9],
-                last_name=row[10], legal_type=row[1], company=row[4],
-                department=row[5], title=row[6], salutation=row[7],
-                street=row[11], street2=row[12], pobox=row[14],
-                postal_code=row[15], city=row[16], country=row[17],
-                language=row[20], birthday=row[19], c_o=row[18],
-                nationality=row[22])
+            user = self._get_or_create_user(**self._get_user_kwargs(row))
             self.company_shareholder = self._get_or_create_shareholder(
                 row[0], user, mailing_type=row[21])
 
@@ -188,13 +198,7 @@ class SisWareImportBackend(BaseImportBackend):
             return 0
 
         # USER
-        user = self._get_or_create_user(
-            shareholder_id=row[0], first_name=row[8]+' '+row[9],
-            last_name=row[10], legal_type=row[1], company=row[4],
-            department=row[5], title=row[6], salutation=row[7], street=row[11],
-            street2=row[12], pobox=row[14], postal_code=row[15],
-            city=row[16], country=row[17], language=row[20], birthday=row[19],
-            c_o=row[18], nationality=row[22])
+        user = self._get_or_create_user(**self._get_user_kwargs(row))
         # SHAREHOLDER
         shareholder = self._get_or_create_shareholder(row[0], user,
                                                       mailing_type=row[21])
@@ -214,15 +218,213 @@ class SisWareImportBackend(BaseImportBackend):
 
         return 1
 
-    def _find_row(self, column, needle):
-        with open(self.filename) as f:
-            reader = csv.reader(f, delimiter=';', dialect=csv.excel)
-            for row in reader:
-                row = [self.to_unicode(field) for field in row]
-                if row == SISWARE_CSV_HEADER:
+    def _get_user_kwargs(self, row):
+        """ return kwargs for `_get_or_create_user` from a row """
+        return dict(
+            shareholder_id=row[0], first_name=row[8]+' '+row[9],
+            last_name=row[10], legal_type=row[1], company=row[4],
+            department=row[5], title=row[6], salutation=row[7], street=row[11],
+            street2=row[12], pobox=row[14], postal_code=row[15],
+            city=row[16], country=row[17], language=row[20], birthday=row[19],
+            c_o=row[18], nationality=row[22])
+
+    def _bulk_import_rows(self, rows):
+        """
+        import rows like `_import_row` but resolve users, shareholders and
+        securities with lookup maps loaded upfront and write with bulk inserts
+        inside one transaction. signals are not fired, the order cache is
+        refreshed once per shareholder afterwards
+        """
+        rows = [row for row in rows
+                if [field for field in row if field != u'']]
+        if not rows:
+            return 0
+
+        if self._bulk_lookups is None:
+            self._bulk_lookups = self._get_bulk_lookups()
+
+        with transaction.atomic():
+            users = self._bulk_get_or_create_users(rows)
+            shareholders = self._bulk_get_or_create_shareholders(rows, users)
+            self._bulk_get_or_create_positions(rows, shareholders)
+            # bulk inserts skip the signals tracking changes
+            self.company.touch_ledger()
+
+        def _update_order_cache():
+            for shareholder in shareholders.values():
+                update_order_cache_task.apply_async([shareholder.pk])
+        transaction.on_commit(_update_order_cache)
+
+        return len(rows)
+
+    def _get_bulk_lookups(self):
+        """
+        return lookup maps shared by all batches of an import run and updated
+        with the inserted objects: shareholders by number, securities by
+        face value and cusip and keys of existing transfer positions like
+        looked up by `Position.objects.get_or_create`, with and without
+        certificate id
+        """
+        lookups = {
+            'shareholders': {
+                shareholder.number: shareholder
+                for shareholder in self.company.shareholder_set.all()},
+            'securities': {},
+            'positions': set(),
+            'positions_with_certificate': set(),
+        }
+        for (bought_at, buyer, security, count,
+             certificate_id) in Position.objects.filter(
+                 seller=self.transfer_shareholder).values_list(
+                     'bought_at', 'buyer', 'security', 'count',
+                     'certificate_id'):
+            lookups['positions'].add((bought_at, buyer, security, count))
+            lookups['positions_with_certificate'].add(
+                (bought_at, buyer, security, count, certificate_id))
+        return lookups
+
+    def _bulk_get_or_create_users(self, rows):
+        """
+        return dict shareholder number -> user for all rows. profiles get the
+        data of the last row of each shareholder like with
+        `_get_or_create_user`
+        """
+        # username -> user data of first row (creates the user) and last row
+        # (sets the profile)
+        user_kwargs = {}
+        for row in rows:
+            kwargs = self._get_user_kwargs(row)
+            username = self._get_username(row[0])
+            user_kwargs[username] = (
+                user_kwargs.get(username, (kwargs,))[0], kwargs)
+
+        users = {user.username: user for user in User.objects.filter(
+            username__in=user_kwargs.keys()).select_related('userprofile')}
+        new_users = []
+        for username, (kwargs, last_kwargs) in user_kwargs.items():
+            if username not in users:
+                new_users.append(User(
+                    username=username,
+                    first_name=kwargs['first_name'].strip(),
+                    last_name=kwargs['last_name'].strip()))
+        try:
+            User.objects.bulk_create(new_users, batch_size=IMPORT_BATCH_SIZE)
+        except DataError as e:
+            print (u'create users failed. please fix data & reimport. '
+                   u'hint: check string length')
+            raise e
+
+        # bulk_create does not set pks, neither fires the signal creating
+        # token and profile
+        for user in User.objects.filter(
+                username__in=[user.username for user in new_users]):
+            users[user.username] = user
+        Token.objects.bulk_create(
+            [Token(user=users[user.username], key=Token().generate_key())
+             for user in new_users], batch_size=IMPORT_BATCH_SIZE)
+
+        new_profiles = []
+        for username, (kwargs, last_kwargs) in user_kwargs.items():
+            user = users[username]
+            profile_kwargs = self._get_profile_kwargs(**last_kwargs)
+            if not hasattr(user, 'userprofile'):
+                new_profiles.append(UserProfile(user=user, **profile_kwargs))
+                continue
+            # save changed profiles only, repeated imports are mostly no-ops
+            profile = user.userprofile
+            changed = False
+            for (key, value) in profile_kwargs.items():
+                if isinstance(value, Country):
+                    key, value = key + '_id', value.pk
+                if getattr(profile, key) != value:
+                    setattr(profile, key, value)
+                    changed = True
+            if changed:
+                profile.save()
+        UserProfile.objects.bulk_create(new_profiles,
+                                        batch_size=IMPORT_BATCH_SIZE)
+
+        return {row[0]: users[self._get_username(row[0])] for row in rows}
+
+    def _bulk_get_or_create_shareholders(self, rows, users):
+        """ return dict shareholder number -> shareholder for all rows """
+        shareholders = self._bulk_lookups['shareholders']
+
+        new_shareholders = []
+        for row in rows:
+            number = row[0]
+            if number in shareholders:
+                continue
+            shareholder = Shareholder(
+                company=self.company, number=number, user=users[number],
+                mailing_type=MAILING_TYPE_MAP[row[21]])
+            new_shareholders.append(shareholder)
+        Shareholder.objects.bulk_create(new_shareholders,
+                                        batch_size=IMPORT_BATCH_SIZE)
+        NumberAllocator.register(
+            self.company, 'shareholder_number',
+            [shareholder.number for shareholder in new_shareholders])
+
+        # bulk_create does not set pks
+        shareholders.update({
+            shareholder.number: shareholder
+            for shareholder in self.company.shareholder_set.filter(
+                number__in=[s.number for s in new_shareholders])})
+        return {row[0]: shareholders[row[0]] for row in rows}
+
+    def _bulk_get_or_create_positions(self, rows, shareholders):
+        """ create positions for all rows which are not yet existing """
+        securities = self._bulk_lookups['securities']
+        existing = self._bulk_lookups['positions']
+        existing_with_certificate = self._bulk_lookups[
+            'positions_with_certificate']
+
+        positions = []
+        for row in rows:
+            face_value = float(row[25].replace(',', '.'))
+            cusip = row[24]
+            if (face_value, cusip) not in securities:
+                securities[(face_value, cusip)] = (
+                    self._get_or_create_security(
+                        face_value=face_value, cusip=cusip))
+
+            pkwargs, defaults = self._get_position_kwargs(
+                bought_at=row[28], buyer=shareholders[row[0]], count=row[26],
+                value=row[25], registration_type=row[2],
+                stock_book_id=row[29], depot_type=row[30],
+                security=securities[(face_value, cusip)],
+                certificate_id=row[27])
+
+            key = (parse(pkwargs['bought_at']).date(), pkwargs['buyer'].pk,
+                   pkwargs['security'].pk, pkwargs['count'])
+            if pkwargs.get('certificate_id'):
+                lookup = key + (pkwargs['certificate_id'],)
+                if lookup in existing_with_certificate:
                     continue
-                if row[column] == str(needle):
-                    return row
+            elif key in existing:
+                continue
+            existing.add(key)
+            existing_with_certificate.add(
+                key + (pkwargs.get('certificate_id'),))
+
+            pkwargs.update(defaults, company=self.company)
+            positions.append(Position(**pkwargs))
+
+        Position.objects.bulk_create(positions, batch_size=IMPORT_BATCH_SIZE)
+        NumberAllocator.register(
+            self.company, 'certificate_id',
+            [position.certificate_id for position in positions
+             if position.certificate_id])
+        SecurityPrice.refresh([(position.security.pk, position.bought_at)
+                               for position in positions if position.value])
+
+    def _find_row(self, column, needle):
+        """ return first row with `needle` in `column` """
+        if column == 0:
+            return self._row_index.get(str(needle))
+        for row in self.rows:
+            if row[column] == str(needle):
+                return row
 
     def _finish_import(self):
         """
@@ -272,10 +474,6 @@ class SisWareImportBackend(BaseImportBackend):
 
     def _get_or_create_shareholder(self, shareholder_number, user,
                                    mailing_type='Unzustellbar'):
-        MAILING_TYPE_MAP = {
-            'Papier': '1',
-            'Unzustellbar': '0',
-        }
         mailing_type = MAILING_TYPE_MAP[mailing_type]
         shareholder, c_ = Shareholder.objects.get_or_create(
             number=shareholder_number, company=self.company,
@@ -320,6 +518,23 @@ class SisWareImportBackend(BaseImportBackend):
         we have no history data, hence, we start with an initial position/
         transaction of the day of the import
         """
+        pkwargs, defaults = self._get_position_kwargs(
+            bought_at, buyer, count, value, registration_type, stock_book_id,
+            depot_type, security, **kwargs)
+
+        # FIXME add scontro and depot type to lookup
+        position, c_ = Position.objects.get_or_create(
+            defaults=defaults, **pkwargs)
+
+        return position
+
+    def _get_position_kwargs(self, bought_at, buyer, count, value,
+                             registration_type, stock_book_id, depot_type,
+                             security, **kwargs):
+        """
+        return tuple (lookup kwargs, defaults) for a position sold by the
+        transfer shareholder
+        """
         seller = self.transfer_shareholder
         registration_type = self._match_registration_type(registration_type)
         depot_type = self._match_depot_type(depot_type)
@@ -338,11 +553,7 @@ class SisWareImportBackend(BaseImportBackend):
         if kwargs.get('certificate_id'):
             pkwargs.update({'certificate_id': kwargs.get('certificate_id')})
 
-        # FIXME add scontro and depot type to lookup
-        position, c_ = Position.objects.get_or_create(
-            defaults=defaults, **pkwargs)
-
-        return position
+        return pkwargs, defaults
 
 # not used:
 #     def _get_or_create_option_transaction(self, cert_id, bought_at, buyer,
@@ -390,11 +601,10 @@ class SisWareImportBackend(BaseImportBackend):
         we have no email to identify duplicates and merge then. hence we are
         using the shareholder id to create new users for each shareholder id
         """
-        username = u"{}-{}".format(
-            slugify(self.company.name[:20]), shareholder_id)
+        username = self._get_username(shareholder_id)
         try:
             user, c_ = User.objects.get_or_create(
-                username=username[:29],
+                username=username,
                 defaults={u'first_name': first_name.strip(),
                           u'last_name': last_name.strip()}
             )
@@ -404,6 +614,39 @@ class SisWareImportBackend(BaseImportBackend):
                    u'hint: check string length'.format(first_name, last_name))
             raise e
 
+        kwargs = self._get_profile_kwargs(
+            legal_type=legal_type, company=company, department=department,
+            title=title, salutation=salutation, street=street,
+            street2=street2, pobox=pobox, postal_code=postal_code, city=city,
+            country=country, language=language, birthday=birthday, c_o=c_o,
+            nationality=nationality)
+
+        # save
+        if hasattr(user, 'userprofile'):
+            profile = user.userprofile
+            for (key, value) in kwargs.items():
+                setattr(profile, key, value)
+            profile.save()
+        elif not hasattr(user, 'userprofile'):
+            UserProfile.objects.create(user=user, **kwargs)
+
+        return user
+
+    def _get_username(self, shareholder_id):
+        username = u"{}-{}".format(
+            slugify(self.company.name[:20]), shareholder_id)
+        return username[:29]
+
+    def _get_profile_kwargs(self, legal_type='Corp', company=None,
+                            department=None, title=None, salutation=None,
+                            street=None, street2=None, pobox=None,
+                            postal_code=None, city=None, country=None,
+                            language=None, birthday=None, c_o=None,
+                            nationality=None, **extra):
+        """
+        return user profile field values for the user data of a row. `extra`
+        takes the user fields which are not part of the profile
+        """
         kwargs = dict(
             legal_type='H' if 'Jurist' not in legal_type else 'C',
             company_name=company,
@@ -419,27 +662,22 @@ class SisWareImportBackend(BaseImportBackend):
         )
         # FIXME use proper country name translation
         if country and COUNTRY_MAP[country]:
-            kwargs.update(
-                {'country': Country.objects.get(iso_code=COUNTRY_MAP[country])})
+            kwargs.update({'country': self._get_country(COUNTRY_MAP[country])})
         if birthday:
-            kwargs.update({'birthday': parse(birthday)})
+            kwargs.update({'birthday': parse(birthday).date()})
         if nationality and COUNTRY_MAP[nationality]:
             kwargs.update(
-                {'nationality': Country.objects.get(
-                    iso_code=COUNTRY_MAP[nationality])})
+                {'nationality': self._get_country(COUNTRY_MAP[nationality])})
         if language:
             kwargs.update({'language': _get_language_iso_code(language)})
 
-        # save
-        if hasattr(user, 'userprofile'):
-            profile = user.userprofile
-            for (key, value) in kwargs.items():
-                setattr(profile, key, value)
-            profile.save()
-        elif not hasattr(user, 'userprofile'):
-            UserProfile.objects.create(user=user, **kwargs)
+        return kwargs
 
-        return user
+    def _get_country(self, iso_code):
+        """ return country by iso code, cached for the import """
+        if iso_code not in self._countries:
+            self._countries[iso_code] = Country.objects.get(iso_code=iso_code)
+        return self._countries[iso_code]
 
     def _get_or_update_init_date(self):
         """ add initial registration date from another file """
@@ -479,106 +717,132 @@ class SisWareImportBackend(BaseImportBackend):
             return DEPOT_TYPES[2][0]
 
     def validate(self, filename):
-        self._validate_file_structure(filename)
-        self._validate_language_iso_code_known()
-        self._validate_country_names_mappable()
-        self._validate_nationality_names_mappable()
-
-    def _validate_file_structure(self, filename):
         """
-        validate if file can be used
+        parse the file once and check all rows. raises ValueError listing all
+        errors with their line numbers
+        """
+        self._read_file(filename)
+
+        errors = []
+        # value -> line numbers, each distinct value is checked once
+        countries = defaultdict(list)
+        nationalities = defaultdict(list)
+        languages = defaultdict(list)
+        for line, row in zip(self.line_numbers, self.rows):
+            if not [field for field in row if field != u'']:
+                continue
+            if len(row) != len(SISWARE_CSV_HEADER):
+                errors.append((line, u'expected {} columns, got {}'.format(
+                    len(SISWARE_CSV_HEADER), len(row))))
+                continue
+            if row[17]:
+                countries[row[17]].append(line)
+            if row[22]:
+                nationalities[row[22]].append(line)
+            if row[20]:
+                languages[row[20]].append(line)
+
+        for name, lines in countries.items():
+            if name not in COUNTRY_MAP:
+                errors.extend([(line, u'cannot map country "{}"'.format(
+                    name)) for line in lines])
+        for name, lines in nationalities.items():
+            if name not in COUNTRY_MAP:
+                errors.extend([(line, u'cannot map nationality "{}"'.format(
+                    name)) for line in lines])
+        for name, lines in languages.items():
+            if not _get_language_iso_code(name):
+                errors.extend([(line, u'cannot map language "{}"'.format(
+                    name)) for line in lines])
+
+        if errors:
+            raise ValueError(u'import not started, invalid rows:\n{}'.format(
+                u'\n'.join([u'line {}: {}'.format(line, error)
+                            for line, error in sorted(errors)])))
+
+    def _read_file(self, filename):
+        """
+        read all rows of the file into `rows` (header excluded) with their
+        line numbers in `line_numbers` and index them by shareholder number
         """
+        self.rows = []
+        self.line_numbers = []
+        self._row_index = {}
         with open(filename) as f:
             reader = csv.reader(f, delimiter=';', dialect=csv.excel)
             for row in reader:
                 row = [self.to_unicode(field) for field in row]
-                if row == SISWARE_CSV_HEADER:
-                    break
-                else:
-                    raise ValueError('invalid file for sisware import backend')
-
-    def _validate_country_names_mappable(self):
-        # check if we can import all countries
-        countries = []
-        with open(self.filename) as f:
-            reader = csv.reader(f, delimiter=';', dialect=csv.excel)
-            self.row_count = 0
-            for row in reader:
-                row = [self.to_unicode(field) for field in row]
-                if row == SISWARE_CSV_HEADER:
-                    continue
-                if row[17]:
-                    countries.append(row[17])
-        countries = set(countries)
-        missing_countries = []
-        for country in countries:
-            if country not in COUNTRY_MAP.keys():
-                missing_countries.append(country)
-        if missing_countries:
-            raise ValueError('cannot map countries to db objs: {}. '
-                             'import not started'.format(missing_countries))
-
-    def _validate_nationality_names_mappable(self):
-        # check if we can import all nationalities
-        countries = []
-        with open(self.filename) as f:
-            reader = csv.reader(f, delimiter=';', dialect=csv.excel)
-            self.row_count = 0
-            for row in reader:
-                row = [self.to_unicode(field) for field in row]
-                if row == SISWARE_CSV_HEADER:
+                if reader.line_num == 1:
+                    if row != SISWARE_CSV_HEADER:
+                        raise ValueError(
+                            'invalid file for sisware import backend')
                     continue
-                if row[22]:
-                    countries.append(row[22])
-        countries = set(countries)
-        missing_countries = []
-        for country in countries:
-            if country not in COUNTRY_MAP.keys():
-                missing_countries.append(country)
-        if missing_countries:
-            raise ValueError('cannot map nationalities to db objs: {}. '
-                             'import not started'.format(missing_countries))
-
-    def _validate_language_iso_code_known(self):
-        # check if we can map all languages
-        languages = []
-        with open(self.filename) as f:
-            reader = csv.reader(f, delimiter=';', dialect=csv.excel)
-            self.row_count = 0
-            for row in reader:
-                row = [self.to_unicode(field) for field in row]
                 if row == SISWARE_CSV_HEADER:
                     continue
-                if row[20]:
-                    languages.append(row[20])
-        languages = set(languages)
-        missing = []
-        for language in languages:
-            if not _get_language_iso_code(language):
-                missing.append(language)
-        if missing:
-            raise ValueError('cannot map languages to db objs: {}. '
-                             'import not started.'.format(missing))
-
-    def import_from_file(self, company_pk):
+                self.rows.append(row)
+                self.line_numbers.append(reader.line_num)
+                if row:
+                    self._row_index.setdefault(row[0], row)
+
+    def import_from_file(self, company_pk, bulk=False, run=None,
+                         progress=None):
         """
-        read file contents and place them into the database
+        read file contents and place them into the database. rows are
+        committed in batches of `IMPORT_BATCH_SIZE`, each batch checkpoints
+        the import run.
+
+        Keyword arguments:
+        bulk -- import all rows with bulk inserts, for large files
+                (default: False)
+        run -- `ImportRun` to resume at its checkpoint (default: new run)
+        progress -- callable receiving the run after each batch
         """
 
         self._init_import(company_pk)
+        # loaded by the first bulk batch
+        self._bulk_lookups = None
+
+        if run is None:
+            run = ImportRun.objects.create(
+                company=self.company, filename=self.filename,
+                backend=self.__class__.__name__, row_count=len(self.rows))
+        elif run.row_count != len(self.rows):
+            raise ValueError('file changed since import run {} was started. '
+                             'please start a new import'.format(run.pk))
+        else:
+            run.restart()
+        self.run = run
 
-        with open(self.filename) as f:
-            reader = csv.reader(f, delimiter=';', dialect=csv.excel)
-            self.row_count = 0
-            for row in reader:
-                row = [self.to_unicode(field) for field in row]
-                if row == SISWARE_CSV_HEADER:
-                    continue
-                self.file_content.append(','.join(row))
-                self.row_count += self._import_row(row)
-
-        self._finish_import()
+        for row in self.rows:
+            self.file_content.append(','.join(row))
 
+        try:
+            while run.offset < run.row_count:
+                rows = self.rows[run.offset:run.offset + IMPORT_BATCH_SIZE]
+                with transaction.atomic():
+                    if bulk:
+                        count = self._bulk_import_rows(rows)
+                    else:
+                        count = sum([self._import_row(row) for row in rows])
+                    run.offset += len(rows)
+                    run.imported_count += count
+                    run.save()
+                if progress:
+                    progress(run)
+
+            self._finish_import()
+        except Exception as e:
+            run.status = ImportRun.STATUS_FAILED
+            run.error = u'{}'.format(e)
+            run.save()
+            logger.exception('import failed', extra={'run': run.pk})
+            raise
+
+        run.status = ImportRun.STATUS_FINISHED
+        run.finished_at = timezone.now()
+        run.save()
+
+        self.row_count = run.imported_count
         return self.row_count
 
 # reusable  list of available import backends
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from project.generators import (BulkCompanyGenerator, LargeCompanyGenerator,
+                                PositionGenerator)
+from reports.models import Report
+from reports.tasks import render_captable_pdf, render_captable_xls
+from services.rest.serializers import PositionSerializer
+from shareholder.models import Company, OptionTransaction, Position
+from utils.cache import captable_cache
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = ['share_count', 'active_shareholders', 'current_segments',
+              'captable_xls', 'captable_pdf', 'statements',
+              'position_validation']
+
+
+class Command(BaseCommand):
+    help = ('build synthetic companies and time the hot paths of the share '
+            'register, results are written as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--shareholders', type=int, nargs='+', default=[1000],
+            help='Build one company per given shareholder count')
+        parser.add_argument(
+            '--company', type=int, dest='company_pk',
+            help='Benchmark existing company instead of building one')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-bulk', action='store_false', dest='bulk', default=True,
+            help='Build companies object by object with signals fired')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per benchmark')
+        parser.add_argument(
+            '--sample', type=int, default=100,
+            help='Shareholders used for per shareholder benchmarks')
+        parser.add_argument(
+            '--skip', nargs='+', default=[], choices=BENCHMARKS)
+        parser.add_argument(
+            '--cache', action='store_true', dest='cache', default=False,
+            help='Keep caches enabled, hot paths are timed uncached otherwise')
+        parser.add_argument(
+            '--output', help='Write JSON results to file instead of stdout')
+        parser.add_argument(
+            '--baseline', help='JSON results of an earlier run to compare to')
+        parser.add_argument(
+            '--keep', action='store_true', dest='keep', default=False,
+            help='Do not delete generated companies')
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help='Generate data even if DEBUG is off')
+
+    def handle(self, *args, **options):
+        if (not options['company_pk'] and not settings.DEBUG and
+                not options['force']):
+            raise CommandError(
+                'Refusing to generate synthetic companies with DEBUG off, '
+                'use --force')
+
+        results = {
+            'version': settings.VERSION,
+            'database': connection.vendor,
+            'started_at': timezone.now().isoformat(),
+            'cache': options['cache'],
+            'bulk': options['bulk'],
+            'runs': [],
+        }
+
+        if options['company_pk']:
+            try:
+                company = Company.objects.get(pk=options['company_pk'])
+            except Company.DoesNotExist:
+                raise CommandError('Company {} does not exist'.format(
+                    options['company_pk']))
+            results['runs'].append(self._benchmark(company, None, options))
+        else:
+            generator = (options['bulk'] and BulkCompanyGenerator or
+                         LargeCompanyGenerator)
+            for shareholder_count in options['shareholders']:
+                started = time.time()
+                company = generator().generate(
+                    shareholder_count=shareholder_count,
+                    seed=options['seed'])
+                build_duration = time.time() - started
+                try:
+                    results['runs'].append(
+                        self._benchmark(company, build_duration, options))
+                finally:
+                    if not options['keep']:
+                        self._delete_company(company)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                self._compare(json.load(f), results)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def _benchmark(self, company, build_duration, options):
+        logger.info('benchmarking company {}...'.format(company.pk))
+        run = {
+            'company': company.pk,
+            'shareholder_count': company.shareholder_set.count(),
+            'position_count': Position.objects.filter(
+                company=company).count(),
+            'option_transaction_count': OptionTransaction.objects.filter(
+                company=company).count(),
+            'build_duration': build_duration,
+            'timings': {},
+        }
+        benchmarks = self._get_benchmarks(company, options['sample'])
+
+        captable_cache.reset_stats()
+        local_size = captable_cache.local_size
+        if not options['cache']:
+            captable_cache.local_size = 0
+            cache_settings = override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+            cache_settings.enable()
+        try:
+            for name in BENCHMARKS:
+                if name in options['skip']:
+                    continue
+                run['timings'][name] = self._time(
+                    benchmarks[name], options['repeat'])
+        finally:
+            if not options['cache']:
+                cache_settings.disable()
+            captable_cache.local_size = local_size
+
+        run['cache_stats'] = captable_cache.get_stats()
+        return run
+
+    def _get_benchmarks(self, company, sample):
+        """ return dict benchmark name -> function to time """
+        security = (company.security_set.filter(track_numbers=True).first() or
+                    company.security_set.first())
+        shareholders = list(company.shareholder_set.exclude(
+            number='0').order_by('pk')[:sample])
+        user = company.operator_set.first().user
+        today = timezone.now().date()
+
+        request = RequestFactory().get('/services/rest/position')
+        request.user = user
+        request.session = {'company_pk': company.pk}
+
+        # sell all shares of a shareholder to the next one
+        seller, buyer = shareholders[0], shareholders[1]
+        position = PositionGenerator().generate(
+            company=company, security=security, seller=seller, buyer=buyer,
+            count=seller.share_count(security=security),
+            number_segments=seller.current_segments(security), save=False)
+        position_data = PositionSerializer(
+            position, context={'request': request}).data
+        position_data['bought_at'] = today.isoformat()
+
+        def share_count():
+            for shareholder in shareholders:
+                shareholder.share_count()
+
+        def active_shareholders():
+            list(company.get_active_shareholders())
+
+        def current_segments():
+            for shareholder in shareholders:
+                shareholder.current_segments(security)
+
+        def captable_xls():
+            report = Report.objects.create(
+                company=company, user=user, report_type='captable',
+                file_type='XLS', report_at=today, eta=timezone.now())
+            render_captable_xls(company.pk, report.pk)
+
+        def captable_pdf():
+            report = Report.objects.create(
+                company=company, user=user, report_type='captable',
+                file_type='PDF', report_at=today, eta=timezone.now())
+            render_captable_pdf(company.pk, report.pk)
+
+        def statements():
+            report = company.shareholderstatementreport_set.get_or_create(
+                report_date=today)[0]
+            for shareholder in shareholders:
+                report.shareholderstatement_set.filter(
+                    user=shareholder.user).delete()
+                report._create_shareholder_statement_for_user(
+                    shareholder.user)
+
+        def position_validation():
+            PositionSerializer(data=position_data,
+                               context={'request': request}).is_valid()
+
+        return {
+            'share_count': share_count,
+            'active_shareholders': active_shareholders,
+            'current_segments': current_segments,
+            'captable_xls': captable_xls,
+            'captable_pdf': captable_pdf,
+            'statements': statements,
+            'position_validation': position_validation,
+        }
+
+    def _time(self, func, repeat):
+        """ return dict with min, mean and max duration of `repeat` runs """
+        durations = []
+        for i in range(0, repeat):
+            started = time.time()
+            try:
+                func()
+            except Exception as e:
+                logger.exception(e)
+                return {'error': unicode(e)}
+            durations.append(time.time() - started)
+
+        return {
+            'runs': repeat,
+            'min': min(durations),
+            'mean': sum(durations) / len(durations),
+            'max': max(durations),
+        }
+
+    def _compare(self, baseline, results):
+        """ add ratio of mean duration to baseline run of same size """
+        baseline_runs = {run['shareholder_count']: run
+                         for run in baseline.get('runs', [])}
+        for run in results['runs']:
+            baseline_run = baseline_runs.get(run['shareholder_count'])
+            if not baseline_run:
+                continue
+            for name, timing in run['timings'].items():
+                baseline_timing = baseline_run['timings'].get(name, {})
+                if timing.get('mean') and baseline_timing.get('mean'):
+                    timing['baseline_ratio'] = (
+                        timing['mean'] / baseline_timing['mean'])
+
+    def _delete_company(self, company):
+        user_pks = list(company.shareholder_set.values_list(
+            'user', flat=True))
+        user_pks.extend(company.operator_set.values_list('user', flat=True))
+        company.delete()
+        get_user_model().objects.filter(
+            pk__in=user_pks, shareholder__isnull=True,
+            operator__isnull=True).delete()
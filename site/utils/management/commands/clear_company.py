@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 import logging
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import Q
 
 from shareholder.models import Company, Position, OptionTransaction
 
@@ -48,11 +47,9 @@ class Command(BaseCommand):
                             company.shareholder_set.count(),
                             company.optionplan_set.count(),
                             Position.objects.filter(
-                                Q(buyer__company=company) | Q(seller__company=company)
-                            ).count(),
+                                company=company).count(),
                             OptionTransaction.objects.filter(
-                                Q(buyer__company=company) | Q(seller__company=company)
-                            ).count(),
+                                company=company).count(),
                             company.security_set.count(),
                             company.operator_set.count(),
                         )
@@ -4,6 +4,7 @@ import os
 
 from django.core.management.base import BaseCommand, CommandError
 
+from shareholder.models import ImportRun
 from utils.import_backends import IMPORT_BACKENDS
 
 
@@ -29,6 +30,15 @@ class Command(BaseCommand):
         """
         self.stdout.write(self.style.ERROR(msg))
 
+    def _progress(self, run):
+        """
+        print progress of import run
+        """
+        eta = run.get_eta()
+        self._notice(u'{}/{} rows ({:.1f}%), {:.0f} rows/s, ETA {}'.format(
+            run.offset, run.row_count, run.get_progress(),
+            run.get_rows_per_second(), eta is None and '-' or eta))
+
     def _get_file(self, filename):
         """
         checks file and returns file obj
@@ -44,18 +54,26 @@ class Command(BaseCommand):
 
         `f` is a file obj
         """
+        errors = []
         for backend in IMPORT_BACKENDS:
             try:
                 backend = backend(filename)
                 return backend
-            except ValueError:
-                pass
+            except ValueError as e:
+                errors.append(u'{}: {}'.format(backend.__name__, unicode(e)))
 
-        raise CommandError('No matching import backend detected')
+        raise CommandError(u'No matching import backend detected\n{}'.format(
+            u'\n'.join(errors)))
 
     def add_arguments(self, parser):
         parser.add_argument('company_pk', nargs='+', type=int)
         parser.add_argument('file', nargs='+', type=str)
+        parser.add_argument(
+            '--bulk', action='store_true', dest='bulk', default=False,
+            help='Import with bulk inserts, for large files')
+        parser.add_argument(
+            '--resume', action='store_true', dest='resume', default=False,
+            help='Resume the last failed import of the file at its checkpoint')
 
     def handle(self, *args, **options):
         """
@@ -67,6 +85,19 @@ class Command(BaseCommand):
 
         filename = self._get_file(options['file'][0])
         backend = self._detect_backend(filename)
-        count = backend.import_from_file(options['company_pk'][0]) or 0
+
+        run = None
+        if options['resume']:
+            run = ImportRun.objects.filter(
+                company_id=options['company_pk'][0], filename=filename,
+                status=ImportRun.STATUS_FAILED).order_by('-pk').first()
+            if not run:
+                raise CommandError('No failed import to resume')
+            self._notice('resuming import run {} at row {}'.format(
+                run.pk, run.offset))
+
+        count = backend.import_from_file(
+            options['company_pk'][0], bulk=options['bulk'], run=run,
+            progress=self._progress) or 0
 
         self._success('Successfully imported {} data sets'.format(count))
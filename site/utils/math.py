@@ -40,3 +40,82 @@ def substract_list(origin, substract):
         else:
             result.append(origin[xi])
             xi += 1
+
+
+def segments_to_intervals(segments):
+    """
+    convert number segments like [1, 2, u'4-10', 8] into sorted and merged
+    closed intervals [(1, 2), (4, 10)] without inflating the ranges. allows
+    containment and overlap checks with cost depending on the number of
+    segments instead of the number of shares
+    """
+    intervals = []
+    for segment in segments or []:
+        if isinstance(segment, basestring) and '-' in segment:
+            start, end = segment.split('-')
+            intervals.append((int(start), int(end)))
+        else:
+            intervals.append((int(segment), int(segment)))
+    intervals.sort()
+
+    merged = []
+    for start, end in intervals:
+        # overlapping or adjacent
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def intervals_to_segments(intervals):
+    """
+    convert intervals back into deflated segments [1, u'4-10']
+    """
+    return [start if start == end else u'{}-{}'.format(start, end)
+            for start, end in intervals]
+
+
+def substract_intervals(origin, substract):
+    """
+    return the parts of `origin` not covered by `substract`. both must be
+    sorted and merged intervals (see `segments_to_intervals`). empty result
+    means `origin` is contained in `substract`
+    """
+    result = []
+    yi = 0
+    len_substract = len(substract)
+
+    for start, end in origin:
+        # skip intervals ending before this one
+        while yi < len_substract and substract[yi][1] < start:
+            yi += 1
+
+        i = yi
+        while start <= end:
+            if i >= len_substract or substract[i][0] > end:
+                result.append((start, end))
+                break
+            if substract[i][0] > start:
+                result.append((start, substract[i][0] - 1))
+            start = substract[i][1] + 1
+            i += 1
+
+    return result
+
+
+def intervals_overlap(a, b):
+    """
+    return True if any interval of `a` overlaps with any of `b`. both must be
+    sorted and merged intervals
+    """
+    ai, bi = 0, 0
+    while ai < len(a) and bi < len(b):
+        if a[ai][1] < b[bi][0]:
+            ai += 1
+        elif b[bi][1] < a[ai][0]:
+            bi += 1
+        else:
+            return True
+    return False
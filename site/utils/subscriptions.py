@@ -23,23 +23,13 @@ def stripe_company_shareholder_invoice_item(customer, plan_name, invoice=None):
     """
     from django.conf import settings
 
-    def _get_company_shareholder_count(company, date=None):
-        """
-        return count of active shareholders but exclude company shareholder
-        """
-        count = 0
-        shareholders = company.shareholder_set.exclude(number='0')
-        for shareholder in shareholders.order_by('number'):
-            if shareholder.share_count(date=date) > 0:
-                count += 1
-        return count
-
     plan = settings.DJSTRIPE_PLANS.get(plan_name, {})
     shareholder_feature = plan.get('features', {}).get('shareholders')
     price_per_shareholder = shareholder_feature.get('price')
     if price_per_shareholder:  # NOTE: we assuming a valid number
         # add per shareholder fees as InvoiceItems for customer
-        shareholder_count = _get_company_shareholder_count(customer.subscriber)
+        shareholder_count = (
+            customer.subscriber.get_active_shareholder_count())
         if not shareholder_count:
             return
         stripe.api_key = settings.STRIPE_SECRET_KEY
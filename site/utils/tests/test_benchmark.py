@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from project.generators import BulkCompanyGenerator
+from shareholder.models import Company, Position
+from shareholder.replay import LedgerReplay
+
+
+class BenchmarkCommandTestCase(TestCase):
+
+    def test_benchmark(self):
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+
+        call_command('benchmark', shareholders=[5], sample=3, repeat=1,
+                     skip=['captable_pdf', 'statements'], output=filename,
+                     force=True)
+
+        with open(filename) as f:
+            results = json.load(f)
+        run = results['runs'][0]
+        self.assertEqual(run['shareholder_count'], 6)
+        self.assertEqual(
+            sorted(run['timings'].keys()),
+            ['active_shareholders', 'captable_xls', 'current_segments',
+             'position_validation', 'share_count'])
+        for timing in run['timings'].values():
+            self.assertNotIn('error', timing)
+            self.assertEqual(timing['runs'], 1)
+        # generated company is removed
+        self.assertFalse(Company.objects.filter(pk=run['company']).exists())
+
+
+class BulkCompanyGeneratorTestCase(TestCase):
+
+    def test_generate(self):
+        company = BulkCompanyGenerator().generate(shareholder_count=5, seed=1)
+
+        self.assertEqual(company.shareholder_set.count(), 6)
+        self.assertEqual(Position.objects.filter(company=company).count(), 6)
+        self.assertTrue(LedgerReplay(company).is_consistent())
+        for shareholder in company.shareholder_set.all():
+            self.assertEqual(shareholder.order_cache['share_count'],
+                             shareholder.share_count())
+            self.assertTrue(shareholder.user.userprofile)
+        self.assertEqual(company.get_new_shareholder_number(), 6)
+
+        # same seed, same data
+        other = BulkCompanyGenerator().generate(shareholder_count=5, seed=1)
+        self.assertEqual(
+            list(Position.objects.filter(company=company).order_by(
+                'pk').values_list('count', 'number_segments', 'bought_at')),
+            list(Position.objects.filter(company=other).order_by(
+                'pk').values_list('count', 'number_segments', 'bought_at')))
+
+    def test_generate_same_company(self):
+        company = BulkCompanyGenerator().generate(shareholder_count=5, seed=1)
+        BulkCompanyGenerator().generate(shareholder_count=5, seed=1,
+                                        company=company)
+
+        # each run created its own users
+        users = User.objects.filter(shareholder__company=company)
+        self.assertEqual(users.count(), 12)
+        self.assertEqual(users.distinct().count(), 12)
@@ -0,0 +1,64 @@
+# coding=utf-8
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+
+from ..cache import CaptableCache, get_key_family
+
+
+class CaptableCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = LocMemCache('captable-tests', {})
+        self.backend.clear()
+        self.cache = CaptableCache(backend=self.backend, local_size=2,
+                                   chunk_size=100, compress_min_length=50)
+
+    def test_get_key_family(self):
+        self.assertEqual(
+            get_key_family(u'company-1-20170101120000000000-current-segments'
+                           u'-3-2017-01-01-4'),
+            u'current-segments')
+        self.assertEqual(get_key_family(u'company-1-shareholder-roles'),
+                         u'shareholder-roles')
+        self.assertEqual(
+            get_key_family(u'shareholder_share_count_1_2017-01-01_None'),
+            u'shareholder-share-count')
+        self.assertEqual(get_key_family(u'1234'), u'other')
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('company-1-foo'))
+        self.cache.set('company-1-foo', {'a': 1})
+        self.assertEqual(self.cache.get('company-1-foo'), {'a': 1})
+
+        # remote tier
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get('company-1-foo'), {'a': 1})
+        self.assertEqual(self.cache.get_stats(), {
+            'foo': {'misses': 1, 'local_hits': 1, 'hits': 1}})
+
+        self.cache.delete('company-1-foo')
+        self.assertIsNone(self.cache.get('company-1-foo'))
+
+    def test_local_lru(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.set(key, key)
+        self.backend.clear()
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 'b')
+        self.assertEqual(self.cache.get('c'), 'c')
+
+    def test_large_values(self):
+        value = [unicode(i) for i in range(1000)]
+        self.cache.set('company-1-large', value)
+        self.cache.clear_local()
+
+        self.assertGreater(len(self.backend._cache), 2)
+        self.assertEqual(self.cache.get('company-1-large'), value)
+
+        # missing chunk
+        key = [k for k in self.backend._cache.keys() if 'chunk' in k][0]
+        self.backend._cache.pop(key)
+        self.cache.clear_local()
+        self.assertIsNone(self.cache.get('company-1-large'))
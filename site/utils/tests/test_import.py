@@ -1,9 +1,13 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import csv
 import datetime
 import logging
+import os
+import tempfile
 
+import mock
 from dateutil.parser import parse
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
@@ -11,7 +15,8 @@ from django.core.management import call_command
 from django.test import TestCase
 
 from project.generators import CompanyGenerator, ShareholderGenerator
-from shareholder.models import Position, Shareholder
+from shareholder.models import (ImportRun, NumberAllocator, Position,
+                                Shareholder)
 from utils.import_backends import SisWareImportBackend, SECURITIES
 
 logger = logging.getLogger(__name__)
@@ -43,6 +48,11 @@ class CommandTestCase(ImportTestCaseMixin, TestCase):
         call_command('import', str(self.company.pk), self.filename)
         self.assertImport()
 
+    def test_import_bulk(self):
+        call_command('import', str(self.company.pk), self.filename,
+                     bulk=True)
+        self.assertImport()
+
 
 class SisWareImportBackendTestCase(ImportTestCaseMixin, TestCase):
 
@@ -139,6 +149,115 @@ class SisWareImportBackendTestCase(ImportTestCaseMixin, TestCase):
         tshareholder = self.company.get_transfer_shareholder()
         self.assertEqual(tshareholder.share_count(), 0)
 
+    def test_import_bulk_repeated(self):
+        """
+        bulk import creates the same data as the regular one, also when
+        repeated
+        """
+        self.backend.import_from_file(str(self.company.pk), bulk=True)
+        self.assertImport()
+        # bulk inserts skip post_save, numbers are registered by the import
+        allocator = NumberAllocator.objects.get(company=self.company)
+        numbers = (allocator.certificate_id, allocator.shareholder_number)
+        allocator.rebuild()
+        self.assertEqual(
+            (allocator.certificate_id, allocator.shareholder_number), numbers)
+        counts = (User.objects.count(), Shareholder.objects.count(),
+                  Position.objects.count())
+        self.assertEqual(self.backend.row_count + 3,
+                         self.backend.transfer_shareholder.seller.count())
+
+        self.backend.import_from_file(str(self.company.pk), bulk=True)
+        self.assertImport()
+        self.assertEqual((User.objects.count(), Shareholder.objects.count(),
+                          Position.objects.count()), counts)
+
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.share_count, 17439)
+        self.assertEqual(Position.objects.filter(depot_type='0').count(), 8)
+        self.assertFalse(self.company.shareholder_set.filter(
+            mailing_type__isnull=True).exists())
+        for shareholder in self.company.shareholder_set.all():
+            self.assertTrue(shareholder.user.userprofile)
+            self.assertTrue(shareholder.user.auth_token)
+        tshareholder = self.company.get_transfer_shareholder()
+        self.assertEqual(tshareholder.share_count(), 0)
+
+    @mock.patch('utils.import_backends.IMPORT_BATCH_SIZE', 5)
+    def test_import_bulk_batches(self):
+        """ lookup maps are loaded once per run and shared by all batches """
+        get_bulk_lookups = self.backend._get_bulk_lookups
+        with mock.patch.object(self.backend, '_get_bulk_lookups',
+                               side_effect=get_bulk_lookups) as lookups:
+            self.backend.import_from_file(str(self.company.pk), bulk=True)
+        self.assertEqual(lookups.call_count, 1)
+        self.assertImport()
+        self.assertEqual(self.backend.row_count + 3,
+                         self.backend.transfer_shareholder.seller.count())
+
+    @mock.patch('utils.import_backends.IMPORT_BATCH_SIZE', 5)
+    def test_import_resume(self):
+        """ failed import continues at the last checkpoint """
+        import_row = self.backend._import_row
+        calls = []
+
+        def _import_row(row):
+            calls.append(row)
+            if len(calls) == 8:
+                raise ValueError('broken row')
+            return import_row(row)
+
+        with mock.patch.object(self.backend, '_import_row',
+                               side_effect=_import_row):
+            with self.assertRaises(ValueError):
+                self.backend.import_from_file(str(self.company.pk))
+
+        run = ImportRun.objects.get(company=self.company)
+        self.assertEqual(run.status, ImportRun.STATUS_FAILED)
+        self.assertEqual(run.offset, 5)
+        self.assertEqual(run.error, 'broken row')
+
+        progress = mock.Mock()
+        self.backend.import_from_file(str(self.company.pk), run=run,
+                                      progress=progress)
+        run.refresh_from_db()
+        self.assertEqual(run.status, ImportRun.STATUS_FINISHED)
+        self.assertEqual(run.offset, run.row_count)
+        self.assertEqual(run.start_offset, 5)
+        self.assertEqual(progress.call_count, 3)  # 14 rows left
+        self.assertEqual(run.get_eta(), datetime.timedelta(0))
+        self.assertImport()
+        self.assertEqual(self.backend.row_count + 3,
+                         self.backend.transfer_shareholder.seller.count())
+
+    def test_validate(self):
+        """ all invalid rows are reported with their line number """
+        with open(self.filename) as f:
+            rows = list(csv.reader(f, delimiter=';', dialect=csv.excel))
+        rows[2][17] = 'Atlantis'
+        rows[5][22] = 'Atlantis'
+        rows[6][20] = 'Klingon'
+
+        fd, filename = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                csv.writer(f, delimiter=';', dialect=csv.excel).writerows(
+                    rows)
+            with self.assertRaises(ValueError) as cm:
+                SisWareImportBackend(filename)
+        finally:
+            os.remove(filename)
+
+        msg = unicode(cm.exception)
+        self.assertIn(u'line 3: cannot map country "Atlantis"', msg)
+        self.assertIn(u'line 6: cannot map nationality "Atlantis"', msg)
+        self.assertIn(u'line 7: cannot map language "Klingon"', msg)
+
+    def test_find_row(self):
+        row = self.backend._find_row(column=0, needle=1913)
+        self.assertEqual(row[0], u'1913')
+        self.assertEqual(self.backend._find_row(column=0, needle=1), None)
+
     def test_get_or_create_user(self):
         self.backend.company = CompanyGenerator().generate()
         kwargs = dict(shareholder_id='1', first_name='first name',
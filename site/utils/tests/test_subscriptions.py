@@ -8,8 +8,8 @@ from django.utils.translation import ugettext as _
 
 import mock
 
-from project.generators import (CompanyGenerator, ShareholderGenerator,
-                                SecurityGenerator)
+from project.generators import (CompanyGenerator, PositionGenerator,
+                                SecurityGenerator, ShareholderGenerator)
 from project.tests.mixins import StripeTestCaseMixin
 
 from ..subscriptions import (stripe_subscriber_request_callback,
@@ -49,24 +49,33 @@ class SubsciptionUtilsTestCase(StripeTestCaseMixin, TestCase):
             mock_invoice_item_create.assert_not_called()
 
             shareholder_generator = ShareholderGenerator()
-            shareholder_generator.generate(company=self.company)
-            shareholder_generator.generate(company=self.company, number='0')
+            shareholder = shareholder_generator.generate(company=self.company)
+            company_shareholder = shareholder_generator.generate(
+                company=self.company, number='0')
 
             # shareholder have no shares
             stripe_company_shareholder_invoice_item(customer, 'test', None)
             mock_invoice_item_create.assert_not_called()
 
-            with mock.patch('shareholder.models.Shareholder.share_count',
-                            return_value=10):
-                stripe_company_shareholder_invoice_item(customer, 'test', None)
-                mock_invoice_item_create.assert_called()
-                mock_invoice_item_create.assert_called_with(
-                    customer=customer.stripe_id,
-                    amount=10,
-                    currency=settings.DJSTRIPE_CURRENCIES[0][0],
-                    invoice=None,
-                    description=_(u'Shareholders (1 x 0.10)')
-                )
+            security = SecurityGenerator().generate(company=self.company)
+            PositionGenerator().generate(
+                buyer=company_shareholder, seller=None, count=10,
+                security=security)
+            PositionGenerator().generate(
+                buyer=shareholder, seller=company_shareholder, count=10,
+                security=security)
+            # company shareholder is not billed
+            self.assertEqual(self.company.get_active_shareholder_count(), 1)
+
+            stripe_company_shareholder_invoice_item(customer, 'test', None)
+            mock_invoice_item_create.assert_called()
+            mock_invoice_item_create.assert_called_with(
+                customer=customer.stripe_id,
+                amount=10,
+                currency=settings.DJSTRIPE_CURRENCIES[0][0],
+                invoice=None,
+                description=_(u'Shareholders (1 x 0.10)')
+            )
 
     @mock.patch('stripe.InvoiceItem.create')
     def test_stripe_company_security_invoice_item(self,
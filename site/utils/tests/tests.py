@@ -12,7 +12,9 @@ from utils import get_vat
 from utils.formatters import (deflate_segments, flatten_list, inflate_segments,
                               string_list_to_json)
 from utils.http import url_with_domain
-from utils.math import substract_list
+from utils.math import (intervals_overlap, intervals_to_segments,
+                        segments_to_intervals, substract_intervals,
+                        substract_list)
 from utils.user import make_username
 
 logger = logging.getLogger(__name__)
@@ -147,6 +149,36 @@ class UtilsTestCase(TestCase):
 
         self.assertEqual(res, [])
 
+    def test_segments_to_intervals(self):
+        intervals = segments_to_intervals(
+            [1000, u'1-3', 4, u'10-20', 15, 1666, u'21-22'])
+        self.assertEqual(intervals, [(1, 4), (10, 22), (1000, 1000),
+                                     (1666, 1666)])
+        self.assertEqual(intervals_to_segments(intervals),
+                         [u'1-4', u'10-22', 1000, 1666])
+        self.assertEqual(segments_to_intervals([]), [])
+
+    def test_substract_intervals(self):
+        self.assertEqual(
+            substract_intervals([(1, 100)], [(5, 10), (20, 30), (90, 200)]),
+            [(1, 4), (11, 19), (31, 89)])
+        self.assertEqual(substract_intervals([(1, 3), (5, 8)], [(2, 6)]),
+                         [(1, 1), (7, 8)])
+        self.assertEqual(substract_intervals([(5, 8)], [(1, 10)]), [])
+
+        # 100k numbers are handled without inflating
+        t0 = time.clock()
+        res = substract_intervals(segments_to_intervals([u'1-100000']),
+                                  segments_to_intervals([u'0-10000000']))
+        self.assertEqual(res, [])
+        self.assertLess(time.clock() - t0, 0.1)
+
+    def test_intervals_overlap(self):
+        self.assertFalse(intervals_overlap([(1, 3)], [(4, 5)]))
+        self.assertTrue(intervals_overlap([(1, 3), (10, 12)],
+                                          [(4, 5), (12, 20)]))
+        self.assertFalse(intervals_overlap([], [(1, 2)]))
+
     def test_get_vat(self):
         amount = abs(random_gen.gen_integer())
         vat = get_vat(amount)